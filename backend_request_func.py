@@ -1,15 +1,18 @@
 # SPDX-License-Identifier: Apache-2.0
 
-import json
 import os
 import sys
 import time
 import traceback
-from dataclasses import dataclass, field
+from array import array
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import Optional, Union
 
 import aiohttp
 import huggingface_hub.constants
+import numpy as np
 from tqdm.asyncio import tqdm
 from transformers import (AutoTokenizer, PreTrainedTokenizer,
                           PreTrainedTokenizerFast)
@@ -17,12 +20,32 @@ from transformers import (AutoTokenizer, PreTrainedTokenizer,
 # NOTE(simon): do not import vLLM here so the benchmark script
 # can run without vLLM installed.
 
+try:
+    # orjson decodes bytes directly and is several times faster than the
+    # standard library, which matters for per-token SSE events.
+    from orjson import loads as json_loads
+except ImportError:
+    import json
+
+    def json_loads(data: bytes):
+        # The standard decoder is faster on str than on bytes, which it
+        # would otherwise have to sniff for an encoding first.
+        return json.loads(data.decode("utf-8"))
+
 AIOHTTP_TIMEOUT = aiohttp.ClientTimeout(total=6 * 60 * 60)
 
+# Connector defaults for the shared benchmark session. A limit of 0 means the
+# pool is unbounded so that --max-concurrency stays the only concurrency cap.
+DEFAULT_CONN_LIMIT = 0
+DEFAULT_CONN_LIMIT_PER_HOST = 0
+DEFAULT_KEEPALIVE_TIMEOUT = 60.0
+DEFAULT_DNS_CACHE_TTL = 10
+
 
 @dataclass
 class RequestFuncInput:
-    prompt: str
+    # Text, or a list of token IDs for the OpenAI Completions API.
+    prompt: Union[str, list[int]]
     api_url: str
     prompt_len: int
     output_len: int
@@ -32,31 +55,228 @@ class RequestFuncInput:
     extra_body: Optional[dict] = None
     multi_modal_content: Optional[dict] = None
     ignore_eos: bool = False
+    # Do not accumulate the generated text, only its timings.
+    discard_text: bool = False
 
 
-@dataclass
 class RequestFuncOutput:
-    generated_text: str = ""
-    success: bool = False
-    latency: float = 0.0
-    output_tokens: int = 0
-    ttft: float = 0.0  # Time to first token
-    itl: list[float] = field(
-        default_factory=list)  # list of inter-token latencies
-    tpot: float = 0.0  # avg next-token latencies
-    prompt_len: int = 0
-    error: str = ""
+    """
+    Outcome and client-side timings of a single request.
+
+    One of these is created per request, so it is a ``__slots__`` class
+    rather than a dataclass. Inter-token latencies are written into an
+    ``array('d')`` preallocated from the requested output length instead of
+    being appended to a list of Python floats.
+    """
+
+    __slots__ = ("generated_text", "success", "latency", "output_tokens",
+                 "ttft", "_itl", "num_itl", "tpot", "prompt_len", "error",
+                 "connect_time", "pool_wait", "scheduled_time",
+                 "dispatch_time", "start_time")
+
+    def __init__(self, output_len: int = 0) -> None:
+        self.generated_text = ""
+        self.success = False
+        self.latency = 0.0
+        # None unless the backend reports the number of output tokens.
+        self.output_tokens: Optional[int] = None
+        self.ttft = 0.0  # Time to first token
+        # Inter-token latencies; the first token of a request has none.
+        self._itl = array("d", bytes(8 * max(output_len - 1, 0)))
+        self.num_itl = 0
+        self.tpot = 0.0  # avg next-token latencies
+        self.prompt_len = 0
+        self.error = ""
+        # Time spent opening a new TCP/TLS connection (0 if one was reused)
+        self.connect_time = 0.0
+        # Time spent waiting for a free connection in the session pool
+        self.pool_wait = 0.0
+        # perf_counter() deadline from the arrival schedule, and the time the
+        # request was actually released by the dispatcher.
+        self.scheduled_time = 0.0
+        self.dispatch_time = 0.0
+        # perf_counter() when the request was actually sent, after any wait
+        # on the client-side concurrency limit. ttft and latency are
+        # relative to it.
+        self.start_time = 0.0
+
+    def add_itl(self, value: float) -> None:
+        if self.num_itl < len(self._itl):
+            self._itl[self.num_itl] = value
+        else:
+            # The server sent more chunks than tokens were requested.
+            self._itl.append(value)
+        self.num_itl += 1
+
+    @property
+    def itl(self) -> np.ndarray:
+        """The inter-token latencies, as a view of the preallocated buffer."""
+        return np.frombuffer(self._itl, dtype=np.float64, count=self.num_itl)
+
+
+async def _on_connection_queued_start(session, trace_config_ctx, params):
+    trace_config_ctx.queued_start = time.perf_counter()
+
+
+async def _on_connection_queued_end(session, trace_config_ctx, params):
+    output = trace_config_ctx.trace_request_ctx
+    if output is not None:
+        output.pool_wait += time.perf_counter() - trace_config_ctx.queued_start
+
+
+async def _on_connection_create_start(session, trace_config_ctx, params):
+    trace_config_ctx.create_start = time.perf_counter()
+
+
+async def _on_connection_create_end(session, trace_config_ctx, params):
+    output = trace_config_ctx.trace_request_ctx
+    if output is not None:
+        output.connect_time += (time.perf_counter() -
+                                trace_config_ctx.create_start)
+
+
+def create_client_session(
+    limit: int = DEFAULT_CONN_LIMIT,
+    limit_per_host: int = DEFAULT_CONN_LIMIT_PER_HOST,
+    keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+    dns_cache_ttl: int = DEFAULT_DNS_CACHE_TTL,
+) -> aiohttp.ClientSession:
+    """
+    Create a client session whose connections are pooled across requests.
+
+    Connection setup and pool waits are traced into the RequestFuncOutput
+    passed as ``trace_request_ctx``, so that the time the harness spends
+    establishing connections can be reported separately from TTFT.
+    Must be called from within a running event loop.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(_on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(_on_connection_queued_end)
+    trace_config.on_connection_create_start.append(
+        _on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+
+    # aiohttp does not allow a keep-alive timeout together with force_close.
+    force_close = keepalive_timeout <= 0
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=None if force_close else keepalive_timeout,
+        force_close=force_close,
+        use_dns_cache=dns_cache_ttl > 0,
+        ttl_dns_cache=dns_cache_ttl if dns_cache_ttl > 0 else None,
+    )
+    return aiohttp.ClientSession(connector=connector,
+                                 trust_env=True,
+                                 timeout=AIOHTTP_TIMEOUT,
+                                 trace_configs=[trace_config])
+
+
+SSE_DONE = b"[DONE]"
+
+
+class SSEDecoder:
+    """
+    Incremental decoder for ``text/event-stream`` response bodies.
+
+    Raw chunks (``bytes`` or ``memoryview``) are fed as they arrive from the
+    socket, regardless of where the network split them. ``feed`` returns the
+    ``data`` payload of every event completed by the chunk, as ``bytes``.
+    Multi-line events are joined with ``\n``; comments such as ``:`` pings
+    and non-data fields (``event:``, ``id:``, ``retry:``) are dropped.
+
+    Payloads are left undecoded so that callers can take the token timestamp
+    before paying for the JSON decode.
+    """
+
+    __slots__ = ("_tail", )
+
+    def __init__(self) -> None:
+        # Bytes of the event that is not yet terminated by a blank line.
+        self._tail = b""
+
+    def feed(self, chunk: Union[bytes, memoryview]) -> list[bytes]:
+        if self._tail:
+            chunk = self._tail + chunk
+        elif not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        elif (chunk.startswith(b"data:") and chunk.endswith(b"\n\n")
+              and chunk.find(b"\n") == len(chunk) - 2):
+            # Fastest path: the chunk is exactly one single-line event.
+            return [chunk[6:-2] if chunk[5:6] == b" " else chunk[5:-2]]
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n")
+        blocks = chunk.split(b"\n\n")
+        self._tail = blocks.pop()
+        events: list[bytes] = []
+        for block in blocks:
+            if block[:5] == b"data:" and b"\n" not in block:
+                # Fast path: a single-line data event.
+                events.append(block[6:] if block[5:6] == b" " else block[5:])
+            elif block:
+                self._decode_block(block, events)
+        return events
+
+    def flush(self) -> list[bytes]:
+        """Return the last event if the stream ended without a blank line."""
+        events: list[bytes] = []
+        if self._tail:
+            self._decode_block(self._tail, events)
+            self._tail = b""
+        return events
+
+    @staticmethod
+    def _decode_block(block: bytes, events: list[bytes]) -> None:
+        data = [
+            line[6:] if line[5:6] == b" " else line[5:]
+            for line in block.split(b"\n") if line[:5] == b"data:"
+        ]
+        if data:
+            events.append(b"\n".join(data))
+
+
+async def iter_sse_events(
+    content: aiohttp.StreamReader
+) -> AsyncGenerator[tuple[float, list[bytes]], None]:
+    """
+    Yield ``(timestamp, payloads)`` for each network chunk of an SSE body.
+
+    The timestamp is taken as soon as the chunk is read from the socket, so
+    every event it completes is attributed to its arrival time rather than to
+    the moment its JSON was decoded.
+    """
+    decoder = SSEDecoder()
+    timestamp = time.perf_counter()
+    async for chunk in content.iter_any():
+        timestamp = time.perf_counter()
+        events = decoder.feed(chunk)
+        if events:
+            yield timestamp, events
+    events = decoder.flush()
+    if events:
+        yield timestamp, events
+
+
+@asynccontextmanager
+async def _maybe_session(session: Optional[aiohttp.ClientSession]):
+    # Reuse the caller's pooled session, or fall back to a private one so
+    # that the request functions can still be called standalone.
+    if session is not None:
+        yield session
+        return
+    async with create_client_session() as own_session:
+        yield own_session
 
 
 async def async_request_tgi(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith("generate_stream")
 
-    async with aiohttp.ClientSession(trust_env=True,
-                                     timeout=AIOHTTP_TIMEOUT) as session:
+    async with _maybe_session(session) as session:
         params = {
             "max_new_tokens": request_func_input.output_len,
             "do_sample": True,
@@ -69,48 +289,45 @@ async def async_request_tgi(
             "inputs": request_func_input.prompt,
             "parameters": params,
         }
-        output = RequestFuncOutput()
+        output = RequestFuncOutput(request_func_input.output_len)
         output.prompt_len = request_func_input.prompt_len
         if request_func_input.ignore_eos:
             output.output_tokens = request_func_input.output_len
-        else:
-            output.output_tokens = None
 
         ttft = 0.0
         st = time.perf_counter()
+        output.start_time = st
         most_recent_timestamp = st
         try:
-            async with session.post(url=api_url, json=payload) as response:
+            async with session.post(url=api_url,
+                                    json=payload,
+                                    trace_request_ctx=output) as response:
                 if response.status == 200:
-                    async for chunk_bytes in response.content:
-                        chunk_bytes = chunk_bytes.strip()
-                        if not chunk_bytes:
-                            continue
-                        chunk_bytes = chunk_bytes.decode("utf-8")
-
-                        # NOTE: Sometimes TGI returns a ping response without
-                        # any data, we should skip it.
-                        if chunk_bytes.startswith(":"):
-                            continue
-                        chunk = chunk_bytes.removeprefix("data:")
-
-                        data = json.loads(chunk)
-                        timestamp = time.perf_counter()
-                        # First token
-                        if ttft == 0.0:
-                            ttft = time.perf_counter() - st
-                            output.ttft = ttft
-
-                        # Decoding phase
-                        else:
-                            output.itl.append(timestamp -
-                                              most_recent_timestamp)
-
-                        most_recent_timestamp = timestamp
+                    # NOTE: Sometimes TGI returns a ping response without
+                    # any data, the SSE decoder skips those.
+                    async for timestamp, events in iter_sse_events(
+                            response.content):
+                        for event in events:
+                            # First token
+                            if ttft == 0.0:
+                                ttft = timestamp - st
+                                output.ttft = ttft
+
+                            # Decoding phase
+                            else:
+                                output.add_itl(timestamp -
+                                               most_recent_timestamp)
+
+                            most_recent_timestamp = timestamp
+                            last_event = event
 
+                    # Only the final event carries the generated text, so
+                    # the JSON decode is kept out of the streaming loop.
                     output.latency = most_recent_timestamp - st
                     output.success = True
-                    output.generated_text = data["generated_text"]
+                    if not request_func_input.discard_text:
+                        output.generated_text = json_loads(
+                            last_event)["generated_text"]
                 else:
                     output.error = response.reason or ""
                     output.success = False
@@ -127,12 +344,12 @@ async def async_request_tgi(
 async def async_request_trt_llm(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith("generate_stream")
 
-    async with aiohttp.ClientSession(trust_env=True,
-                                     timeout=AIOHTTP_TIMEOUT) as session:
+    async with _maybe_session(session) as session:
         payload = {
             "accumulate_tokens": True,
             "text_input": request_func_input.prompt,
@@ -143,37 +360,35 @@ async def async_request_trt_llm(
         }
         if request_func_input.ignore_eos:
             payload["min_length"] = request_func_input.output_len
-        output = RequestFuncOutput()
+        output = RequestFuncOutput(request_func_input.output_len)
         output.prompt_len = request_func_input.prompt_len
 
         ttft = 0.0
         st = time.perf_counter()
+        output.start_time = st
         most_recent_timestamp = st
         try:
-            async with session.post(url=api_url, json=payload) as response:
+            async with session.post(url=api_url,
+                                    json=payload,
+                                    trace_request_ctx=output) as response:
                 if response.status == 200:
-                    async for chunk_bytes in response.content:
-                        chunk_bytes = chunk_bytes.strip()
-                        if not chunk_bytes:
-                            continue
+                    async for timestamp, events in iter_sse_events(
+                            response.content):
+                        for event in events:
+                            if not request_func_input.discard_text:
+                                output.generated_text += json_loads(
+                                    event)["text_output"]
+                            # First token
+                            if ttft == 0.0:
+                                ttft = timestamp - st
+                                output.ttft = ttft
+
+                            # Decoding phase
+                            else:
+                                output.add_itl(timestamp -
+                                               most_recent_timestamp)
 
-                        chunk = chunk_bytes.decode("utf-8").removeprefix(
-                            "data:")
-
-                        data = json.loads(chunk)
-                        output.generated_text += data["text_output"]
-                        timestamp = time.perf_counter()
-                        # First token
-                        if ttft == 0.0:
-                            ttft = timestamp - st
-                            output.ttft = ttft
-
-                        # Decoding phase
-                        else:
-                            output.itl.append(timestamp -
-                                              most_recent_timestamp)
-
-                        most_recent_timestamp = timestamp
+                            most_recent_timestamp = timestamp
 
                     output.latency = most_recent_timestamp - st
                     output.success = True
@@ -194,9 +409,9 @@ async def async_request_trt_llm(
 async def async_request_deepspeed_mii(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
-    async with aiohttp.ClientSession(trust_env=True,
-                                     timeout=AIOHTTP_TIMEOUT) as session:
+    async with _maybe_session(session) as session:
 
         payload = {
             "prompt": request_func_input.prompt,
@@ -204,7 +419,7 @@ async def async_request_deepspeed_mii(
             "temperature": 0.01,  # deepspeed-mii does not accept 0.0 temp.
             "top_p": 1.0,
         }
-        output = RequestFuncOutput()
+        output = RequestFuncOutput(request_func_input.output_len)
         output.prompt_len = request_func_input.prompt_len
 
         # NOTE: DeepSpeed-MII doesn't support streaming as of Jan 28 2024,
@@ -213,13 +428,16 @@ async def async_request_deepspeed_mii(
         output.ttft = 0
 
         st = time.perf_counter()
+        output.start_time = st
         try:
             async with session.post(url=request_func_input.api_url,
-                                    json=payload) as response:
+                                    json=payload,
+                                    trace_request_ctx=output) as response:
                 if response.status == 200:
-                    parsed_resp = await response.json()
+                    parsed_resp = json_loads(await response.read())
                     output.latency = time.perf_counter() - st
-                    output.generated_text = parsed_resp["text"][0]
+                    if not request_func_input.discard_text:
+                        output.generated_text = parsed_resp["text"][0]
                     output.success = True
                 else:
                     output.error = response.reason or ""
@@ -237,14 +455,14 @@ async def async_request_deepspeed_mii(
 async def async_request_openai_completions(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith(
         ("completions", "profile")
     ), "OpenAI Completions API URL must end with 'completions' or 'profile'."
 
-    async with aiohttp.ClientSession(trust_env=True,
-                                     timeout=AIOHTTP_TIMEOUT) as session:
+    async with _maybe_session(session) as session:
         payload = {
             "model": request_func_input.model_name \
                 if request_func_input.model_name else request_func_input.model,
@@ -265,26 +483,26 @@ async def async_request_openai_completions(
             "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"
         }
 
-        output = RequestFuncOutput()
+        output = RequestFuncOutput(request_func_input.output_len)
         output.prompt_len = request_func_input.prompt_len
 
         generated_text = ""
         st = time.perf_counter()
+        output.start_time = st
         most_recent_timestamp = st
         try:
-            async with session.post(url=api_url, json=payload,
-                                    headers=headers) as response:
+            async with session.post(url=api_url,
+                                    json=payload,
+                                    headers=headers,
+                                    trace_request_ctx=output) as response:
                 if response.status == 200:
                     first_chunk_received = False
-                    async for chunk_bytes in response.content:
-                        chunk_bytes = chunk_bytes.strip()
-                        if not chunk_bytes:
-                            continue
-
-                        chunk = chunk_bytes.decode("utf-8").removeprefix(
-                            "data: ")
-                        if chunk != "[DONE]":
-                            data = json.loads(chunk)
+                    async for timestamp, events in iter_sse_events(
+                            response.content):
+                        for event in events:
+                            if event == SSE_DONE:
+                                continue
+                            data = json_loads(event)
 
                             # NOTE: Some completion API might have a last
                             # usage summary response without a token so we
@@ -293,20 +511,20 @@ async def async_request_openai_completions(
                                 # Note that text could be empty here
                                 # e.g. for special tokens
                                 text = choices[0].get("text")
-                                timestamp = time.perf_counter()
                                 # First token
                                 if not first_chunk_received:
                                     first_chunk_received = True
-                                    ttft = time.perf_counter() - st
+                                    ttft = timestamp - st
                                     output.ttft = ttft
 
                                 # Decoding phase
                                 else:
-                                    output.itl.append(timestamp -
-                                                      most_recent_timestamp)
+                                    output.add_itl(timestamp -
+                                                   most_recent_timestamp)
 
                                 most_recent_timestamp = timestamp
-                                generated_text += text or ""
+                                if not request_func_input.discard_text:
+                                    generated_text += text or ""
                             elif usage := data.get("usage"):
                                 output.output_tokens = usage.get(
                                     "completion_tokens")
@@ -335,14 +553,14 @@ async def async_request_openai_completions(
 async def async_request_openai_chat_completions(
     request_func_input: RequestFuncInput,
     pbar: Optional[tqdm] = None,
+    session: Optional[aiohttp.ClientSession] = None,
 ) -> RequestFuncOutput:
     api_url = request_func_input.api_url
     assert api_url.endswith(
         ("chat/completions", "profile")
     ), "OpenAI Chat Completions API URL must end with 'chat/completions'."
 
-    async with aiohttp.ClientSession(trust_env=True,
-                                     timeout=AIOHTTP_TIMEOUT) as session:
+    async with _maybe_session(session) as session:
         # 构造 content 字段
         content = request_func_input.prompt  # 直接使用纯文本内容
         if request_func_input.multi_modal_content:
@@ -377,28 +595,27 @@ async def async_request_openai_chat_completions(
         }
 
         # 初始化输出对象
-        output = RequestFuncOutput()
+        output = RequestFuncOutput(request_func_input.output_len)
         output.prompt_len = request_func_input.prompt_len
 
         generated_text = ""
         ttft = 0.0
         st = time.perf_counter()
+        output.start_time = st
         most_recent_timestamp = st
 
         try:
-            async with session.post(url=api_url, json=payload,
-                                    headers=headers) as response:
+            async with session.post(url=api_url,
+                                    json=payload,
+                                    headers=headers,
+                                    trace_request_ctx=output) as response:
                 if response.status == 200:
-                    async for chunk_bytes in response.content:
-                        chunk_bytes = chunk_bytes.strip()
-                        if not chunk_bytes:
-                            continue
-
-                        chunk = chunk_bytes.decode("utf-8").removeprefix(
-                            "data: ")
-                        if chunk != "[DONE]":
-                            timestamp = time.perf_counter()
-                            data = json.loads(chunk)
+                    async for timestamp, events in iter_sse_events(
+                            response.content):
+                        for event in events:
+                            if event == SSE_DONE:
+                                continue
+                            data = json_loads(event)
 
                             if choices := data.get("choices"):
                                 delta = choices[0]["delta"]
@@ -411,10 +628,11 @@ async def async_request_openai_chat_completions(
 
                                 # Decoding phase
                                 elif content:
-                                    output.itl.append(timestamp -
-                                                      most_recent_timestamp)
+                                    output.add_itl(timestamp -
+                                                   most_recent_timestamp)
 
-                                generated_text += content
+                                if not request_func_input.discard_text:
+                                    generated_text += content
 
                             elif usage := data.get("usage"):
                                 output.output_tokens = usage.get(
@@ -7,25 +7,40 @@ generation. Supported dataset types include:
   - Random (synthetic)
   - Sonnet
   - BurstGPT
-  - HuggingFace
-  - VisionArena
+  - Trace (replay of a recorded request trace)
+  - HuggingFace (datasets with a "conversations" column)
+
+The file-based datasets are streamed: JSON files are parsed incrementally and
+candidate prompts are tokenized in batches, optionally across a process pool,
+until enough of them are valid, so a dataset is never loaded or tokenized as
+a whole.
 
 TODO: Implement CustomDataset to parse a JSON file and convert its contents into
 SampleRequest instances, similar to the approach used in ShareGPT.
 """
 
+import asyncio
 import base64
+import codecs
+import collections
 import io
+import itertools
 import json
 import logging
+import mmap
+import multiprocessing
+import queue
 import random
+import threading
 from abc import ABC, abstractmethod
-from collections.abc import Mapping
+from collections.abc import Iterable, Iterator, Mapping
 from dataclasses import dataclass
 from io import BytesIO
-from typing import Any, Optional, Union
+from typing import Any, Callable, Optional, Union
 
 import numpy as np
+import pandas as pd
+from datasets import load_dataset
 from PIL import Image
 from transformers import PreTrainedTokenizerBase
 from transformers import (PreTrainedTokenizer,
@@ -147,11 +162,27 @@ class BenchmarkDataset(ABC):
         """
         raise NotImplementedError("sample must be implemented in subclasses.")
 
+    def iter_samples(self, tokenizer: PreTrainedTokenizerBase,
+                     num_requests: int, **kwargs) -> Iterator[SampleRequest]:
+        """
+        Return an iterator that produces the sample requests on demand.
+
+        Takes the same arguments as `sample` and yields the same requests.
+        The default implementation samples the whole list up front;
+        subclasses override it to build each request only when it is
+        consumed. Any random draws are made before this method returns, so
+        the stream does not depend on when or from which thread it is read.
+        """
+        return iter(
+            self.sample(tokenizer=tokenizer,
+                        num_requests=num_requests,
+                        **kwargs))
+
     def maybe_oversample_requests(self, requests: list[SampleRequest],
                                   num_requests: int) -> None:
         """
         Oversamples the list of requests if its size is less than the desired
-        number.
+        number. See `maybe_oversample_stream` for the streaming version.
 
         Args:
             requests (List[SampleRequest]): The current list of sampled
@@ -165,6 +196,46 @@ class BenchmarkDataset(ABC):
             logger.info("Oversampled requests to reach %d total samples.",
                         num_requests)
 
+    def maybe_oversample_stream(
+        self,
+        make_stream: Callable[[], Iterator[SampleRequest]],
+        num_requests: int,
+    ) -> Iterator[SampleRequest]:
+        """
+        Streaming counterpart of `maybe_oversample_requests`.
+
+        Yields the requests of `make_stream()` and then, if there were fewer
+        than `num_requests`, the same extra samples that
+        `maybe_oversample_requests` would append to the list. The extra
+        samples are picked by position and collected from a second pass over
+        a fresh stream, so only the distinct picked requests are held in
+        memory rather than the whole dataset.
+
+        Args:
+            make_stream (Callable): Returns a new iterator over the sampled
+            requests. It must produce the same sequence on every call.
+            num_requests (int): The target number of requests.
+        """
+        count = 0
+        for request in make_stream():
+            count += 1
+            yield request
+        if count >= num_requests:
+            return
+        # A private generator keeps the picks independent of other users of
+        # the global one, which may run concurrently with the stream.
+        picks = random.Random(self.random_seed).choices(range(count),
+                                                        k=num_requests - count)
+        wanted = set(picks)
+        picked = {
+            index: request
+            for index, request in enumerate(make_stream()) if index in wanted
+        }
+        for index in picks:
+            yield picked[index]
+        logger.info("Oversampled requests to reach %d total samples.",
+                    num_requests)
+
 
 # -----------------------------------------------------------------------------
 # Utility Functions and Global Caches
@@ -198,6 +269,193 @@ def is_valid_sequence(
                 or combined_too_long)
 
 
+# Size of the chunks read by `iter_json_array`.
+JSON_READ_CHUNK_SIZE = 1 << 20
+_JSON_SEPARATORS = " \t\r\n,"
+# Characters that can continue a JSON number.
+_JSON_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def iter_json_array(
+        path: str,
+        chunk_size: int = JSON_READ_CHUNK_SIZE) -> Iterator[tuple[Any, int, int]]:
+    """
+    Parse a file holding a JSON array one element at a time.
+
+    Yields ``(element, start, end)`` where ``start:end`` is the byte range of
+    the element in the file, so that it can be parsed again later with
+    `read_json_range` without scanning the file. The file is read in chunks
+    of `chunk_size` bytes and only the element being parsed is kept in
+    memory, whatever the size of the file.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        buf = ""
+        pos = 0
+        # Byte offset in the file of buf[pos].
+        offset = 0
+        eof = False
+
+        def fill(grow: bool = False) -> bool:
+            nonlocal buf, pos, eof
+            if eof:
+                return False
+            # An element that is still incomplete at least doubles the
+            # buffer, so it is parsed a logarithmic number of times.
+            chunk = f.read(
+                max(chunk_size, len(buf) - pos) if grow else chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+            return True
+
+        def skip(chars: str) -> None:
+            nonlocal pos, offset
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    # Separators are ASCII, one byte each.
+                    pos += 1
+                    offset += 1
+                if pos < len(buf) or not fill():
+                    return
+
+        skip(_JSON_SEPARATORS)
+        if buf[pos:pos + 1] != "[":
+            raise ValueError(f"{path} does not hold a JSON array.")
+        pos += 1
+        offset += 1
+        while True:
+            skip(_JSON_SEPARATORS)
+            if pos == len(buf):
+                raise ValueError(f"Unterminated JSON array in {path}.")
+            if buf[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Most likely the element continues in the next chunk.
+                if fill(grow=True):
+                    continue
+                raise
+            if ((end == len(buf) or buf[end] in _JSON_NUMBER_CHARS)
+                    and not buf[end:].lstrip(_JSON_NUMBER_CHARS)
+                    and fill(grow=True)):
+                # A number cut at the end of the chunk, e.g. after "2." or
+                # "1e", may continue in the next one.
+                continue
+            size = len(buf[pos:end].encode("utf-8"))
+            yield element, offset, offset + size
+            offset += size
+            pos = end
+
+
+def read_json_range(data: Union[bytes, mmap.mmap], start: int,
+                    end: int) -> Any:
+    """Parse the JSON value at ``data[start:end]``, see `iter_json_array`."""
+    return json.loads(data[start:end])
+
+
+def iter_batches(iterable: Iterable[Any],
+                 batch_size: int) -> Iterator[list[Any]]:
+    """Split `iterable` into lists of up to `batch_size` items."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+class PrefetchIterator:
+    """
+    Iterates over `source` while a background thread produces up to
+    `max_buffered` items ahead of the consumer.
+
+    Used to generate benchmark requests while the benchmark runs instead of
+    before it starts. The buffer is bounded, so memory stays proportional to
+    `max_buffered` however long the source is. Exceptions raised by the
+    source are re-raised to the consumer. Iterated with ``async for``, the
+    consumer waits for the thread in an executor, so the event loop keeps
+    running while the next item is not ready.
+    """
+
+    _END = object()
+
+    def __init__(self, source: Iterable[Any], max_buffered: int) -> None:
+        self._queue: queue.Queue = queue.Queue(maxsize=max_buffered)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._fill,
+                                        args=(iter(source), ),
+                                        name="dataset-prefetch",
+                                        daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self, source: Iterator[Any]) -> None:
+        try:
+            for item in source:
+                if not self._put((item, None)):
+                    return
+        except BaseException as e:
+            self._put((None, e))
+            return
+        self._put((self._END, None))
+
+    def __iter__(self) -> "PrefetchIterator":
+        return self
+
+    def _get(self) -> tuple[Any, Optional[BaseException]]:
+        # Polls, so that a consumer waiting in an executor thread notices
+        # close() or the end of the source reached by another consumer.
+        while not self._done:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return self._END, None
+
+    def _unpack(self, entry: tuple[Any, Optional[BaseException]]) -> Any:
+        item, error = entry
+        if error is not None:
+            self._done = True
+            raise error
+        if item is self._END:
+            self._done = True
+            raise StopIteration
+        return item
+
+    def __next__(self) -> Any:
+        if self._done:
+            raise StopIteration
+        return self._unpack(self._get())
+
+    def __aiter__(self) -> "PrefetchIterator":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._done:
+            raise StopAsyncIteration
+        try:
+            entry = self._queue.get_nowait()
+        except queue.Empty:
+            entry = await asyncio.get_running_loop().run_in_executor(
+                None, self._get)
+        try:
+            return self._unpack(entry)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+    def close(self) -> None:
+        """Stop the background thread without consuming the rest."""
+        self._done = True
+        self._stop.set()
 
 
 # Global cache for LoRA tokenizers.
@@ -259,6 +517,11 @@ class RandomDataset(BenchmarkDataset):
     DEFAULT_RANGE_RATIO = 1.0
     DEFAULT_INPUT_LEN = 1024
     DEFAULT_OUTPUT_LEN = 128
+    # Number of prompts built and decoded together.
+    DECODE_BATCH_SIZE = 256
+    # How the prompts are represented, see `iter_samples`.
+    PROMPT_FORMATS = ("text", "exact-text", "token-ids")
+    DEFAULT_PROMPT_FORMAT = "text"
 
     def __init__(
         self,
@@ -274,10 +537,48 @@ class RandomDataset(BenchmarkDataset):
         range_ratio: float = DEFAULT_RANGE_RATIO,
         input_len: int = DEFAULT_INPUT_LEN,
         output_len: int = DEFAULT_OUTPUT_LEN,
+        num_proc: int = 1,
+        prompt_format: str = DEFAULT_PROMPT_FORMAT,
         **kwargs,
     ) -> list[SampleRequest]:
+        return list(
+            self.iter_samples(tokenizer=tokenizer,
+                              num_requests=num_requests,
+                              prefix_len=prefix_len,
+                              range_ratio=range_ratio,
+                              input_len=input_len,
+                              output_len=output_len,
+                              num_proc=num_proc,
+                              prompt_format=prompt_format,
+                              **kwargs))
+
+    def iter_samples(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        prefix_len: int = DEFAULT_PREFIX_LEN,
+        range_ratio: float = DEFAULT_RANGE_RATIO,
+        input_len: int = DEFAULT_INPUT_LEN,
+        output_len: int = DEFAULT_OUTPUT_LEN,
+        num_proc: int = 1,
+        prompt_format: str = DEFAULT_PROMPT_FORMAT,
+        **kwargs,
+    ) -> Iterator[SampleRequest]:
+        """
+        With the "text" prompt format, the random token IDs are decoded to
+        text and `prompt_len` is the number of IDs, which can differ by a few
+        percent from what the text re-encodes to. "exact-text" re-encodes
+        and trims the decoded prompts so that `prompt_len` is their actual
+        token count. "token-ids" skips decoding and uses the ID list itself
+        as the prompt, for endpoints that accept token IDs.
+        """
+        if prompt_format not in self.PROMPT_FORMATS:
+            raise ValueError(f"Unknown prompt format: {prompt_format}. "
+                             f"Expected one of {self.PROMPT_FORMATS}.")
         vocab_size = tokenizer.vocab_size
 
+        # Every length and offset is drawn here, in the same order as
+        # before, so only the prompt decoding is deferred to the consumer.
         prefix_token_ids = (np.random.randint(
             0, vocab_size, size=prefix_len).tolist() if prefix_len > 0 else [])
 
@@ -291,19 +592,765 @@ class RandomDataset(BenchmarkDataset):
                                         output_len + 1,
                                         size=num_requests)
         offsets = np.random.randint(0, vocab_size, size=num_requests)
+        # Request i is the prefix followed by the tokens offsets[i] + i,
+        # offsets[i] + i + 1, ... modulo the vocabulary size.
+        starts = offsets + np.arange(num_requests)
+        batches = [
+            (prefix_token_ids, starts[i:i + self.DECODE_BATCH_SIZE],
+             input_lens[i:i + self.DECODE_BATCH_SIZE], vocab_size,
+             prompt_format)
+            for i in range(0, num_requests, self.DECODE_BATCH_SIZE)
+        ]
+        return _random_requests(tokenizer, batches, output_lens, num_proc)
+
+
+def _random_requests(
+    tokenizer: PreTrainedTokenizerBase,
+    batches: Iterable[tuple],
+    output_lens: np.ndarray,
+    num_proc: int,
+) -> Iterator[SampleRequest]:
+    # Workers receive only the batch parameters and build the token IDs
+    # themselves, so little more than the prompts is pickled.
+    index = 0
+    for _, (prompts, prompt_lens) in map_batches(
+            _build_random_batch, ((batch, None) for batch in batches),
+            tokenizer, num_proc):
+        for prompt, prompt_len in zip(prompts, prompt_lens):
+            yield SampleRequest(
+                prompt=prompt,
+                prompt_len=prompt_len,
+                expected_output_len=int(output_lens[index]),
+            )
+            index += 1
+
+
+def random_token_ids(
+    prefix_token_ids: list[int],
+    starts: np.ndarray,
+    input_lens: np.ndarray,
+    vocab_size: int,
+) -> list[list[int]]:
+    """
+    Build the token IDs of a batch of random requests in one pass.
+
+    Row ``i`` is ``prefix_token_ids`` followed by ``input_lens[i]`` tokens
+    counting up from ``starts[i]`` modulo ``vocab_size``. All rows are laid
+    out in one flat array, which is then split into per-request lists.
+    """
+    prefix = np.asarray(prefix_token_ids, dtype=np.int64)
+    row_lens = prefix.size + np.asarray(input_lens, dtype=np.int64)
+    row_ends = np.cumsum(row_lens)
+    # Position of every token within its own row.
+    positions = np.arange(row_ends[-1] if row_ends.size else 0) - np.repeat(
+        row_ends - row_lens, row_lens)
+    flat = (np.repeat(starts, row_lens) + positions - prefix.size) % vocab_size
+    if prefix.size:
+        in_prefix = positions < prefix.size
+        flat[in_prefix] = prefix[positions[in_prefix]]
+    flat_list = flat.tolist()
+    return [
+        flat_list[end - length:end]
+        for end, length in zip(row_ends.tolist(), row_lens.tolist())
+    ]
+
+
+def batch_decode(tokenizer: PreTrainedTokenizerBase,
+                 token_ids: list[list[int]]) -> list[str]:
+    """
+    Decode many sequences at once, giving the same text as `decode`.
+
+    Fast tokenizers decode the whole batch in a single call into the Rust
+    backend, which parallelizes it, instead of one call per sequence.
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is None:
+        return tokenizer.batch_decode(token_ids)
+    texts = backend.decode_batch(token_ids, skip_special_tokens=False)
+    if tokenizer.clean_up_tokenization_spaces:
+        texts = [tokenizer.clean_up_tokenization(text) for text in texts]
+    return texts
+
+
+# Number of re-encode and trim passes made by `calibrate_prompts`.
+CALIBRATION_ROUNDS = 4
+
+
+def calibrate_prompts(
+    tokenizer: PreTrainedTokenizerBase,
+    prompts: list[str],
+    target_ids: list[list[int]],
+) -> tuple[list[str], list[int]]:
+    """
+    Adjust decoded prompts so that they re-encode to their target length.
+
+    Decoding random IDs and encoding the text again rarely gives back the
+    same number of tokens, because neighbouring pieces merge or split. Each
+    round re-encodes the prompts that are still off in one batch, trims the
+    ones that are too long and extends the ones that are too short with
+    their own target IDs, then decodes them again. The returned lengths are
+    the token counts of the final texts, without special tokens, so they
+    match what the server tokenizes even for a prompt that did not converge.
+    """
+    prompts = list(prompts)
+    targets = [len(ids) for ids in target_ids]
+    pending = list(range(len(prompts)))
+    prompt_lens = list(targets)
+    for round_index in range(CALIBRATION_ROUNDS + 1):
+        encoded = tokenizer([prompts[i] for i in pending],
+                            add_special_tokens=False).input_ids
+        retry, retry_ids = [], []
+        for i, ids in zip(pending, encoded):
+            prompt_lens[i] = len(ids)
+            if len(ids) > targets[i]:
+                retry.append(i)
+                retry_ids.append(ids[:targets[i]])
+            elif len(ids) < targets[i]:
+                retry.append(i)
+                retry_ids.append(ids + target_ids[i][len(ids):])
+        if not retry or round_index == CALIBRATION_ROUNDS:
+            break
+        for i, text in zip(retry, batch_decode(tokenizer, retry_ids)):
+            prompts[i] = text
+        pending = retry
+    return prompts, prompt_lens
+
+
+# -----------------------------------------------------------------------------
+# ShareGPT Dataset Implementation
+# -----------------------------------------------------------------------------
+
+
+class ShareGPTDataset(BenchmarkDataset):
+    """
+    Implements the ShareGPT dataset.  Loads data from a JSON file and
+    generates sample requests based on conversation turns.
+
+    `load_data` scans the file once with `iter_json_array` and keeps only
+    the byte range of each conversation with at least two turns, in a
+    shuffled order. `iter_samples` then parses and tokenizes conversations
+    in that order, a batch at a time, until `num_requests` of them pass
+    `is_valid_sequence`.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.load_data()
+
+    def load_data(self) -> None:
+        if self.dataset_path is None:
+            raise ValueError("dataset_path must be provided for loading data.")
+        # Filter entries with at least two conversation turns.
+        self.data = [(start, end) for entry, start, end in iter_json_array(
+            self.dataset_path) if isinstance(entry, dict)
+                     and len(entry.get("conversations", ())) >= 2]
+        random.Random(self.random_seed).shuffle(self.data)
+
+    def sample(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        output_len: Optional[int] = None,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> list[SampleRequest]:
+        return list(
+            self.iter_samples(tokenizer=tokenizer,
+                              num_requests=num_requests,
+                              output_len=output_len,
+                              num_proc=num_proc,
+                              **kwargs))
+
+    def iter_samples(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        output_len: Optional[int] = None,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> Iterator[SampleRequest]:
+        """
+        With `output_len`, it replaces the length of the completions, which
+        are then not tokenized.
+        """
+
+        def make_stream() -> Iterator[SampleRequest]:
+            count = 0
+            for prompt, prompt_len, completion_len, _ in tokenize_conversations(
+                    tokenizer, self._iter_conversations(output_len is None),
+                    num_proc):
+                new_output_len = (completion_len
+                                  if output_len is None else output_len)
+                if not is_valid_sequence(prompt_len,
+                                         new_output_len,
+                                         skip_min_output_len_check=output_len
+                                         is not None):
+                    continue
+                yield SampleRequest(
+                    prompt=prompt,
+                    prompt_len=prompt_len,
+                    expected_output_len=new_output_len,
+                )
+                count += 1
+                if count >= num_requests:
+                    return
+
+        return self.maybe_oversample_stream(make_stream, num_requests)
+
+    def _iter_conversations(
+            self, with_completion: bool
+    ) -> Iterator[tuple[str, Optional[str], None]]:
+        with open(self.dataset_path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in self.data:
+                conversations = read_json_range(data, start,
+                                                end)["conversations"]
+                yield (conversations[0]["value"], conversations[1]["value"]
+                       if with_completion else None, None)
+
+
+# -----------------------------------------------------------------------------
+# Sonnet Dataset Implementation
+# -----------------------------------------------------------------------------
+
+
+class SonnetDataset(BenchmarkDataset):
+    """
+    Simplified implementation of the Sonnet dataset.  Loads poem lines from a
+    text file and generates sample requests.  Default values here copied from
+    `benchmark_serving.py` for the sonnet dataset.
+    """
+
+    DEFAULT_PREFIX_LEN = 200
+    DEFAULT_INPUT_LEN = 550
+    DEFAULT_OUTPUT_LEN = 150
+    BASE_PROMPT = "Pick as many lines as you can from these poem lines:\n"
+
+    def __init__(
+        self,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.load_data()
+
+    def load_data(self) -> None:
+        if not self.dataset_path:
+            raise ValueError("dataset_path must be provided.")
+        with open(self.dataset_path, encoding="utf-8") as f:
+            self.data = f.readlines()
+
+    def sample(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        prefix_len: int = DEFAULT_PREFIX_LEN,
+        input_len: int = DEFAULT_INPUT_LEN,
+        output_len: int = DEFAULT_OUTPUT_LEN,
+        return_prompt_formatted: bool = False,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> list[SampleRequest]:
+        return list(
+            self.iter_samples(tokenizer=tokenizer,
+                              num_requests=num_requests,
+                              prefix_len=prefix_len,
+                              input_len=input_len,
+                              output_len=output_len,
+                              return_prompt_formatted=return_prompt_formatted,
+                              num_proc=num_proc,
+                              **kwargs))
+
+    def iter_samples(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        prefix_len: int = DEFAULT_PREFIX_LEN,
+        input_len: int = DEFAULT_INPUT_LEN,
+        output_len: int = DEFAULT_OUTPUT_LEN,
+        return_prompt_formatted: bool = False,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> Iterator[SampleRequest]:
+        """
+        The lines of each prompt are drawn from a generator seeded with
+        `random_seed`, and the chat-formatted prompts are tokenized a batch
+        at a time.
+        """
+        # Calculate average token length for a poem line.
+        line_lens = _token_counts(tokenizer, self.data)
+        avg_len = sum(line_lens) / len(line_lens)
+
+        # Build the base prompt.
+        base_msg = [{"role": "user", "content": self.BASE_PROMPT}]
+        base_fmt = tokenizer.apply_chat_template(base_msg,
+                                                 add_generation_prompt=True,
+                                                 tokenize=False)
+        base_offset = len(tokenizer(base_fmt).input_ids)
+        if input_len <= base_offset:
+            raise ValueError(
+                f"'input_len' must be higher than the base prompt length "
+                f"({base_offset}).")
+
+        # Determine how many poem lines to use.
+        num_input_lines = round((input_len - base_offset) / avg_len)
+        num_prefix_lines = max(round((prefix_len - base_offset) / avg_len), 0)
+        prefix = "".join(self.data[:num_prefix_lines])
+        rng = random.Random(self.random_seed)
+
+        def prompts() -> Iterator[str]:
+            for _ in range(num_requests):
+                extra_lines = rng.choices(self.data,
+                                          k=num_input_lines - num_prefix_lines)
+                yield f"{self.BASE_PROMPT}{prefix}{''.join(extra_lines)}"
+
+        batches = (((batch, return_prompt_formatted), batch)
+                   for batch in iter_batches(prompts(), TOKENIZE_BATCH_SIZE))
+        for batch, (formatted, prompt_lens) in map_batches(
+                _format_sonnet_batch, batches, tokenizer, num_proc):
+            for prompt, prompt_len in zip(formatted or batch, prompt_lens):
+                yield SampleRequest(
+                    prompt=prompt,
+                    prompt_len=prompt_len,
+                    expected_output_len=output_len,
+                )
+
+
+def _format_sonnet_batch(
+    batch: tuple[list[str], bool],
+    tokenizer: Optional[PreTrainedTokenizerBase] = None,
+) -> tuple[Optional[list[str]], list[int]]:
+    """
+    Return the chat-formatted prompts, if asked for, and their token counts.
+    """
+    tokenizer = tokenizer or _worker_tokenizer
+    prompts, return_prompt_formatted = batch
+    formatted = [
+        tokenizer.apply_chat_template([{
+            "role": "user",
+            "content": prompt
+        }],
+                                      add_generation_prompt=True,
+                                      tokenize=False) for prompt in prompts
+    ]
+    prompt_lens = _token_counts(tokenizer, formatted)
+    return (formatted if return_prompt_formatted else None), prompt_lens
+
+
+# -----------------------------------------------------------------------------
+# BurstGPT Dataset Implementation
+# -----------------------------------------------------------------------------
+
+
+class BurstGPTDataset(BenchmarkDataset):
+    """
+    Implements the BurstGPT dataset.  Loads data from a CSV file and generates
+    sample requests based on synthetic prompt generation. Only rows with Model
+    "GPT-4" and positive response tokens are used.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.load_data()
+
+    def load_data(self) -> None:
+        if self.dataset_path is None:
+            raise ValueError("dataset_path must be provided for loading data.")
+
+        # Only the columns used for sampling are read.
+        df = pd.read_csv(self.dataset_path,
+                         usecols=["Model", "Request tokens", "Response tokens"])
+        # Filter to keep only GPT-4 rows.
+        gpt4_df = df[df["Model"] == "GPT-4"]
+        # Remove failed requests (where Response tokens is 0 or less).
+        gpt4_df = gpt4_df[gpt4_df["Response tokens"] > 0]
+        self.data = gpt4_df[["Request tokens", "Response tokens"]]
+
+    def _sample_loaded_data(self, num_requests: int) -> np.ndarray:
+        data = self.data.sample(n=num_requests,
+                                random_state=self.random_seed,
+                                replace=num_requests > len(self.data))
+        return data.to_numpy(dtype=np.int64)
+
+    def sample(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> list[SampleRequest]:
+        return list(
+            self.iter_samples(tokenizer=tokenizer,
+                              num_requests=num_requests,
+                              num_proc=num_proc,
+                              **kwargs))
+
+    def iter_samples(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> Iterator[SampleRequest]:
+        """
+        Request i gets a synthetic prompt made of the token IDs i, i + 1, ...
+        modulo the vocabulary size, as long as its sampled request, and the
+        prompts are built and decoded like the RandomDataset ones.
+        """
+        data = self._sample_loaded_data(num_requests=num_requests)
+        input_lens, output_lens = data[:, 0], data[:, 1]
+        starts = np.arange(num_requests)
+        batches = [([], starts[i:i + TOKENIZE_BATCH_SIZE],
+                    input_lens[i:i + TOKENIZE_BATCH_SIZE],
+                    tokenizer.vocab_size, "text")
+                   for i in range(0, num_requests, TOKENIZE_BATCH_SIZE)]
+        return _random_requests(tokenizer, batches, output_lens, num_proc)
+
+
+# -----------------------------------------------------------------------------
+# Trace Replay Dataset Implementation
+# -----------------------------------------------------------------------------
+
+
+class TraceDataset(BenchmarkDataset):
+    """
+    Replays a production request trace.
+
+    The trace is a CSV or JSONL file (by extension: .jsonl/.json are read as
+    JSON lines) with one row per request giving its arrival time, prompt
+    length and output length. The column names of the BurstGPT and Azure LLM
+    inference traces are recognized, see `TIMESTAMP_COLUMNS`,
+    `INPUT_LEN_COLUMNS` and `OUTPUT_LEN_COLUMNS`. Timestamps are either
+    seconds or date-times. Rows are replayed in timestamp order; rows with a
+    non-positive length are dropped.
+
+    Each request gets a synthetic prompt as long as the recorded one, built
+    for the whole trace with the vectorized RandomDataset builder, and
+    `arrival_times` gives the send time of each request.
+    """
+
+    TIMESTAMP_COLUMNS = ("timestamp", "Timestamp", "TIMESTAMP", "arrival_time")
+    INPUT_LEN_COLUMNS = ("input_len", "prompt_len", "input_tokens",
+                         "Request tokens", "ContextTokens")
+    OUTPUT_LEN_COLUMNS = ("output_len", "output_tokens", "Response tokens",
+                          "GeneratedTokens")
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.load_data()
+
+    def load_data(self) -> None:
+        if self.dataset_path is None:
+            raise ValueError("dataset_path must be provided for loading data.")
+        columns = (self.TIMESTAMP_COLUMNS + self.INPUT_LEN_COLUMNS +
+                   self.OUTPUT_LEN_COLUMNS)
+        if self.dataset_path.endswith((".jsonl", ".json")):
+            df = pd.read_json(self.dataset_path, lines=True)
+        else:
+            # Only the recognized columns are read.
+            df = pd.read_csv(self.dataset_path,
+                             usecols=lambda name: name in columns)
+
+        def column(names: tuple[str, ...]) -> pd.Series:
+            for name in names:
+                if name in df.columns:
+                    return df[name]
+            raise ValueError(f"Trace {self.dataset_path} has none of the "
+                             f"columns {names}.")
+
+        timestamps = column(self.TIMESTAMP_COLUMNS)
+        if pd.api.types.is_numeric_dtype(timestamps):
+            timestamps = timestamps.to_numpy(dtype=np.float64)
+        else:
+            times = pd.to_datetime(timestamps)
+            timestamps = (times - times.min()).dt.total_seconds().to_numpy(
+                dtype=np.float64)
+        input_lens = column(self.INPUT_LEN_COLUMNS).to_numpy(dtype=np.int64)
+        output_lens = column(self.OUTPUT_LEN_COLUMNS).to_numpy(dtype=np.int64)
+
+        valid = (input_lens > 0) & (output_lens > 0)
+        if not valid.all():
+            logger.info("Dropped %d trace rows with a non-positive length.",
+                        int((~valid).sum()))
+        order = np.argsort(timestamps[valid], kind="stable")
+        # (n, 3) float64: timestamp, input length, output length.
+        self.data = np.stack([
+            timestamps[valid][order], input_lens[valid][order],
+            output_lens[valid][order]
+        ],
+                             axis=1)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def arrival_times(self,
+                      num_requests: int,
+                      time_scale: float = 1.0) -> list[float]:
+        """
+        Send times of the first `num_requests` requests relative to the
+        first one, sped up `time_scale` times.
+        """
+        if time_scale <= 0:
+            raise ValueError(
+                f"The time scale must be positive, got {time_scale}.")
+        timestamps = self.data[:num_requests, 0]
+        return ((timestamps - timestamps[:1]) / time_scale).tolist()
+
+    def sample(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        prompt_format: str = RandomDataset.DEFAULT_PROMPT_FORMAT,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> list[SampleRequest]:
+        return list(
+            self.iter_samples(tokenizer=tokenizer,
+                              num_requests=num_requests,
+                              prompt_format=prompt_format,
+                              num_proc=num_proc,
+                              **kwargs))
+
+    def iter_samples(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        prompt_format: str = RandomDataset.DEFAULT_PROMPT_FORMAT,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> Iterator[SampleRequest]:
+        """
+        Yields the first `num_requests` requests of the trace. Request i gets
+        the token IDs i, i + 1, ... modulo the vocabulary size, in any of the
+        RandomDataset prompt formats.
+        """
+        if num_requests > len(self):
+            raise ValueError(f"The trace has only {len(self)} requests, "
+                             f"{num_requests} were asked for.")
+        if prompt_format not in RandomDataset.PROMPT_FORMATS:
+            raise ValueError(f"Unknown prompt format: {prompt_format}. "
+                             f"Expected one of {RandomDataset.PROMPT_FORMATS}.")
+        input_lens = self.data[:num_requests, 1].astype(np.int64)
+        output_lens = self.data[:num_requests, 2].astype(np.int64)
+        starts = np.arange(num_requests)
+        batches = [([], starts[i:i + TOKENIZE_BATCH_SIZE],
+                    input_lens[i:i + TOKENIZE_BATCH_SIZE],
+                    tokenizer.vocab_size, prompt_format)
+                   for i in range(0, num_requests, TOKENIZE_BATCH_SIZE)]
+        return _random_requests(tokenizer, batches, output_lens, num_proc)
+
+
+# -----------------------------------------------------------------------------
+# HuggingFace Dataset Implementation
+# -----------------------------------------------------------------------------
+
 
-        requests = []
-        for i in range(num_requests):
-            inner_seq = ((offsets[i] + i + np.arange(input_lens[i])) %
-                         vocab_size).tolist()
-            token_sequence = prefix_token_ids + inner_seq
-            prompt = tokenizer.decode(token_sequence)
-            total_input_len = prefix_len + int(input_lens[i])
-            requests.append(
-                SampleRequest(
+class HuggingFaceDataset(BenchmarkDataset):
+    """
+    Dataset class for processing a HuggingFace dataset with conversation data
+    and optional images.
+
+    The dataset is streamed, shuffled with a buffer seeded by `random_seed`,
+    and its conversations are tokenized a batch at a time until
+    `num_requests` of them are valid.
+    """
+
+    def __init__(
+        self,
+        dataset_split: str,
+        dataset_subset: Optional[str] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.dataset_split = dataset_split
+        self.dataset_subset = dataset_subset
+        self.load_data()
+
+    def load_data(self) -> None:
+        if not self.dataset_path:
+            raise ValueError("dataset_path must be provided for loading data.")
+
+        self.data = load_dataset(
+            self.dataset_path,
+            name=self.dataset_subset,
+            split=self.dataset_split,
+            streaming=True,
+        )
+        if self.data.features is None or "conversations" \
+            not in self.data.features:
+            raise ValueError(
+                "HuggingFaceDataset currently only supports datasets with "
+                "a 'conversations' column like lmms-lab/LLaVA-OneVision-Data. "
+                "Please consider contributing if you would like to add "
+                "support for additional dataset formats.")
+        # Shuffle and filter examples with at least 2 conversations.
+        self.data = self.data.shuffle(seed=self.random_seed).filter(
+            lambda x: len(x["conversations"]) >= 2)
+
+    def sample(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        output_len: Optional[int] = None,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> list[SampleRequest]:
+        return list(
+            self.iter_samples(tokenizer=tokenizer,
+                              num_requests=num_requests,
+                              output_len=output_len,
+                              num_proc=num_proc,
+                              **kwargs))
+
+    def iter_samples(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        num_requests: int,
+        output_len: Optional[int] = None,
+        num_proc: int = 1,
+        **kwargs,
+    ) -> Iterator[SampleRequest]:
+        dynamic_output = output_len is None
+
+        def conversations() -> Iterator[tuple[str, Optional[str], Any]]:
+            for item in self.data:
+                conversation = item["conversations"]
+                yield (conversation[0]["value"], conversation[1]["value"]
+                       if dynamic_output else None, item.get("image"))
+
+        def make_stream() -> Iterator[SampleRequest]:
+            count = 0
+            for prompt, prompt_len, completion_len, image in \
+                    tokenize_conversations(tokenizer, conversations(),
+                                           num_proc):
+                if dynamic_output and not is_valid_sequence(
+                        prompt_len, completion_len):
+                    continue
+                new_output_len = (completion_len
+                                  if dynamic_output else output_len)
+                assert isinstance(new_output_len,
+                                  int) and new_output_len > 0
+                yield SampleRequest(
                     prompt=prompt,
-                    prompt_len=total_input_len,
-                    expected_output_len=int(output_lens[i]),
-                ))
-        return requests
+                    prompt_len=prompt_len,
+                    expected_output_len=new_output_len,
+                    multi_modal_data=(process_image(image)
+                                      if image is not None else None),
+                )
+                count += 1
+                if count >= num_requests:
+                    return
+
+        return self.maybe_oversample_stream(make_stream, num_requests)
+
+
+# -----------------------------------------------------------------------------
+# Batched Tokenization
+# -----------------------------------------------------------------------------
+
+# Number of prompts tokenized or decoded together.
+TOKENIZE_BATCH_SIZE = 256
+
+# Tokenizer of a `map_batches` worker process.
+_worker_tokenizer: Optional[PreTrainedTokenizerBase] = None
+
+
+def _init_tokenizer_worker(tokenizer: PreTrainedTokenizerBase) -> None:
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def map_batches(
+    func: Callable[..., Any],
+    batches: Iterable[tuple[Any, Any]],
+    tokenizer: PreTrainedTokenizerBase,
+    num_proc: int,
+) -> Iterator[tuple[Any, Any]]:
+    """
+    Apply ``func(payload, tokenizer)`` to a stream of batches, in order.
+
+    `batches` yields ``(payload, local)`` pairs and ``(local, result)`` is
+    yielded for each of them; only the payload is sent to the workers. With
+    ``num_proc > 1`` the batches are processed by a pool of spawned
+    processes that each hold a copy of the tokenizer, with at most two
+    batches per process ahead of the consumer, so `batches` is only read as
+    far as the consumer needs. The pool is shut down when the consumer
+    stops, even before the end of `batches`.
+    """
+    if num_proc <= 1:
+        for payload, local in batches:
+            yield local, func(payload, tokenizer)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(num_proc,
+                  initializer=_init_tokenizer_worker,
+                  initargs=(tokenizer, )) as pool:
+        pending: collections.deque = collections.deque()
+        for payload, local in batches:
+            pending.append((local, pool.apply_async(func, (payload, ))))
+            if len(pending) >= 2 * num_proc:
+                local, result = pending.popleft()
+                yield local, result.get()
+        while pending:
+            local, result = pending.popleft()
+            yield local, result.get()
+
+
+def _token_counts(tokenizer: PreTrainedTokenizerBase,
+                  texts: list[str]) -> list[int]:
+    return [len(ids) for ids in tokenizer(texts).input_ids] if texts else []
+
+
+def _tokenize_pairs(
+    batch: tuple[list[str], list[Optional[str]]],
+    tokenizer: Optional[PreTrainedTokenizerBase] = None,
+) -> list[tuple[int, int]]:
+    """Token counts of a batch of prompts and of their completions."""
+    tokenizer = tokenizer or _worker_tokenizer
+    prompts, completions = batch
+    completion_lens = iter(
+        _token_counts(tokenizer, [c for c in completions if c is not None]))
+    return [(prompt_len, next(completion_lens) if c is not None else 0)
+            for prompt_len, c in zip(_token_counts(tokenizer, prompts),
+                                     completions)]
+
+
+def tokenize_conversations(
+    tokenizer: PreTrainedTokenizerBase,
+    conversations: Iterable[tuple[str, Optional[str], Any]],
+    num_proc: int = 1,
+) -> Iterator[tuple[str, int, int, Any]]:
+    """
+    Count the tokens of a stream of ``(prompt, completion, extra)`` triples.
+
+    Yields ``(prompt, prompt_len, completion_len, extra)`` in input order.
+    Completions that are None are not tokenized and count as 0 tokens.
+    Triples are tokenized `TOKENIZE_BATCH_SIZE` at a time with one call to
+    the tokenizer, see `map_batches` for ``num_proc``.
+    """
+    batches = (((
+        [prompt for prompt, _, _ in batch],
+        [completion for _, completion, _ in batch],
+    ), batch) for batch in iter_batches(conversations, TOKENIZE_BATCH_SIZE))
+    for batch, lengths in map_batches(_tokenize_pairs, batches, tokenizer,
+                                      num_proc):
+        for (prompt, _, extra), (prompt_len,
+                                 completion_len) in zip(batch, lengths):
+            yield prompt, prompt_len, completion_len, extra
+
 
+def _build_random_batch(
+    batch: tuple[list[int], np.ndarray, np.ndarray, int, str],
+    tokenizer: Optional[PreTrainedTokenizerBase] = None,
+) -> tuple[list[Any], list[int]]:
+    """Return the prompts of a RandomDataset batch and their lengths."""
+    tokenizer = tokenizer or _worker_tokenizer
+    prefix_token_ids, starts, input_lens, vocab_size, prompt_format = batch
+    token_ids = random_token_ids(prefix_token_ids, starts, input_lens,
+                                 vocab_size)
+    prompt_lens = [len(ids) for ids in token_ids]
+    if prompt_format == "token-ids":
+        return token_ids, prompt_lens
+    prompts = batch_decode(tokenizer, token_ids)
+    if prompt_format == "exact-text":
+        return calibrate_prompts(tokenizer, prompts, token_ids)
+    return prompts, prompt_lens
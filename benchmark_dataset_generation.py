@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: Apache-2.0
+r"""Benchmark how fast the random dataset generates requests.
+
+Compares the previous per-request generation (one np.arange, .tolist() and
+tokenizer.decode call per request) with RandomDataset, which builds the token
+IDs of a whole batch at once and decodes it with a single batch call,
+optionally spread over a process pool.
+
+Usage:
+    python benchmark_dataset_generation.py \
+        --tokenizer <your_model> \
+        --num-requests 2000 \
+        --input-lens 128 1024 8192 \
+        --num-proc 1 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from backend_request_func import get_tokenizer
+from benchmark_dataset import RandomDataset
+
+
+def generate_per_request(tokenizer, num_requests: int, input_len: int,
+                         output_len: int) -> int:
+    # Mirrors the former RandomDataset.sample loop.
+    vocab_size = tokenizer.vocab_size
+    input_lens = np.random.randint(input_len, input_len + 1, size=num_requests)
+    np.random.randint(output_len, output_len + 1, size=num_requests)
+    offsets = np.random.randint(0, vocab_size, size=num_requests)
+    prompts = []
+    for i in range(num_requests):
+        inner_seq = ((offsets[i] + i + np.arange(input_lens[i])) %
+                     vocab_size).tolist()
+        prompts.append(tokenizer.decode(inner_seq))
+    return len(prompts)
+
+
+def generate_batched(tokenizer, num_requests: int, input_len: int,
+                     output_len: int, num_proc: int) -> int:
+    return len(RandomDataset().sample(tokenizer=tokenizer,
+                                      num_requests=num_requests,
+                                      input_len=input_len,
+                                      output_len=output_len,
+                                      num_proc=num_proc))
+
+
+def main(args: argparse.Namespace):
+    tokenizer = get_tokenizer(args.tokenizer,
+                              trust_remote_code=args.trust_remote_code)
+    generators = {
+        "per-request":
+        lambda input_len: generate_per_request(tokenizer, args.num_requests,
+                                               input_len, args.output_len),
+    }
+    for num_proc in args.num_proc:
+        generators[f"batched (num_proc={num_proc})"] = (
+            lambda input_len, num_proc=num_proc: generate_batched(
+                tokenizer, args.num_requests, input_len, args.output_len,
+                num_proc))
+
+    print("{:<24} {:>10} {:>14} {:>14}".format("Generator", "Input len",
+                                               "Requests/s", "Tokens/s"))
+    for input_len in args.input_lens:
+        for name, generate in generators.items():
+            best = float("inf")
+            for _ in range(args.num_iters):
+                np.random.seed(args.seed)
+                st = time.perf_counter()
+                count = generate(input_len)
+                best = min(best, time.perf_counter() - st)
+            assert count == args.num_requests, (name, count)
+            print("{:<24} {:>10} {:>14.1f} {:>14.0f}".format(
+                name, input_len, count / best, count * input_len / best))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark random dataset generation throughput.")
+    parser.add_argument("--tokenizer",
+                        type=str,
+                        required=True,
+                        help="Name or path of the tokenizer.")
+    parser.add_argument("--trust-remote-code",
+                        action="store_true",
+                        help="Trust remote code from huggingface.")
+    parser.add_argument("--num-requests",
+                        type=int,
+                        default=2000,
+                        help="Number of requests generated per iteration.")
+    parser.add_argument("--input-lens",
+                        type=int,
+                        nargs="+",
+                        default=[128, 1024, 8192],
+                        help="Input lengths, in tokens, to benchmark.")
+    parser.add_argument("--output-len",
+                        type=int,
+                        default=128,
+                        help="Output length of the generated requests.")
+    parser.add_argument("--num-proc",
+                        type=int,
+                        nargs="+",
+                        default=[1],
+                        help="Process pool sizes of the batched generator.")
+    parser.add_argument("--num-iters",
+                        type=int,
+                        default=3,
+                        help="Number of timed iterations; the best is kept.")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
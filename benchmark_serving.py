@@ -22,20 +22,26 @@ On the client side, run:
 """
 import argparse
 import asyncio
+import contextlib
 import gc
+import itertools
 import json
 import os
 import random
 import time
 import warnings
-from collections.abc import AsyncGenerator, Iterable
+from collections.abc import Iterable
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Optional
 
 import numpy as np
-from backend_request_func import (ASYNC_REQUEST_FUNCS, RequestFuncInput,
-                                  RequestFuncOutput)
+from backend_request_func import (ASYNC_REQUEST_FUNCS, DEFAULT_CONN_LIMIT,
+                                  DEFAULT_CONN_LIMIT_PER_HOST,
+                                  DEFAULT_DNS_CACHE_TTL,
+                                  DEFAULT_KEEPALIVE_TIMEOUT, RequestFuncInput,
+                                  async_request_openai_completions,
+                                  create_client_session)
 from tqdm.asyncio import tqdm
 from transformers import PreTrainedTokenizerBase
 
@@ -43,9 +49,25 @@ from backend_request_func import get_tokenizer
 
 from argparse import ArgumentParser as FlexibleArgumentParser
 
-from benchmark_dataset import (RandomDataset,
-                               SampleRequest)
+from benchmark_dataset import (BurstGPTDataset, HuggingFaceDataset,
+                               PrefetchIterator, RandomDataset, SampleRequest,
+                               ShareGPTDataset, SonnetDataset, TraceDataset)
+from benchmark_sharding import (ClosedLoop, dispatch_closed_loop,
+                                dispatch_requests, run_sharded,
+                                split_into_shards)
 from benchmark_utils import convert_to_pytorch_benchmark_format, write_to_json
+from dataset_cache import cache_samples, dataset_cache_key, load_cached_dataset
+from gpu_telemetry import TELEMETRY_SOURCES, GpuTelemetry, create_source
+from harness_monitor import HarnessMonitor, suspect_metrics
+from latency_sketch import (DEFAULT_RELATIVE_ACCURACY, ExactDistribution,
+                            TokenLatencySketches)
+from live_metrics import LiveMetrics
+from load_profiles import LoadProfile, Phase
+from request_records import RequestRecords
+from saturation_search import (SEARCH_PARAMETERS, print_search_results,
+                               search_saturation)
+from server_metrics import ServerMetricsScraper
+from steady_state import SteadyStateMonitor, records_finish_times
 
 MILLISECONDS_TO_SECONDS_CONVERSION = 1000
 
@@ -78,22 +100,69 @@ class BenchmarkMetrics:
     median_e2el_ms: float
     std_e2el_ms: float
     percentiles_e2el_ms: list[tuple[float, float]]
-
-
-async def get_request(
-    input_requests: list[SampleRequest],
+    # Corrected latencies are measured from the intended send time in the
+    # arrival schedule instead of from the moment the request was sent, so
+    # time spent queued on the client is not hidden (coordinated omission).
+    mean_corrected_ttft_ms: float
+    median_corrected_ttft_ms: float
+    std_corrected_ttft_ms: float
+    percentiles_corrected_ttft_ms: list[tuple[float, float]]
+    mean_corrected_e2el_ms: float
+    median_corrected_e2el_ms: float
+    std_corrected_e2el_ms: float
+    percentiles_corrected_e2el_ms: list[tuple[float, float]]
+    # Time each request waited on the client between its scheduled send
+    # time and its start, e.g. for a free --max-concurrency slot.
+    mean_queue_wait_ms: float
+    median_queue_wait_ms: float
+    std_queue_wait_ms: float
+    percentiles_queue_wait_ms: list[tuple[float, float]]
+    # Connection setup is done by the client, not the server. Only requests
+    # that had to open a new connection contribute to the connect stats.
+    new_connections: int
+    mean_connect_ms: float
+    median_connect_ms: float
+    percentiles_connect_ms: list[tuple[float, float]]
+    mean_pool_wait_ms: float
+    percentiles_pool_wait_ms: list[tuple[float, float]]
+    # Schedule lag is how late each request was released by the client
+    # relative to its deadline in the arrival schedule.
+    median_schedule_lag_ms: float
+    p99_schedule_lag_ms: float
+    max_schedule_lag_ms: float
+    # Rate at which the client actually released requests. None when the
+    # target rate was infinite, i.e. every request was due at once.
+    achieved_request_rate: Optional[float]
+    # Closed-loop mode: how evenly the virtual users that sent requests were
+    # served. The fairness index is Jain's index of the per-user output
+    # throughput: 1 when every user got the same share, 1/num_users when a
+    # single user got everything.
+    num_users: int = 0
+    user_fairness_index: float = 1.0
+    min_user_request_throughput: float = 0.0
+    max_user_request_throughput: float = 0.0
+    min_user_mean_e2el_ms: float = 0.0
+    max_user_mean_e2el_ms: float = 0.0
+
+
+def get_arrival_times(
+    num_requests: int,
     request_rate: float,
     burstiness: float = 1.0,
-) -> AsyncGenerator[SampleRequest, None]:
+) -> list[float]:
     """
-    Asynchronously generates requests at a specified rate
-    with OPTIONAL burstiness.
+    Compute the send time of every request, relative to the benchmark start.
+
+    The whole schedule is drawn up front in one vectorized call, so that it
+    is reproducible from the seed and independent of how fast the client
+    dispatches requests.
 
     Args:
-        input_requests:
-            A list of input requests, each represented as a SampleRequest.
+        num_requests:
+            The number of requests to schedule.
         request_rate:
             The rate at which requests are generated (requests/s).
+            If it is inf, every request is sent at time 0.
         burstiness (optional):
             The burstiness factor of the request generation.
             Only takes effect when request_rate is not inf.
@@ -103,98 +172,174 @@ async def get_request(
             in more bursty requests, while a higher burstiness value
             (burstiness > 1) results in a more uniform arrival of requests.
     """
-    input_requests: Iterable[SampleRequest] = iter(input_requests)
-
-    # Calculate scale parameter theta to maintain the desired request_rate.
     assert burstiness > 0, (
         f"A positive burstiness factor is expected, but given {burstiness}.")
+    if request_rate == float("inf") or num_requests == 0:
+        return [0.0] * num_requests
+    # Calculate scale parameter theta to maintain the desired request_rate.
+    # If burstiness is 1, the intervals follow an exponential distribution.
     theta = 1.0 / (request_rate * burstiness)
+    intervals = np.random.gamma(shape=burstiness,
+                                scale=theta,
+                                size=num_requests)
+    # The first request is sent immediately; the last interval is unused.
+    return np.concatenate(([0.0], np.cumsum(intervals[:-1]))).tolist()
+
 
-    for request in input_requests:
-        yield request
+def get_timed_arrival_times(
+    request_rate: float,
+    burstiness: float,
+    duration: float,
+) -> list[float]:
+    """
+    Compute the send times of a run that lasts `duration` seconds, drawn
+    like `get_arrival_times` in chunks of the expected number of requests
+    until the schedule covers the duration.
+    """
+    assert request_rate != float("inf"), (
+        "An infinite request rate has no finite schedule.")
+    chunk = max(int(request_rate * duration), 1)
+    arrival_times = np.asarray(get_arrival_times(chunk, request_rate,
+                                                 burstiness))
+    while arrival_times[-1] < duration:
+        # The next chunk starts one interval after the current end.
+        more = np.asarray(get_arrival_times(chunk + 1, request_rate,
+                                            burstiness))[1:]
+        arrival_times = np.concatenate((arrival_times,
+                                        arrival_times[-1] + more))
+    return arrival_times[arrival_times < duration].tolist()
+
+
+def get_think_times(
+    num_requests: int,
+    mean_think_time: float,
+    distribution: str = "constant",
+) -> list[float]:
+    """
+    Draw the think time that follows each request in closed-loop mode, in
+    one vectorized call so that it is reproducible from the seed.
+
+    Args:
+        num_requests:
+            The number of requests.
+        mean_think_time:
+            The mean seconds a virtual user waits after a request finished
+            before sending its next one.
+        distribution:
+            "constant" waits exactly the mean, "exponential" draws the
+            waits from an exponential distribution with that mean.
+    """
+    assert mean_think_time >= 0, (
+        f"A non-negative think time is expected, but given {mean_think_time}."
+    )
+    if distribution == "exponential" and mean_think_time > 0:
+        return np.random.exponential(mean_think_time,
+                                     size=num_requests).tolist()
+    if distribution not in ("constant", "exponential"):
+        raise ValueError(f"Unknown think time distribution: {distribution}")
+    return [float(mean_think_time)] * num_requests
+
+
+def _user_fairness_fields(records: RequestRecords,
+                          actual_output_lens: np.ndarray,
+                          dur_s: float) -> dict[str, Any]:
+    """Per-user fairness statistics of a closed-loop run."""
+    sent = records.user_id >= 0
+    if not sent.any():
+        return {}
+    users, user_index = np.unique(records.user_id[sent], return_inverse=True)
+    success = records.success[sent]
+    completed = np.bincount(user_index, weights=success,
+                            minlength=users.size)
+    output = np.bincount(user_index,
+                         weights=actual_output_lens[sent],
+                         minlength=users.size)
+    e2el_sum = np.bincount(user_index,
+                           weights=np.where(success, records.latency[sent],
+                                            0.0),
+                           minlength=users.size)
+    served = completed > 0
+    mean_e2els = e2el_sum[served] / completed[served]
+    output_throughput = output / dur_s
+    square_sum = users.size * np.square(output_throughput).sum()
+    return {
+        "num_users": int(users.size),
+        "user_fairness_index": (float(output_throughput.sum()**2 /
+                                      square_sum) if square_sum > 0 else 1.0),
+        "min_user_request_throughput": float(completed.min() / dur_s),
+        "max_user_request_throughput": float(completed.max() / dur_s),
+        "min_user_mean_e2el_ms": float(np.min(_or_zero(mean_e2els)) * 1000),
+        "max_user_mean_e2el_ms": float(np.max(_or_zero(mean_e2els)) * 1000),
+    }
 
-        if request_rate == float("inf"):
-            # If the request rate is infinity, then we don't need to wait.
-            continue
 
-        # Sample the request interval from the gamma distribution.
-        # If burstiness is 1, it follows exponential distribution.
-        interval = np.random.gamma(shape=burstiness, scale=theta)
-        # The next request will be sent after the interval.
-        await asyncio.sleep(interval)
+def _or_zero(values: np.ndarray) -> np.ndarray:
+    # numpy reductions fail on empty arrays; report 0 like `values or 0`.
+    return values if values.size else np.zeros(1)
 
 
 def calculate_metrics(
-    input_requests: list[SampleRequest],
-    outputs: list[RequestFuncOutput],
+    records: RequestRecords,
     dur_s: float,
     tokenizer: PreTrainedTokenizerBase,
     selected_percentile_metrics: list[str],
     selected_percentiles: list[float],
     goodput_config_dict: dict[str, float],
-) -> tuple[BenchmarkMetrics, list[int]]:
-    actual_output_lens: list[int] = []
-    total_input = 0
-    completed = 0
-    good_completed = 0
-    itls: list[float] = []
-    tpots: list[float] = []
-    all_tpots: list[float] = []
-    ttfts: list[float] = []
-    e2els: list[float] = []
-    # 新增：存储每个请求除首token外的总生成时间
-    total_time_except_first_token = []
-    # 新增：存储每个请求除首token外自身其他token的生成时间
-    other_token_times = []
-
-    for i in range(len(outputs)):
-        if outputs[i].success:
-            output_len = outputs[i].output_tokens
-            if output_len is None:
-                output_len = len(
-                    tokenizer(outputs[i].generated_text,
-                              add_special_tokens=False).input_ids)
-            actual_output_lens.append(output_len)
-            total_input += input_requests[i].prompt_len
-            tpot = 0
-            if output_len > 1:
-                latency_minus_ttft = outputs[i].latency - outputs[i].ttft
-                tpot = latency_minus_ttft / (output_len - 1)
-                tpots.append(tpot)
-            all_tpots.append(tpot)
-            itls += outputs[i].itl
-            ttfts.append(outputs[i].ttft)
-            e2els.append(outputs[i].latency)
-            completed += 1
-
-            # 计算每个请求除首token外的总生成时间
-            if output_len > 1:
-                total_time = sum(outputs[i].itl[1:])
-                total_time_except_first_token.append(total_time)
-                # 存储每个请求除首token外自身其他token的生成时间
-                other_token_times.extend(outputs[i].itl[1:])
-        else:
-            actual_output_lens.append(0)
+    token_sketches: Optional[TokenLatencySketches] = None,
+) -> tuple[BenchmarkMetrics, np.ndarray, dict[str, float]]:
+    """
+    Compute the benchmark metrics from the per-request records.
+
+    If `token_sketches` is given, the per-token latencies were already folded
+    into it as requests finished and all latency percentiles are read from
+    bounded-memory sketches (see latency_sketch.py for the error bound).
+    Otherwise percentiles are computed exactly from every sample.
+    """
+    success = records.success
+    actual_output_lens = np.where(success, records.output_tokens, 0)
+    # Backends that do not report usage get their output counted from the
+    # generated text, in one batched tokenizer call.
+    missing = np.flatnonzero(success & (records.output_tokens < 0))
+    if missing.size:
+        texts = [records.generated_texts[i] for i in missing]
+        actual_output_lens[missing] = [
+            len(ids)
+            for ids in tokenizer(texts, add_special_tokens=False).input_ids
+        ]
+
+    completed = int(success.sum())
+    total_input = int(records.prompt_len[success].sum())
+    output_lens = actual_output_lens[success]
+    ttfts = records.ttft[success]
+    e2els = records.latency[success]
+    multi_token = output_lens > 1
+    all_tpots = np.where(multi_token,
+                         (e2els - ttfts) / np.maximum(output_lens - 1, 1), 0.0)
+    tpots = all_tpots[multi_token]
+    send_delays = (records.start_time - records.scheduled_time)[success]
+    corrected_ttfts = ttfts + send_delays
+    corrected_e2els = e2els + send_delays
+    queue_waits = records.start_time - records.scheduled_time
+    connect_times = records.connect_time[records.connect_time > 0]
+    pool_waits = records.pool_wait
+    schedule_lags = records.dispatch_time - records.scheduled_time
+    achieved_request_rate = None
+    if len(records) > 1 and np.ptp(records.scheduled_time) > 0:
+        dispatch_span = np.ptp(records.dispatch_time)
+        if dispatch_span > 0:
+            achieved_request_rate = (len(records) - 1) / dispatch_span
+    # 新增：每个请求除首token外的总生成时间
+    total_time_except_first_token = records.itl_tail_sum[success][multi_token]
 
+    good_completed = 0
     if goodput_config_dict:
-        valid_metrics = []
-        slo_values = []
-        if "ttft" in goodput_config_dict:
-            valid_metrics.append(ttfts)
-            slo_values.append(goodput_config_dict["ttft"] /
-                              MILLISECONDS_TO_SECONDS_CONVERSION)
-        if "tpot" in goodput_config_dict:
-            valid_metrics.append(all_tpots)
-            slo_values.append(goodput_config_dict["tpot"] /
-                              MILLISECONDS_TO_SECONDS_CONVERSION)
-        if "e2el" in goodput_config_dict:
-            valid_metrics.append(e2els)
-            slo_values.append(goodput_config_dict["e2el"] /
-                              MILLISECONDS_TO_SECONDS_CONVERSION)
-        for req_metric in zip(*valid_metrics):
-            is_good_req = all([s >= r for s, r in zip(slo_values, req_metric)])
-            if is_good_req:
-                good_completed += 1
+        is_good_req = np.ones(completed, dtype=bool)
+        for name, values in (("ttft", ttfts), ("tpot", all_tpots),
+                             ("e2el", e2els)):
+            if name in goodput_config_dict:
+                is_good_req &= values <= (goodput_config_dict[name] /
+                                          MILLISECONDS_TO_SECONDS_CONVERSION)
+        good_completed = int(is_good_req.sum())
 
     if completed == 0:
         warnings.warn(
@@ -202,45 +347,80 @@ def calculate_metrics(
             "on the benchmark arguments.",
             stacklevel=2)
 
+    def distribution(values: np.ndarray):
+        dist = (token_sketches.new_sketch()
+                if token_sketches is not None else ExactDistribution())
+        dist.add_many(values)
+        return dist
+
+    def latency_fields(name: str, dist) -> dict[str, Any]:
+        return {
+            f"mean_{name}_ms": dist.mean * 1000,
+            f"median_{name}_ms": dist.percentile(50) * 1000,
+            f"std_{name}_ms": dist.std * 1000,
+            f"percentiles_{name}_ms":
+            [(p, dist.percentile(p) * 1000) for p in selected_percentiles],
+        }
+
+    if token_sketches is not None:
+        itl_distribution = token_sketches.itl
+        other_token_distribution = token_sketches.other_token
+    else:
+        # 每个请求除首token外自身其他token的生成时间
+        successful_itls = [
+            itl for itl, ok in zip(records.itls, success) if ok
+        ]
+        itl_distribution = distribution(
+            np.concatenate(successful_itls or [np.zeros(0)]))
+        other_token_distribution = distribution(
+            np.concatenate([itl[1:] for itl in successful_itls] or
+                           [np.zeros(0)]))
+
     metrics = BenchmarkMetrics(
         completed=completed,
         total_input=total_input,
-        total_output=sum(actual_output_lens),
+        total_output=int(actual_output_lens.sum()),
         request_throughput=completed / dur_s,
         request_goodput=good_completed / dur_s,
-        output_throughput=sum(actual_output_lens) / dur_s,
-        total_token_throughput=(total_input + sum(actual_output_lens)) / dur_s,
-        mean_ttft_ms=np.mean(ttfts or 0) * 1000,
-        std_ttft_ms=np.std(ttfts or 0) * 1000,
-        median_ttft_ms=np.median(ttfts or 0) * 1000,
-        percentiles_ttft_ms=[(p, np.percentile(ttfts or 0, p) * 1000)
-                             for p in selected_percentiles],
-        mean_tpot_ms=np.mean(tpots or 0) * 1000,
-        std_tpot_ms=np.std(tpots or 0) * 1000,
-        median_tpot_ms=np.median(tpots or 0) * 1000,
-        percentiles_tpot_ms=[(p, np.percentile(tpots or 0, p) * 1000)
-                             for p in selected_percentiles],
-        mean_itl_ms=np.mean(itls or 0) * 1000,
-        std_itl_ms=np.std(itls or 0) * 1000,
-        median_itl_ms=np.median(itls or 0) * 1000,
-        percentiles_itl_ms=[(p, np.percentile(itls or 0, p) * 1000)
-                            for p in selected_percentiles],
-        mean_e2el_ms=np.mean(e2els or 0) * 1000,
-        std_e2el_ms=np.std(e2els or 0) * 1000,
-        median_e2el_ms=np.median(e2els or 0) * 1000,
-        percentiles_e2el_ms=[(p, np.percentile(e2els or 0, p) * 1000)
-                             for p in selected_percentiles],
+        output_throughput=actual_output_lens.sum() / dur_s,
+        total_token_throughput=(total_input + actual_output_lens.sum()) /
+        dur_s,
+        **latency_fields("ttft", distribution(ttfts)),
+        **latency_fields("tpot", distribution(tpots)),
+        **latency_fields("itl", itl_distribution),
+        **latency_fields("e2el", distribution(e2els)),
+        **latency_fields("corrected_ttft", distribution(corrected_ttfts)),
+        **latency_fields("corrected_e2el", distribution(corrected_e2els)),
+        **latency_fields("queue_wait", distribution(queue_waits)),
+        new_connections=connect_times.size,
+        mean_connect_ms=np.mean(_or_zero(connect_times)) * 1000,
+        median_connect_ms=np.median(_or_zero(connect_times)) * 1000,
+        percentiles_connect_ms=[
+            (p, np.percentile(_or_zero(connect_times), p) * 1000)
+            for p in selected_percentiles
+        ],
+        mean_pool_wait_ms=np.mean(_or_zero(pool_waits)) * 1000,
+        percentiles_pool_wait_ms=[
+            (p, np.percentile(_or_zero(pool_waits), p) * 1000)
+            for p in selected_percentiles
+        ],
+        median_schedule_lag_ms=np.median(_or_zero(schedule_lags)) * 1000,
+        p99_schedule_lag_ms=np.percentile(_or_zero(schedule_lags), 99) * 1000,
+        max_schedule_lag_ms=np.max(_or_zero(schedule_lags)) * 1000,
+        achieved_request_rate=achieved_request_rate,
+        **_user_fairness_fields(records, actual_output_lens, dur_s),
     )
 
     # 新增：计算每个请求除首token外的总生成时间的统计值
-    mean_time_except_first_token = np.mean(total_time_except_first_token) * 1000 if total_time_except_first_token else 0
-    median_time_except_first_token = np.median(total_time_except_first_token) * 1000 if total_time_except_first_token else 0
-    p99_time_except_first_token = np.percentile(total_time_except_first_token, 99) * 1000 if total_time_except_first_token else 0
+    time_except_first_token = distribution(total_time_except_first_token)
+    mean_time_except_first_token = time_except_first_token.mean * 1000
+    median_time_except_first_token = time_except_first_token.percentile(50) * 1000
+    p99_time_except_first_token = time_except_first_token.percentile(99) * 1000
 
     # 新增：计算每个请求除首token外自身其他token的生成时间的统计值
-    mean_other_token_time = np.mean(other_token_times) * 1000 if other_token_times else 0
-    median_other_token_time = np.median(other_token_times) * 1000 if other_token_times else 0
-    p99_other_token_time = np.percentile(other_token_times, 99) * 1000 if other_token_times else 0
+    mean_other_token_time = other_token_distribution.mean * 1000
+    median_other_token_time = other_token_distribution.percentile(50) * 1000
+    p99_other_token_time = other_token_distribution.percentile(99) * 1000
 
     # 将新增的统计值添加到结果中（可以根据实际需求调整添加方式，这里以字典形式添加到返回结果中）
     additional_metrics = {
@@ -255,6 +435,82 @@ def calculate_metrics(
     return metrics, actual_output_lens, additional_metrics
 
 
+# A replayed request sent at most this late counts as on time.
+REPLAY_ON_TIME_MS = 10.0
+
+
+def calculate_replay_fidelity(records: RequestRecords,
+                              arrival_times: list[float]) -> dict[str, float]:
+    """
+    Compare the send times of a trace replay with the recorded ones.
+
+    Drift is how late each request was actually sent (after any
+    --max-concurrency wait) relative to its recorded, time-scaled offset
+    from the first request. The span ratio is the replayed over the
+    recorded time between the first and the last request, 1 for a faithful
+    replay.
+    """
+    drifts = _or_zero(records.start_time - records.scheduled_time) * 1000
+    recorded_span = (arrival_times[-1] -
+                     arrival_times[0]) if arrival_times else 0.0
+    replayed_span = (records.start_time.max() -
+                     records.start_time.min()) if len(records) else 0.0
+    return {
+        "mean_replay_drift_ms": float(np.mean(drifts)),
+        "median_replay_drift_ms": float(np.median(drifts)),
+        "p99_replay_drift_ms": float(np.percentile(drifts, 99)),
+        "max_replay_drift_ms": float(np.max(drifts)),
+        "replay_on_time_ratio": float(np.mean(drifts <= REPLAY_ON_TIME_MS)),
+        "replay_span_ratio":
+        (replayed_span / recorded_span if recorded_span > 0 else 1.0),
+    }
+
+
+def calculate_phase_metrics(
+    records: RequestRecords,
+    actual_output_lens: np.ndarray,
+    arrival_times: list[float],
+    phases: list[Phase],
+) -> list[dict[str, Any]]:
+    """
+    Summarize the requests scheduled in each phase of a load profile.
+
+    A request belongs to every phase whose window contains its scheduled
+    arrival time, so the requests of a spike also count in the phase it
+    interrupts. Rates are per second of the phase window.
+    """
+    arrivals = np.asarray(arrival_times, dtype=np.float64)
+    multi_token = records.success & (actual_output_lens > 1)
+    tpots = np.where(
+        multi_token,
+        (records.latency - records.ttft) / np.maximum(actual_output_lens - 1,
+                                                      1), 0.0)
+    summaries = []
+    for phase in phases:
+        in_phase = (arrivals >= phase.start) & (arrivals < phase.end)
+        done = in_phase & records.success
+        length = phase.end - phase.start
+        ttfts = _or_zero(records.ttft[done]) * 1000
+        e2els = _or_zero(records.latency[done]) * 1000
+        summaries.append({
+            "name": phase.name,
+            "start": phase.start,
+            "end": phase.end,
+            "requests": int(in_phase.sum()),
+            "completed": int(done.sum()),
+            "offered_rate": in_phase.sum() / length,
+            "request_throughput": done.sum() / length,
+            "output_throughput": actual_output_lens[done].sum() / length,
+            "mean_ttft_ms": float(np.mean(ttfts)),
+            "p99_ttft_ms": float(np.percentile(ttfts, 99)),
+            "mean_tpot_ms":
+            float(np.mean(_or_zero(tpots[in_phase & multi_token])) * 1000),
+            "mean_e2el_ms": float(np.mean(e2els)),
+            "p99_e2el_ms": float(np.percentile(e2els, 99)),
+        })
+    return summaries
+
+
 async def benchmark(
     backend: str,
     api_url: str,
@@ -262,7 +518,7 @@ async def benchmark(
     model_id: str,
     model_name: str,
     tokenizer: PreTrainedTokenizerBase,
-    input_requests: list[SampleRequest],
+    input_requests: Iterable[SampleRequest],
     logprobs: Optional[int],
     request_rate: float,
     burstiness: float,
@@ -273,17 +529,320 @@ async def benchmark(
     ignore_eos: bool,
     goodput_config_dict: dict[str, float],
     max_concurrency: Optional[int],
-    lora_modules: Optional[Iterable[str]]
+    lora_modules: Optional[Iterable[str]],
+    conn_limit: int = DEFAULT_CONN_LIMIT,
+    conn_limit_per_host: int = DEFAULT_CONN_LIMIT_PER_HOST,
+    keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+    dns_cache_ttl: int = DEFAULT_DNS_CACHE_TTL,
+    num_workers: int = 1,
+    exact_percentiles: bool = False,
+    sketch_relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    discard_generated_text: bool = False,
+    num_requests: Optional[int] = None,
+    arrival_times: Optional[list[float]] = None,
+    phases: Optional[list[Phase]] = None,
+    closed_loop: Optional[ClosedLoop] = None,
+    duration: Optional[float] = None,
+    warmup_seconds: float = 0.0,
+    cooldown_seconds: float = 0.0,
+    steady_state_monitor: Optional[SteadyStateMonitor] = None,
+    steady_state_early_stop: bool = False,
+    live_metrics: Optional[LiveMetrics] = None,
+    gpu_telemetry: Optional[GpuTelemetry] = None,
+    server_metrics: Optional[ServerMetricsScraper] = None,
+    harness_monitor: Optional[HarnessMonitor] = None,
 ):
-    """Run benchmark without GPU monitoring."""
+    """
+    Run benchmark, monitoring the GPUs of `gpu_telemetry` and scraping the
+    server's Prometheus metrics with `server_metrics` if they are given.
+    `harness_monitor` watches the event loop of this process for the
+    stalls that would distort the measured latencies.
+
+    `input_requests` may be a lazy stream, in which case `num_requests` must
+    give the number of requests it yields. `arrival_times` replaces the
+    schedule drawn from `request_rate` and `burstiness`, e.g. by a recorded
+    trace or a load profile whose `phases` are then reported separately.
+    With `closed_loop`, the requests are instead sent by virtual users that
+    each wait for their previous request and a think time.
+
+    With `duration`, requests are sent for that many seconds, cycling
+    through `input_requests`. Only the requests that start and finish
+    within the measurement window, which excludes the first
+    `warmup_seconds` and the last `cooldown_seconds` of the run, feed the
+    metrics, and throughput is computed over that window.
+
+    With `steady_state_monitor`, the steady state of the whole run is
+    detected and its metrics are reported as well; with
+    `steady_state_early_stop`, the run ends as soon as it settled.
+    `live_metrics` exports windowed metrics while the run is in progress.
+    """
     # 初始化后端请求函数
     if backend not in ASYNC_REQUEST_FUNCS:
         raise ValueError(f"Unknown backend: {backend}")
     request_func = ASYNC_REQUEST_FUNCS[backend]
 
+    # One pooled session is shared by every request of the run, so that
+    # connections are reused instead of being opened once per request.
+    session_kwargs = dict(limit=conn_limit,
+                          limit_per_host=conn_limit_per_host,
+                          keepalive_timeout=keepalive_timeout,
+                          dns_cache_ttl=dns_cache_ttl)
+    session = create_client_session(**session_kwargs)
+    # Per-token latencies are folded into bounded-memory sketches as each
+    # request finishes, unless exact percentiles were requested.
+    token_sketches = (None if exact_percentiles else
+                      TokenLatencySketches(sketch_relative_accuracy))
+    scrape_task = (asyncio.create_task(server_metrics.run())
+                   if server_metrics is not None else None)
+    monitor_task = (asyncio.create_task(harness_monitor.run())
+                    if harness_monitor is not None else None)
+    try:
+        records, start_time, benchmark_duration = await _run_benchmark_requests(
+            backend=backend,
+            request_func=request_func,
+            session=session,
+            session_kwargs=session_kwargs,
+            num_workers=num_workers,
+            api_url=api_url,
+            base_url=base_url,
+            model_id=model_id,
+            model_name=model_name,
+            input_requests=input_requests,
+            num_requests=(len(input_requests)
+                          if num_requests is None else num_requests),
+            logprobs=logprobs,
+            request_rate=request_rate,
+            burstiness=burstiness,
+            disable_tqdm=disable_tqdm,
+            profile=profile,
+            ignore_eos=ignore_eos,
+            max_concurrency=max_concurrency,
+            lora_modules=lora_modules,
+            token_sketches=token_sketches,
+            discard_generated_text=discard_generated_text,
+            arrival_times=arrival_times,
+            closed_loop=closed_loop,
+            duration=duration,
+            steady_state_monitor=(steady_state_monitor
+                                  if steady_state_early_stop else None),
+            live_metrics=live_metrics,
+            gpu_telemetry=gpu_telemetry,
+        )
+    finally:
+        await session.close()
+        if gpu_telemetry is not None:
+            gpu_telemetry.stop()
+        for task in (scrape_task, monitor_task):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+
+    steady_state = None
+    if steady_state_monitor is not None:
+        steady_state = _steady_state_results(
+            steady_state_monitor, records, start_time, tokenizer,
+            selected_percentile_metrics, selected_percentiles,
+            goodput_config_dict, token_sketches)
+
+    if (duration is not None and steady_state_early_stop
+            and steady_state_monitor.stopped_at is not None):
+        # The run ended when the steady state settled.
+        duration = min(duration, steady_state_monitor.stopped_at)
+    measurement_window = None
+    if duration is not None or warmup_seconds or cooldown_seconds:
+        # Ramp-up and drain would otherwise dilute the steady-state numbers.
+        window_start = warmup_seconds
+        window_end = (duration if duration is not None else
+                      benchmark_duration) - cooldown_seconds
+        if window_end <= window_start:
+            raise ValueError(
+                f"The measurement window [{window_start:g}, "
+                f"{window_end:g}) s is empty; shorten the warmup or the "
+                "cooldown.")
+        request_start = records.start_time - start_time
+        in_window = ((request_start >= window_start) &
+                     (request_start + records.latency <= window_end))
+        measurement_window = {
+            "window_start": window_start,
+            "window_end": window_end,
+            "sent_requests": len(records),
+            "measured_requests": int(in_window.sum()),
+        }
+        records = records.select(in_window)
+        benchmark_duration = window_end - window_start
+        start_time += window_start
+
+    # 计算指标
+    metrics, actual_output_lens, additional_metrics = calculate_metrics(
+        records=records,
+        dur_s=benchmark_duration,
+        tokenizer=tokenizer,
+        selected_percentile_metrics=selected_percentile_metrics,
+        selected_percentiles=selected_percentiles,
+        goodput_config_dict=goodput_config_dict,
+        token_sketches=token_sketches,
+    )
+
+    gpu_stats = None
+    if gpu_telemetry is not None:
+        # Samples share the perf_counter clock of the requests, so they are
+        # restricted to the measured part of the run.
+        gpu_stats = gpu_telemetry_results(gpu_telemetry, start_time,
+                                          benchmark_duration,
+                                          metrics.total_output)
+    server_stats = (server_metrics.results(start_time, benchmark_duration)
+                    if server_metrics is not None else None)
+    harness_stats = None
+    if harness_monitor is not None:
+        harness_stats = harness_monitor.summarize(start_time,
+                                                  benchmark_duration)
+        harness_stats.update(
+            suspect_metrics(
+                harness_stats, {
+                    "ttft": metrics.median_ttft_ms,
+                    "tpot": metrics.median_tpot_ms,
+                    "itl": metrics.median_itl_ms,
+                    "e2el": metrics.median_e2el_ms,
+                }))
+
+    return report_benchmark_results(
+        records=records,
+        benchmark_duration=benchmark_duration,
+        metrics=metrics,
+        actual_output_lens=actual_output_lens,
+        additional_metrics=additional_metrics,
+        selected_percentile_metrics=selected_percentile_metrics,
+        goodput_config_dict=goodput_config_dict,
+        replay_fidelity=(calculate_replay_fidelity(records, arrival_times)
+                         if arrival_times is not None and not phases else
+                         None),
+        phase_metrics=(calculate_phase_metrics(
+            records, actual_output_lens, arrival_times, phases)
+                       if phases else None),
+        measurement_window=measurement_window,
+        steady_state=steady_state,
+        gpu_stats=gpu_stats,
+        server_stats=server_stats,
+        harness_stats=harness_stats,
+    )
+
+
+def gpu_telemetry_results(gpu_telemetry: GpuTelemetry, start_time: float,
+                          duration: float,
+                          total_output: int) -> dict[str, Any]:
+    """
+    Per-GPU statistics of the `duration` seconds from `start_time`, the
+    output tokens per joule over all supervised GPUs and the samples, with
+    times relative to `start_time`.
+    """
+    stats = gpu_telemetry.summarize(start_time, start_time + duration)
+    energy = sum(gpu["energy_j"] for gpu in stats.values()
+                 if np.isfinite(gpu["energy_j"]))
+    samples = gpu_telemetry.samples()
+    samples["time"] = samples["time"] - start_time
+    return {
+        "gpu_stats": {str(gpu_id): gpu for gpu_id, gpu in stats.items()},
+        "gpu_energy_j": energy,
+        "tokens_per_joule": total_output / energy if energy > 0 else None,
+        "gpu_samples": {k: v.tolist() for k, v in samples.items()},
+    }
+
+
+def _steady_state_results(
+    monitor: SteadyStateMonitor,
+    records: RequestRecords,
+    start_time: float,
+    tokenizer: PreTrainedTokenizerBase,
+    selected_percentile_metrics: list[str],
+    selected_percentiles: list[float],
+    goodput_config_dict: dict[str, float],
+    token_sketches: Optional[TokenLatencySketches],
+) -> dict[str, Any]:
+    """
+    Detect the steady state of the run and compute the metrics of the
+    requests that started and finished within it.
+    """
+    state = monitor.check(records, start_time)
+    if state is None:
+        return {"detected": False, "stopped_at": monitor.stopped_at}
+    request_start = records.start_time - start_time
+    in_steady_state = ((request_start >= state.start) &
+                       (records_finish_times(records, start_time, slice(None))
+                        <= state.end))
+    # Without exact percentiles the ITLs only exist in the sketches of the
+    # whole run, so the steady state reports TTFT, TPOT and E2EL.
+    steady_metrics, _, _ = calculate_metrics(
+        records=records.select(in_steady_state),
+        dur_s=state.end - state.start,
+        tokenizer=tokenizer,
+        selected_percentile_metrics=selected_percentile_metrics,
+        selected_percentiles=selected_percentiles,
+        goodput_config_dict=goodput_config_dict,
+        token_sketches=token_sketches,
+    )
+    result = {
+        "detected": True,
+        "settled": state.settled,
+        "stopped_at": monitor.stopped_at,
+        "start": state.start,
+        "end": state.end,
+        "completed": steady_metrics.completed,
+        "request_throughput": steady_metrics.request_throughput,
+        "request_throughput_ci": state.request_rate_half_width,
+        "output_throughput": steady_metrics.output_throughput,
+        "output_throughput_ci": state.output_rate_half_width,
+    }
+    for metric in ["ttft", "tpot", "e2el"]:
+        result[f"mean_{metric}_ms"] = getattr(steady_metrics,
+                                              f"mean_{metric}_ms")
+        for p, value in getattr(steady_metrics, f"percentiles_{metric}_ms"):
+            p_word = str(int(p)) if int(p) == p else str(p)
+            result[f"p{p_word}_{metric}_ms"] = value
+    return result
+
+
+async def _run_benchmark_requests(
+    backend: str,
+    request_func,
+    session,
+    session_kwargs: dict[str, Any],
+    num_workers: int,
+    api_url: str,
+    base_url: str,
+    model_id: str,
+    model_name: str,
+    input_requests: Iterable[SampleRequest],
+    num_requests: int,
+    logprobs: Optional[int],
+    request_rate: float,
+    burstiness: float,
+    disable_tqdm: bool,
+    profile: bool,
+    ignore_eos: bool,
+    max_concurrency: Optional[int],
+    lora_modules: Optional[Iterable[str]],
+    token_sketches: Optional[TokenLatencySketches] = None,
+    discard_generated_text: bool = False,
+    arrival_times: Optional[list[float]] = None,
+    closed_loop: Optional[ClosedLoop] = None,
+    duration: Optional[float] = None,
+    steady_state_monitor: Optional[SteadyStateMonitor] = None,
+    live_metrics: Optional[LiveMetrics] = None,
+    gpu_telemetry: Optional[GpuTelemetry] = None,
+) -> tuple[RequestRecords, float, float]:
+    """
+    Send the warmup request and the timed requests on `session`.
+
+    Returns the records, the start time of the run and its duration.
+    """
     # 初始测试请求
     print("Starting initial single prompt test run...")
-    test_request = input_requests[0]
+    # The first request is also sent as part of the run, so it is put back
+    # in front of a possibly lazy stream.
+    input_requests = iter(input_requests)
+    test_request = next(input_requests)
+    input_requests = itertools.chain([test_request], input_requests)
     test_input = RequestFuncInput(
         model=model_id,
         model_name=model_name,
@@ -295,14 +854,22 @@ async def benchmark(
         multi_modal_content=test_request.multi_modal_data,
         ignore_eos=ignore_eos
     )
-    test_output = await request_func(request_func_input=test_input)
+    test_output = await request_func(request_func_input=test_input,
+                                     session=session)
     if not test_output.success:
         raise ValueError(f"Initial test failed: {test_output.error}")
     print("Initial test run completed. Starting main benchmark run...")
 
+    if duration is not None:
+        # A timed run cycles through the sampled requests until it ends.
+        input_requests = itertools.cycle(input_requests)
+
     # 设置LoRA模块（如果指定）
     if lora_modules:
-        lora_modules = iter([random.choice(lora_modules) for _ in range(len(input_requests))])
+        lora_choices = list(lora_modules)
+        lora_modules = (random.choice(lora_choices)
+                        for _ in (itertools.count() if duration is not None
+                                  else range(num_requests)))
 
     # 启动分析器（如果请求）
     if profile:
@@ -318,34 +885,53 @@ async def benchmark(
             multi_modal_content=test_request.multi_modal_data,
             ignore_eos=ignore_eos
         )
-        if (await request_func(profile_input)).success:
+        if (await request_func(profile_input, session=session)).success:
             print("Profiler started")
 
     # 打印基准测试参数
-    print(f"Traffic request rate: {request_rate}")
-    print(f"Burstiness factor: {burstiness} ({'Poisson' if burstiness == 1.0 else 'Gamma'})")
+    if closed_loop is not None:
+        print(f"Traffic: closed loop with {len(closed_loop.users)} users, "
+              "mean think time "
+              f"{np.mean(_or_zero(np.asarray(closed_loop.think_times))):.3f} s")
+        # Users send as soon as they are ready; there is no schedule.
+        arrival_times = [0.0] * num_requests
+    elif arrival_times is not None:
+        print("Traffic: replaying the recorded arrival times "
+              f"({arrival_times[-1] if arrival_times else 0:.2f} s)")
+    else:
+        print(f"Traffic request rate: {request_rate}")
+        print(f"Burstiness factor: {burstiness} ({'Poisson' if burstiness == 1.0 else 'Gamma'})")
+        if duration is None:
+            arrival_times = get_arrival_times(num_requests, request_rate,
+                                              burstiness)
+        elif request_rate == float("inf"):
+            # Sent as fast as --max-concurrency admits until the run ends.
+            arrival_times = itertools.repeat(0.0)
+        else:
+            arrival_times = get_timed_arrival_times(request_rate,
+                                                    burstiness, duration)
     print(f"Max concurrency: {max_concurrency}")
+    if gpu_telemetry is not None:
+        print("Monitoring GPUs: "
+              f"{','.join(map(str, gpu_telemetry.gpu_ids))}")
+        gpu_telemetry.start()
+    total_requests: Optional[int] = num_requests
+    if duration is not None:
+        print(f"Duration: {duration:g} s")
+        # Only a finite schedule tells how many requests a timed run sends.
+        total_requests = (len(arrival_times) if isinstance(
+            arrival_times, list) and closed_loop is None else None)
+        num_requests = total_requests or num_requests
 
     # 设置进度条
-    pbar = None if disable_tqdm else tqdm(total=len(input_requests))
-    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    pbar = None if disable_tqdm else tqdm(total=total_requests)
 
-    async def limited_request_func(request_input, pbar):
-        if semaphore is None:
-            return await request_func(request_input, pbar)
-        async with semaphore:
-            return await request_func(request_input, pbar)
-
-    # 运行基准测试
-    benchmark_start_time = time.perf_counter()
-    tasks = []
-
-    async for request in get_request(input_requests, request_rate, burstiness):
+    def build_request_input(request: SampleRequest) -> RequestFuncInput:
         req_model_id, req_model_name = model_id, model_name
         if lora_modules:
             req_lora_module = next(lora_modules)
             req_model_id = req_model_name = req_lora_module
-        request_input = RequestFuncInput(
+        return RequestFuncInput(
             model=req_model_id,
             model_name=req_model_name,
             prompt=request.prompt,
@@ -354,14 +940,50 @@ async def benchmark(
             output_len=request.expected_output_len,
             logprobs=logprobs,
             multi_modal_content=request.multi_modal_data,
-            ignore_eos=ignore_eos
+            ignore_eos=ignore_eos,
+            discard_text=discard_generated_text,
         )
 
-        tasks.append(asyncio.create_task(
-            limited_request_func(request_input, pbar)
-        ))
-
-    outputs = await asyncio.gather(*tasks)
+    if num_workers > 1:
+        # Each worker process runs its own event loop and session; the
+        # arrival schedule is computed here so the global rate is kept.
+        # Shards are sent to the workers whole, so a lazy stream of requests
+        # is consumed here before the run starts.
+        print(f"Worker processes: {num_workers}")
+        plans = split_into_shards(
+            backend=backend,
+            request_inputs=[
+                build_request_input(request) for request in
+                itertools.islice(input_requests, len(arrival_times))
+            ],
+            arrival_times=arrival_times,
+            num_workers=num_workers,
+            session_kwargs=session_kwargs,
+            sketch_accuracy=(token_sketches.relative_accuracy
+                             if token_sketches is not None else None),
+            keep_text=not discard_generated_text,
+            max_concurrency=max_concurrency,
+            closed_loop=closed_loop,
+        )
+        records, benchmark_start_time = await run_sharded(
+            plans, max_concurrency, pbar, token_sketches)
+    else:
+        records, benchmark_start_time = await _send_requests(
+            request_func=request_func,
+            session=session,
+            input_requests=input_requests,
+            num_requests=num_requests,
+            build_request_input=build_request_input,
+            arrival_times=arrival_times,
+            max_concurrency=max_concurrency,
+            pbar=pbar,
+            token_sketches=token_sketches,
+            keep_text=not discard_generated_text,
+            closed_loop=closed_loop,
+            duration=duration,
+            steady_state_monitor=steady_state_monitor,
+            live_metrics=live_metrics,
+        )
 
     # 停止分析器（如果正在运行）
     if profile:
@@ -374,24 +996,112 @@ async def benchmark(
             output_len=test_request.expected_output_len,
             logprobs=logprobs
         )
-        if (await request_func(profile_input)).success:
+        if (await request_func(profile_input, session=session)).success:
             print("Profiler stopped")
 
     if pbar is not None:
         pbar.close()
 
-    # 计算指标
     benchmark_duration = time.perf_counter() - benchmark_start_time
-    metrics, actual_output_lens, additional_metrics = calculate_metrics(
-        input_requests=input_requests,
-        outputs=outputs,
-        dur_s=benchmark_duration,
-        tokenizer=tokenizer,
-        selected_percentile_metrics=selected_percentile_metrics,
-        selected_percentiles=selected_percentiles,
-        goodput_config_dict=goodput_config_dict
-    )
+    return records, benchmark_start_time, benchmark_duration
+
+
+async def _send_requests(
+    request_func,
+    session,
+    input_requests: Iterable[SampleRequest],
+    num_requests: int,
+    build_request_input,
+    arrival_times: list[float],
+    max_concurrency: Optional[int],
+    pbar: Optional[tqdm],
+    token_sketches: Optional[TokenLatencySketches] = None,
+    keep_text: bool = True,
+    closed_loop: Optional[ClosedLoop] = None,
+    duration: Optional[float] = None,
+    steady_state_monitor: Optional[SteadyStateMonitor] = None,
+    live_metrics: Optional[LiveMetrics] = None,
+) -> tuple[RequestRecords, float]:
+    """
+    Send the timed requests from this process's event loop, for `duration`
+    seconds if it is given, and until `steady_state_monitor` finds the
+    steady state settled if it is given. `live_metrics` exports windowed
+    metrics while the requests are in flight.
+    """
+    # Request inputs are built as the dispatcher reaches them, so only the
+    # ones in flight exist at any time.
+    if isinstance(input_requests, PrefetchIterator):
+        # Awaited, so that the streams in flight are still read while the
+        # background thread falls behind.
+        request_inputs = (build_request_input(request)
+                          async for request in input_requests)
+    else:
+        request_inputs = map(build_request_input, input_requests)
 
+    # 运行基准测试
+    records = RequestRecords(num_requests,
+                             keep_itl=token_sketches is None,
+                             keep_text=keep_text)
+    benchmark_start_time = time.perf_counter()
+    stop_time = (benchmark_start_time +
+                 duration if duration is not None else None)
+    stop_event = None
+    background_tasks = []
+    if steady_state_monitor is not None:
+        stop_event = asyncio.Event()
+        background_tasks.append(
+            asyncio.create_task(
+                steady_state_monitor.run(records, benchmark_start_time,
+                                         stop_event)))
+    if live_metrics is not None:
+        live_metrics.start(benchmark_start_time)
+        background_tasks.append(asyncio.create_task(live_metrics.run()))
+    dispatch_kwargs = dict(
+        request_func=request_func,
+        session=session,
+        request_inputs=request_inputs,
+        start_time=benchmark_start_time,
+        pbar=pbar,
+        records=records,
+        token_sketches=token_sketches,
+        stop_time=stop_time,
+        stop_event=stop_event,
+        live_metrics=live_metrics,
+    )
+    try:
+        if closed_loop is not None:
+            await dispatch_closed_loop(closed_loop=closed_loop,
+                                       **dispatch_kwargs)
+        else:
+            await dispatch_requests(arrival_times=arrival_times,
+                                    max_concurrency=max_concurrency,
+                                    semaphore=None,
+                                    **dispatch_kwargs)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        if live_metrics is not None:
+            live_metrics.close()
+    return records.trim(), benchmark_start_time
+
+
+def report_benchmark_results(
+    records: RequestRecords,
+    benchmark_duration: float,
+    metrics: BenchmarkMetrics,
+    actual_output_lens: np.ndarray,
+    additional_metrics: dict[str, float],
+    selected_percentile_metrics: list[str],
+    goodput_config_dict: dict[str, float],
+    replay_fidelity: Optional[dict[str, float]] = None,
+    phase_metrics: Optional[list[dict[str, Any]]] = None,
+    measurement_window: Optional[dict[str, Any]] = None,
+    steady_state: Optional[dict[str, Any]] = None,
+    gpu_stats: Optional[dict[str, Any]] = None,
+    server_stats: Optional[dict[str, Any]] = None,
+    harness_stats: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """Build the result dict for a finished run and print its summary."""
     # 准备结果
     result = {
         "duration": benchmark_duration,
@@ -402,14 +1112,68 @@ async def benchmark(
         "request_goodput": metrics.request_goodput if goodput_config_dict else None,
         "output_throughput": metrics.output_throughput,
         "total_token_throughput": metrics.total_token_throughput,
-        "input_lens": [o.prompt_len for o in outputs],
-        "output_lens": actual_output_lens,
-        "ttfts": [o.ttft for o in outputs],
-        "itls": [o.itl for o in outputs],
-        "generated_texts": [o.generated_text for o in outputs],
-        "errors": [o.error for o in outputs],
-        **additional_metrics
+        "input_lens": records.prompt_len.tolist(),
+        "output_lens": actual_output_lens.tolist(),
+        "ttfts": records.ttft.tolist(),
+        # Per-request ITLs are only kept with exact percentiles.
+        "itls": ([itl.tolist() for itl in records.itls]
+                 if records.keep_itl else []),
+        "generated_texts": records.generated_texts or [],
+        "errors": records.errors,
+        "new_connections": metrics.new_connections,
+        "mean_connect_ms": metrics.mean_connect_ms,
+        "median_connect_ms": metrics.median_connect_ms,
+        "mean_pool_wait_ms": metrics.mean_pool_wait_ms,
+        "connect_times": records.connect_time.tolist(),
+        "pool_waits": records.pool_wait.tolist(),
+        "median_schedule_lag_ms": metrics.median_schedule_lag_ms,
+        "p99_schedule_lag_ms": metrics.p99_schedule_lag_ms,
+        "max_schedule_lag_ms": metrics.max_schedule_lag_ms,
+        "achieved_request_rate": metrics.achieved_request_rate,
+        "schedule_lags":
+        (records.dispatch_time - records.scheduled_time).tolist(),
+        "queue_waits": (records.start_time - records.scheduled_time).tolist(),
+        **additional_metrics,
+        **(replay_fidelity or {}),
     }
+    if phase_metrics is not None:
+        result["phases"] = phase_metrics
+    if measurement_window is not None:
+        result.update(measurement_window)
+    if steady_state is not None:
+        result["steady_state"] = steady_state
+    if gpu_stats is not None:
+        result.update(gpu_stats)
+    if server_stats is not None:
+        result.update(server_stats)
+    if harness_stats is not None:
+        result["harness"] = harness_stats
+    if metrics.num_users:
+        result.update({
+            "num_users": metrics.num_users,
+            "user_fairness_index": metrics.user_fairness_index,
+            "min_user_request_throughput":
+            metrics.min_user_request_throughput,
+            "max_user_request_throughput":
+            metrics.max_user_request_throughput,
+            "min_user_mean_e2el_ms": metrics.min_user_mean_e2el_ms,
+            "max_user_mean_e2el_ms": metrics.max_user_mean_e2el_ms,
+            "user_ids": records.user_id.tolist(),
+        })
+    for metric in [
+            "ttft", "tpot", "itl", "e2el", "corrected_ttft",
+            "corrected_e2el", "queue_wait"
+    ]:
+        for stat in ["mean", "median", "std"]:
+            result[f"{stat}_{metric}_ms"] = getattr(metrics,
+                                                    f"{stat}_{metric}_ms")
+    for metric in [
+            "ttft", "tpot", "itl", "e2el", "corrected_ttft",
+            "corrected_e2el", "queue_wait", "connect", "pool_wait"
+    ]:
+        for p, value in getattr(metrics, f"percentiles_{metric}_ms"):
+            p_word = str(int(p)) if int(p) == p else str(p)
+            result[f"p{p_word}_{metric}_ms"] = value
 
     # 打印摘要
     print("\n" + "=" * 55)
@@ -417,15 +1181,60 @@ async def benchmark(
     print("=" * 55)
     print("{:<30} {:>18}".format("Successful requests:", metrics.completed))
     print("{:<30} {:>18.2f} s".format("Duration:", benchmark_duration))
+    if measurement_window is not None:
+        print("{:<30} {:>18}".format(
+            "Measurement window:",
+            f"[{measurement_window['window_start']:.2f}, "
+            f"{measurement_window['window_end']:.2f}) s"))
+        print("{:<30} {:>18}".format(
+            "Requests outside window:",
+            measurement_window["sent_requests"] -
+            measurement_window["measured_requests"]))
     print("{:<30} {:>18}".format("Input tokens:", metrics.total_input))
     print("{:<30} {:>18}".format("Output tokens:", metrics.total_output))
     print("{:<30} {:>18.2f} req/s".format("Request throughput:", metrics.request_throughput))
     print("{:<30} {:>18.2f} tok/s".format("Token throughput:", metrics.total_token_throughput))
     print("{:<30} {:>18.2f} tok/s".format("Output throughput:", metrics.output_throughput))
 
+    if gpu_stats is not None:
+        print("\n" + "-" * 55)
+        print("{:^55}".format(" GPU Statistics "))
+        print("-" * 55)
+        for gpu_id, gpu in gpu_stats["gpu_stats"].items():
+            print(f"\n[GPU {gpu_id}]")
+            print("{:<43} {:>8.2f}%".format("Avg GPU util:",
+                                            gpu["avg_gpu_util"]))
+            print("{:<43} {:>8.2f}%".format("Max GPU util:",
+                                            gpu["max_gpu_util"]))
+            print("{:<43} {:>8.2f}%".format("Avg Mem util:",
+                                            gpu["avg_mem_util"]))
+            print("{:<43} {:>8.2f}%".format("Max Mem util:",
+                                            gpu["max_mem_util"]))
+            # hy-smi only reports the memory utilization.
+            if np.isfinite(gpu["total_mem_mb"]):
+                print("{:<43} {:>8.2f} MB".format("Avg Mem used:",
+                                                  gpu["avg_mem_used_mb"]))
+                print("{:<43} {:>8.2f} MB".format("Max Mem used:",
+                                                  gpu["max_mem_used_mb"]))
+                print("{:<43} {:>8.2f} MB".format("Total Mem:",
+                                                  gpu["total_mem_mb"]))
+            if np.isfinite(gpu["avg_power_w"]):
+                print("{:<43} {:>8.2f} W".format("Avg power:",
+                                                 gpu["avg_power_w"]))
+                print("{:<43} {:>8.2f} W".format("Max power:",
+                                                 gpu["max_power_w"]))
+                print("{:<43} {:>8.2f} J".format("Energy:",
+                                                 gpu["energy_j"]))
+        if gpu_stats["tokens_per_joule"] is not None:
+            print("\n{:<40} {:>11.4f} tok/J".format(
+                "Output tokens per joule:", gpu_stats["tokens_per_joule"]))
+        print()
+
     # 打印延迟指标
-    def print_metric(metric, name):
-        if metric in selected_percentile_metrics:
+    def print_metric(metric, name, always=False):
+        # Corrected metrics follow the selection of their uncorrected one.
+        if always or metric.removeprefix(
+                "corrected_") in selected_percentile_metrics:
             print("-" * 55)
             print("{:^55}".format(f" {name} Metrics "))
             print("-" * 55)
@@ -441,8 +1250,170 @@ async def benchmark(
     print_metric("tpot", "Time Per Output Token")
     print_metric("itl", "Inter-Token Latency")
     print_metric("e2el", "End-to-End Latency")
+    # Measured from the intended send time, so client-side queueing under
+    # --max-concurrency or a lagging schedule is included.
+    print_metric("corrected_ttft", "Corrected Time To First Token")
+    print_metric("corrected_e2el", "Corrected End-to-End Latency")
+    print_metric("queue_wait", "Client Queue Wait", always=True)
+
+    # Connection setup happens on the client, so it is reported apart from
+    # TTFT to show how much of the latency is spent by the harness itself.
+    print("-" * 55)
+    print("{:^55}".format(" Connection Establishment "))
+    print("-" * 55)
+    print("{:<43} {:>8}".format("New connections:", metrics.new_connections))
+    print("{:<43} {:>8.2f} ms".format("Mean connect time:",
+                                      metrics.mean_connect_ms))
+    print("{:<43} {:>8.2f} ms".format("Median connect time:",
+                                      metrics.median_connect_ms))
+    for p, val in metrics.percentiles_connect_ms:
+        print("{:<43} {:>8.2f} ms".format(
+            f"P{int(p) if p.is_integer() else p} connect time:", val))
+    print("{:<43} {:>8.2f} ms".format("Mean pool wait:",
+                                      metrics.mean_pool_wait_ms))
+    for p, val in metrics.percentiles_pool_wait_ms:
+        print("{:<43} {:>8.2f} ms".format(
+            f"P{int(p) if p.is_integer() else p} pool wait:", val))
 
     # 打印新增指标
+    # A growing schedule lag means the client could not keep up with the
+    # requested arrival rate, so the offered load was lower than intended.
+    print("-" * 55)
+    print("{:^55}".format(" Arrival Schedule "))
+    print("-" * 55)
+    if metrics.achieved_request_rate is None:
+        print("{:<43} {:>8}".format("Achieved request rate:", "n/a"))
+    else:
+        print("{:<40} {:>11.2f} req/s".format("Achieved request rate:",
+                                             metrics.achieved_request_rate))
+    print("{:<43} {:>8.2f} ms".format("Median schedule lag:",
+                                      metrics.median_schedule_lag_ms))
+    print("{:<43} {:>8.2f} ms".format("P99 schedule lag:",
+                                      metrics.p99_schedule_lag_ms))
+    print("{:<43} {:>8.2f} ms".format("Max schedule lag:",
+                                      metrics.max_schedule_lag_ms))
+
+    if replay_fidelity is not None:
+        # How closely the send times followed the recorded trace.
+        print("-" * 55)
+        print("{:^55}".format(" Trace Replay Fidelity "))
+        print("-" * 55)
+        for key, name in (("mean_replay_drift_ms", "Mean drift:"),
+                          ("median_replay_drift_ms", "Median drift:"),
+                          ("p99_replay_drift_ms", "P99 drift:"),
+                          ("max_replay_drift_ms", "Max drift:")):
+            print("{:<43} {:>8.2f} ms".format(name, replay_fidelity[key]))
+        print("{:<43} {:>8.2f} %".format(
+            f"Sent within {REPLAY_ON_TIME_MS:g} ms:",
+            replay_fidelity["replay_on_time_ratio"] * 100))
+        print("{:<43} {:>10.3f}".format("Replayed / recorded span:",
+                                        replay_fidelity["replay_span_ratio"]))
+
+    if phase_metrics is not None:
+        # The overall numbers above average over every phase of the load
+        # profile; this shows how the server behaved in each of them.
+        print("-" * 55)
+        print("{:^55}".format(" Load Profile Phases "))
+        print("-" * 55)
+        for phase in phase_metrics:
+            print(f"{phase['name']} [{phase['start']:g}s, {phase['end']:g}s)")
+            print("{:<43} {:>8}".format(
+                "  Requests (completed):",
+                f"{phase['requests']} ({phase['completed']})"))
+            print("{:<40} {:>11.2f} req/s".format("  Offered rate:",
+                                                 phase["offered_rate"]))
+            print("{:<40} {:>11.2f} req/s".format(
+                "  Request throughput:", phase["request_throughput"]))
+            print("{:<40} {:>11.2f} tok/s".format(
+                "  Output throughput:", phase["output_throughput"]))
+            for key, name in (("mean_ttft_ms", "  Mean TTFT:"),
+                              ("p99_ttft_ms", "  P99 TTFT:"),
+                              ("mean_tpot_ms", "  Mean TPOT:"),
+                              ("mean_e2el_ms", "  Mean E2EL:"),
+                              ("p99_e2el_ms", "  P99 E2EL:")):
+                print("{:<43} {:>8.2f} ms".format(name, phase[key]))
+
+    if metrics.num_users:
+        # In closed-loop mode every user waits for its own requests, so a
+        # server that favors some connections starves the other users.
+        print("-" * 55)
+        print("{:^55}".format(" Per-User Fairness "))
+        print("-" * 55)
+        print("{:<43} {:>8}".format("Users:", metrics.num_users))
+        print("{:<43} {:>8.3f}".format("Fairness index (output tok/s):",
+                                       metrics.user_fairness_index))
+        print("{:<40} {:>11.2f} req/s".format(
+            "Min user request throughput:",
+            metrics.min_user_request_throughput))
+        print("{:<40} {:>11.2f} req/s".format(
+            "Max user request throughput:",
+            metrics.max_user_request_throughput))
+        print("{:<43} {:>8.2f} ms".format("Min user mean E2EL:",
+                                          metrics.min_user_mean_e2el_ms))
+        print("{:<43} {:>8.2f} ms".format("Max user mean E2EL:",
+                                          metrics.max_user_mean_e2el_ms))
+
+    if server_stats is not None:
+        # What the server was doing while the latencies above were measured.
+        summary = server_stats["server_metrics"]
+        print("-" * 55)
+        print("{:^55}".format(" Server Metrics "))
+        print("-" * 55)
+        print("{:<43} {:>8}".format(
+            "Scrapes (failed):",
+            f"{summary['scrapes']} ({summary['failed_scrapes']})"))
+        for key, name, scale, unit in (
+            ("mean_num_requests_running", "Mean running requests:", 1, ""),
+            ("max_num_requests_running", "Max running requests:", 1, ""),
+            ("mean_num_requests_waiting", "Mean waiting requests:", 1, ""),
+            ("max_num_requests_waiting", "Max waiting requests:", 1, ""),
+            ("max_num_requests_swapped", "Max swapped requests:", 1, ""),
+            ("mean_kv_cache_usage", "Mean KV cache usage:", 100, "%"),
+            ("max_kv_cache_usage", "Max KV cache usage:", 100, "%"),
+            ("run_prefix_cache_hit_rate", "Prefix cache hit rate:", 100,
+             "%"),
+            ("mean_prefix_cache_hit_rate", "Prefix cache hit rate:", 100,
+             "%"),
+            ("delta_num_preemptions", "Preemptions:", 1, ""),
+        ):
+            if key in summary:
+                if (key == "mean_prefix_cache_hit_rate"
+                        and "run_prefix_cache_hit_rate" in summary):
+                    continue
+                print("{:<43} {:>8.2f}{}".format(name, summary[key] * scale,
+                                                 unit))
+
+    if steady_state is not None:
+        # The numbers above average over ramp-up and drain as well.
+        print("-" * 55)
+        print("{:^55}".format(" Steady State "))
+        print("-" * 55)
+        if steady_state["stopped_at"] is not None:
+            print("{:<43} {:>8.2f} s".format("Run stopped early at:",
+                                             steady_state["stopped_at"]))
+        if not steady_state["detected"]:
+            print("Not detected: the run is too short for enough windows.")
+        else:
+            print("{:<30} {:>18}".format(
+                "Window:", f"[{steady_state['start']:.2f}, "
+                f"{steady_state['end']:.2f}) s"))
+            print("{:<43} {:>8}".format(
+                "Settled:", "yes" if steady_state["settled"] else "no"))
+            print("{:<30} {:>18}".format(
+                "Request throughput (req/s):",
+                f"{steady_state['request_throughput']:.2f} +- "
+                f"{steady_state['request_throughput_ci']:.2f}"))
+            output_ci = steady_state["output_throughput_ci"]
+            print("{:<30} {:>18}".format(
+                "Output throughput (tok/s):",
+                f"{steady_state['output_throughput']:.2f}" +
+                (f" +- {output_ci:.2f}" if output_ci is not None else "")))
+            for key, value in steady_state.items():
+                if key.endswith("_ms"):
+                    stat, metric, _ = key.split("_")
+                    print("{:<43} {:>8.2f} ms".format(
+                        f"{stat.capitalize()} {metric.upper()}:", value))
+
     print("-" * 55)
     print("{:^55}".format(" Additional Token Generation Metrics "))
     print("-" * 55)
@@ -454,6 +1425,41 @@ async def benchmark(
     print("{:<43} {:>8.2f} ms".format("P99 other token time:", additional_metrics["p99_other_token_time"]))
     print("-" * 55)
 
+    if harness_stats is not None:
+        # Time the client's event loop was busy elsewhere is counted in the
+        # latencies of every stream it was reading.
+        print("{:^55}".format(" Benchmark Client "))
+        print("-" * 55)
+        print("{:<43} {:>8.2f} ms".format("Mean event loop lag:",
+                                          harness_stats["mean_loop_lag_ms"]))
+        print("{:<43} {:>8.2f} ms".format("P99 event loop lag:",
+                                          harness_stats["p99_loop_lag_ms"]))
+        print("{:<43} {:>8.2f} ms".format("Max event loop lag:",
+                                          harness_stats["max_loop_lag_ms"]))
+        print("{:<43} {:>8.2f}%".format(
+            "Mean CPU utilization:",
+            harness_stats["mean_client_cpu_util"] * 100))
+        print("{:<43} {:>8.2f}%".format(
+            "Max CPU utilization:",
+            harness_stats["max_client_cpu_util"] * 100))
+        print("{:<43} {:>8}".format("GC collections:",
+                                    harness_stats["gc_collections"]))
+        print("{:<43} {:>8.2f} ms".format("Total GC pause:",
+                                          harness_stats["total_gc_pause_ms"]))
+        print("{:<43} {:>8.2f} ms".format("Max GC pause:",
+                                          harness_stats["max_gc_pause_ms"]))
+        print("-" * 55)
+        if harness_stats["suspect_metrics"]:
+            print("WARNING: the benchmark client may have distorted the "
+                  "results:")
+            for reason in harness_stats["saturation_reasons"]:
+                print(f"  - {reason}")
+            print("Suspect metrics: " +
+                  ", ".join(harness_stats["suspect_metrics"]))
+            print("Lower the load per process, e.g. with --num-workers, or "
+                  "use --discard-generated-text.")
+            print("-" * 55)
+
     return result
 
 def check_goodput_args(args):
@@ -501,7 +1507,11 @@ def save_to_pytorch_benchmark_format(args: argparse.Namespace,
     ]
     # These raw data might be useful, but they are rather big. They can be added
     # later if needed
-    ignored_metrics = ["ttfts", "itls", "generated_texts", "errors"]
+    ignored_metrics = [
+        "ttfts", "itls", "generated_texts", "errors", "connect_times",
+        "pool_waits", "schedule_lags", "queue_waits", "user_ids",
+        "gpu_samples", "server_metrics_series"
+    ]
     pt_records = convert_to_pytorch_benchmark_format(
         args=args,
         metrics={k: [results[k]]
@@ -543,54 +1553,319 @@ def main(args: argparse.Namespace):
             "Please specify '--dataset-name' and the corresponding "
             "'--dataset-path' if required.")
 
+    if args.dataset_name == "sonnet" and backend != "openai-chat":
+        # For the "sonnet" dataset, formatting depends on the backend.
+        assert tokenizer.chat_template, (
+            "Tokenizer/model must have chat template for sonnet dataset.")
+
+    if (args.random_prompt_format == "token-ids"
+            and args.dataset_name in ("random", "trace")
+            and ASYNC_REQUEST_FUNCS[backend] is not
+            async_request_openai_completions):
+        raise ValueError(
+            "--random-prompt-format token-ids is only supported by the "
+            "OpenAI Completions API backends, got --backend "
+            f"{backend}. Use exact-text for text-only endpoints.")
+
+    # For datasets that follow a similar structure, use a mapping from
+    # the dataset name to the dataset and its sampling arguments.
+    dataset_mapping = {
+        "sharegpt":
+        lambda: (ShareGPTDataset(random_seed=args.seed,
+                                 dataset_path=args.dataset_path),
+                 dict(output_len=args.sharegpt_output_len,
+                      num_proc=args.dataset_num_proc)),
+        "burstgpt":
+        lambda: (BurstGPTDataset(random_seed=args.seed,
+                                 dataset_path=args.dataset_path),
+                 dict(num_proc=args.dataset_num_proc)),
+        "sonnet":
+        lambda: (SonnetDataset(random_seed=args.seed,
+                               dataset_path=args.dataset_path),
+                 dict(
+                     input_len=args.sonnet_input_len,
+                     output_len=args.sonnet_output_len,
+                     prefix_len=args.sonnet_prefix_len,
+                     return_prompt_formatted=backend != "openai-chat",
+                     num_proc=args.dataset_num_proc,
+                 )),
+        "hf":
+        lambda: (HuggingFaceDataset(random_seed=args.seed,
+                                    dataset_path=args.dataset_path,
+                                    dataset_subset=args.hf_subset,
+                                    dataset_split=args.hf_split),
+                 dict(output_len=args.hf_output_len,
+                      num_proc=args.dataset_num_proc)),
+        "trace":
+        lambda: (TraceDataset(random_seed=args.seed,
+                              dataset_path=args.dataset_path),
+                 dict(prompt_format=args.random_prompt_format,
+                      num_proc=args.dataset_num_proc)),
+        "random":
+        lambda: (RandomDataset(dataset_path=args.dataset_path),
+                 dict(
+                     prefix_len=args.random_prefix_len,
+                     input_len=args.random_input_len,
+                     output_len=args.random_output_len,
+                     range_ratio=args.random_range_ratio,
+                     num_proc=args.dataset_num_proc,
+                     prompt_format=args.random_prompt_format,
+                 ))
+    }
 
+    try:
+        dataset, sample_kwargs = dataset_mapping[args.dataset_name]()
+    except KeyError as err:
+        raise ValueError(f"Unknown dataset: {args.dataset_name}") from err
+
+    arrival_times = None
+    phases = None
+    if args.load_profile is not None:
+        if isinstance(dataset, TraceDataset):
+            raise ValueError("--load-profile cannot be combined with a "
+                             "trace replay.")
+        profile = LoadProfile.from_spec(args.load_profile)
+        arrival_times = profile.arrival_times()
+        if not arrival_times:
+            raise ValueError("The load profile produced no requests.")
+        phases = profile.phases
+        print(f"Load profile: {len(arrival_times)} requests over "
+              f"{profile.duration:g} s in {len(phases)} phases; "
+              "--num-prompts, --request-rate and --burstiness are "
+              "ignored.")
+        args.num_prompts = len(arrival_times)
+    elif isinstance(dataset, TraceDataset):
+        if args.num_prompts > len(dataset):
+            print(f"The trace has {len(dataset)} requests, replaying all "
+                  f"of them instead of --num-prompts {args.num_prompts}.")
+            args.num_prompts = len(dataset)
+        if args.request_rate != float("inf"):
+            print("--request-rate and --burstiness are ignored when "
+                  "replaying a trace.")
+        arrival_times = dataset.arrival_times(args.num_prompts,
+                                              args.trace_time_scale)
+
+    cached_requests = None
+    if args.dataset_cache_dir:
+        # num_proc only changes how the prompts are computed.
+        cache_key = dataset_cache_key(
+            dataset_name=args.dataset_name,
+            sample_params={
+                "dataset_path": args.dataset_path,
+                "dataset_seed": dataset.random_seed,
+                **{
+                    k: v
+                    for k, v in sample_kwargs.items() if k != "num_proc"
+                },
+            },
+            num_requests=args.num_prompts,
+            seed=args.seed,
+            tokenizer=tokenizer)
+        cached_requests = load_cached_dataset(args.dataset_cache_dir,
+                                              cache_key)
+
+    if cached_requests is not None:
+        print(f"Loaded {len(cached_requests)} requests from the dataset "
+              f"cache {cached_requests.path}")
+        cached_requests.restore_rng_state()
+        input_requests = cached_requests
     else:
-        # For datasets that follow a similar structure, use a mapping.
-        dataset_mapping = {
-            "random":
-            lambda: RandomDataset(dataset_path=args.dataset_path).sample(
-                tokenizer=tokenizer,
-                num_requests=args.num_prompts,
-                prefix_len=args.random_prefix_len,
-                input_len=args.random_input_len,
-                output_len=args.random_output_len,
-                range_ratio=args.random_range_ratio,
-            )
-        }
+        input_requests = dataset.iter_samples(
+            tokenizer=tokenizer,
+            num_requests=args.num_prompts,
+            **sample_kwargs)
+        if args.dataset_cache_dir:
+            input_requests = cache_samples(input_requests,
+                                           args.dataset_cache_dir,
+                                           cache_key)
+        # A saturation search sends the same requests in every probe.
+        if args.dataset_prefetch > 0 and args.search is None:
+            input_requests = PrefetchIterator(
+                input_requests, max_buffered=args.dataset_prefetch)
+        else:
+            input_requests = list(input_requests)
 
-        try:
-            input_requests = dataset_mapping[args.dataset_name]()
-        except KeyError as err:
-            raise ValueError(f"Unknown dataset: {args.dataset_name}") from err
     goodput_config_dict = check_goodput_args(args)
+    closed_loop = None
+    if args.num_users is not None:
+        if args.num_users < 1:
+            raise ValueError("--num-users must be at least 1.")
+        if arrival_times is not None or args.search is not None:
+            raise ValueError("--num-users cannot be combined with a trace "
+                             "replay, a load profile or --search.")
+        if args.max_concurrency is not None:
+            raise ValueError("--num-users already bounds the concurrency; "
+                             "drop --max-concurrency.")
+        closed_loop = ClosedLoop(
+            users=list(range(args.num_users)),
+            think_times=get_think_times(args.num_prompts, args.think_time,
+                                        args.think_time_distribution),
+            user_ids=([i % args.num_users for i in range(args.num_prompts)]
+                      if args.per_user_prompts else None))
+    if args.warmup_seconds < 0 or args.cooldown_seconds < 0:
+        raise ValueError("--warmup-seconds and --cooldown-seconds must not "
+                         "be negative.")
+    if args.duration is not None:
+        if args.duration <= 0:
+            raise ValueError("--duration must be positive.")
+        if arrival_times is not None or args.search is not None:
+            raise ValueError("--duration cannot be combined with a trace "
+                             "replay, a load profile or --search.")
+        unbounded = (closed_loop is not None
+                     or args.request_rate == float("inf"))
+        if unbounded and args.num_workers > 1:
+            raise ValueError("--duration with --num-workers needs a finite "
+                             "--request-rate and no --num-users.")
+        if (args.request_rate == float("inf") and closed_loop is None
+                and args.max_concurrency is None):
+            raise ValueError("--duration with an infinite --request-rate "
+                             "needs --max-concurrency or --num-users.")
+    elif (args.warmup_seconds or args.cooldown_seconds) and (
+            arrival_times is not None or args.search is not None):
+        raise ValueError("--warmup-seconds and --cooldown-seconds cannot be "
+                         "combined with a trace replay, a load profile or "
+                         "--search.")
+    steady_state_monitor = None
+    if args.steady_state or args.steady_state_early_stop:
+        if args.steady_state_early_stop and args.num_workers > 1:
+            raise ValueError("--steady-state-early-stop needs a single "
+                             "process; drop --num-workers.")
+        steady_state_monitor = SteadyStateMonitor(
+            window=args.steady_state_window,
+            tolerance=args.steady_state_tolerance,
+            min_windows=args.steady_state_min_windows)
+    if ((args.live_metrics_file or args.openmetrics_file)
+            and args.num_workers > 1):
+        raise ValueError("--live-metrics-file and --openmetrics-file need a "
+                         "single process; drop --num-workers.")
+    gpu_ids = None
+    if args.gpu_supervised:
+        gpu_ids = [int(gpu_id) for gpu_id in args.gpu_supervised.split(",")]
+    if args.search is not None:
+        if not goodput_config_dict:
+            raise ValueError("--search needs the SLOs given by --goodput.")
+        if arrival_times is not None:
+            raise ValueError("--search cannot be combined with a trace "
+                             "replay or a load profile.")
 
     # Avoid GC processing "static" data - reduce pause times.
     gc.collect()
     gc.freeze()
 
-    benchmark_result = asyncio.run(
-        benchmark(
-            backend=backend,
-            api_url=api_url,
-            base_url=base_url,
-            model_id=model_id,
-            model_name=model_name,
-            tokenizer=tokenizer,
-            input_requests=input_requests,
-            logprobs=args.logprobs,
-            request_rate=args.request_rate,
-            burstiness=args.burstiness,
-            disable_tqdm=args.disable_tqdm,
-            profile=args.profile,
-            selected_percentile_metrics=args.percentile_metrics.split(","),
-            selected_percentiles=[
-                float(p) for p in args.metric_percentiles.split(",")
-            ],
-            ignore_eos=args.ignore_eos,
-            goodput_config_dict=goodput_config_dict,
-            max_concurrency=args.max_concurrency,
-            lora_modules=args.lora_modules,
-        ))
+    def run_benchmark(request_rate: float,
+                      max_concurrency: Optional[int]) -> dict[str, Any]:
+        return asyncio.run(
+            benchmark(
+                backend=backend,
+                api_url=api_url,
+                base_url=base_url,
+                model_id=model_id,
+                model_name=model_name,
+                tokenizer=tokenizer,
+                input_requests=input_requests,
+                logprobs=args.logprobs,
+                request_rate=request_rate,
+                burstiness=args.burstiness,
+                disable_tqdm=args.disable_tqdm,
+                profile=args.profile,
+                selected_percentile_metrics=args.percentile_metrics.split(","),
+                selected_percentiles=[
+                    float(p) for p in args.metric_percentiles.split(",")
+                ],
+                ignore_eos=args.ignore_eos,
+                goodput_config_dict=goodput_config_dict,
+                max_concurrency=max_concurrency,
+                lora_modules=args.lora_modules,
+                conn_limit=args.conn_limit,
+                conn_limit_per_host=args.conn_limit_per_host,
+                keepalive_timeout=args.keepalive_timeout,
+                dns_cache_ttl=args.dns_cache_ttl,
+                num_workers=args.num_workers,
+                exact_percentiles=args.exact_percentiles,
+                sketch_relative_accuracy=args.sketch_relative_accuracy,
+                discard_generated_text=args.discard_generated_text,
+                num_requests=args.num_prompts,
+                arrival_times=arrival_times,
+                phases=phases,
+                closed_loop=closed_loop,
+                duration=args.duration,
+                warmup_seconds=args.warmup_seconds,
+                cooldown_seconds=args.cooldown_seconds,
+                steady_state_monitor=steady_state_monitor,
+                steady_state_early_stop=args.steady_state_early_stop,
+                live_metrics=(LiveMetrics(
+                    interval=args.live_metrics_interval,
+                    series_path=args.live_metrics_file,
+                    openmetrics_path=args.openmetrics_file,
+                    percentiles=tuple(
+                        float(p) for p in args.metric_percentiles.split(",")),
+                    relative_accuracy=args.sketch_relative_accuracy,
+                ) if args.live_metrics_file or args.openmetrics_file else
+                              None),
+                # Every run samples into its own telemetry.
+                gpu_telemetry=(GpuTelemetry(
+                    create_source(args.gpu_telemetry_source,
+                                  args.gpu_smi_command),
+                    gpu_ids,
+                    interval=args.gpu_telemetry_interval)
+                               if gpu_ids is not None else None),
+                server_metrics=(ServerMetricsScraper(
+                    args.server_metrics_url or f"{base_url}/metrics",
+                    interval=args.server_metrics_interval)
+                                if args.scrape_server_metrics else None),
+                # Worker processes run loops of their own, which this one
+                # cannot observe.
+                harness_monitor=(HarnessMonitor(
+                    interval=args.harness_monitor_interval)
+                                 if args.num_workers == 1
+                                 and not args.disable_harness_monitor else
+                                 None),
+            ))
+
+    if args.search is None:
+        benchmark_result = run_benchmark(args.request_rate,
+                                         args.max_concurrency)
+    else:
+        # The tokenizer and the sampled requests are reused by every probe.
+        by_concurrency = args.search == "max-concurrency"
+
+        def run_probe(value: float) -> dict[str, Any]:
+            # Every probe draws the same arrival schedule from the seed.
+            np.random.seed(args.seed)
+            if by_concurrency:
+                return run_benchmark(args.request_rate, int(value))
+            return run_benchmark(value, args.max_concurrency)
+
+        knee, probes = search_saturation(
+            run_probe=run_probe,
+            num_requests=args.num_prompts,
+            low=args.search_min,
+            high=args.search_max,
+            min_good_ratio=args.search_min_good_ratio,
+            growth=args.search_growth,
+            tolerance=args.search_tolerance,
+            integer=by_concurrency,
+        )
+        print_search_results(args.search, knee, probes)
+        # The saved result is the run at the knee, or at the lowest value
+        # if none passed, with the whole curve attached.
+        reported = knee or min(probes, key=lambda probe: probe.value)
+        if by_concurrency:
+            args.max_concurrency = int(reported.value)
+        else:
+            args.request_rate = reported.value
+        benchmark_result = {
+            **reported.result,
+            "saturation_search": {
+                "parameter": args.search,
+                "knee": knee.value if knee is not None else None,
+                "min_good_ratio": args.search_min_good_ratio,
+                "curve": [
+                    probe.curve_point()
+                    for probe in sorted(probes, key=lambda p: p.value)
+                ],
+            },
+        }
 
     # Save config and results to json
     if args.save_result:
@@ -615,24 +1890,40 @@ def main(args: argparse.Namespace):
                         "Invalid metadata format. Please use KEY=VALUE format."
                     )
 
-        if not args.save_detailed:
-            # Remove fields with too many data points
-            for field in [
-                    "input_lens", "output_lens", "ttfts", "itls",
-                    "generated_texts", "errors"
-            ]:
-                if field in result_json:
-                    del result_json[field]
 
         # Traffic
         result_json["request_rate"] = (args.request_rate if args.request_rate
                                        < float("inf") else "inf")
         result_json["burstiness"] = args.burstiness
         result_json["max_concurrency"] = args.max_concurrency
+        if phases is not None:
+            result_json["load_profile"] = args.load_profile
+        elif arrival_times is not None:
+            result_json["trace_time_scale"] = args.trace_time_scale
+        if args.duration is not None:
+            result_json["run_duration"] = args.duration
+        result_json["warmup_seconds"] = args.warmup_seconds
+        result_json["cooldown_seconds"] = args.cooldown_seconds
+        if closed_loop is not None:
+            result_json["think_time"] = args.think_time
+            result_json["think_time_distribution"] = (
+                args.think_time_distribution)
+            result_json["per_user_prompts"] = args.per_user_prompts
 
         # Merge with benchmark result
         result_json = {**result_json, **benchmark_result}
 
+        if not args.save_detailed:
+            # Remove fields with too many data points
+            for field in [
+                    "input_lens", "output_lens", "ttfts", "itls",
+                    "generated_texts", "errors", "connect_times", "pool_waits",
+                    "schedule_lags", "queue_waits", "user_ids",
+                    "gpu_samples", "server_metrics_series"
+            ]:
+                if field in result_json:
+                    del result_json[field]
+
         # Save to file
         base_model_id = model_id.split("/")[-1]
         max_concurrency_str = (f"-concurrency{args.max_concurrency}"
@@ -675,13 +1966,14 @@ if __name__ == "__main__":
         "--dataset-name",
         type=str,
         default="sharegpt",
-        choices=["sharegpt", "burstgpt", "sonnet", "random", "hf"],
+        choices=["sharegpt", "burstgpt", "sonnet", "random", "hf", "trace"],
         help="Name of the dataset to benchmark on.",
     )
     parser.add_argument("--dataset-path",
                         type=str,
                         default=None,
-                        help="Path to the sharegpt/sonnet dataset. "
+                        help="Path to the sharegpt/sonnet dataset or to the "
+                        "CSV/JSONL request trace. "
                         "Or the huggingface dataset ID if using HF dataset.")
     parser.add_argument(
         "--max-concurrency",
@@ -713,7 +2005,34 @@ if __name__ == "__main__":
         "--num-prompts",
         type=int,
         default=1000,
-        help="Number of prompts to process.",
+        help="Number of prompts to process. With --duration, the number of "
+        "prompts sampled and cycled through until the run ends.",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="Send requests for this many seconds instead of stopping after "
+        "--num-prompts. Requests in flight when the time expires are still "
+        "awaited. With an infinite --request-rate, requires "
+        "--max-concurrency or --num-users.",
+    )
+    parser.add_argument(
+        "--warmup-seconds",
+        type=float,
+        default=0.0,
+        help="Exclude the requests that start during the first seconds of "
+        "the run from the metrics. Throughput is computed over the "
+        "measurement window that remains.",
+    )
+    parser.add_argument(
+        "--cooldown-seconds",
+        type=float,
+        default=0.0,
+        help="Exclude the requests that finish during the last seconds of "
+        "the run, which keep the load on while the measured requests "
+        "complete. Counted back from --duration, or from the end of the "
+        "run without it.",
     )
     parser.add_argument(
         "--logprobs",
@@ -746,7 +2065,49 @@ if __name__ == "__main__":
         "bursty requests. A higher burstiness value (burstiness > 1) "
         "results in a more uniform arrival of requests.",
     )
+    parser.add_argument(
+        "--load-profile",
+        type=str,
+        default=None,
+        help="Time-varying request rate, as a JSON list of phases or the "
+        "path to a JSON file holding one, e.g. '[{\"type\": \"ramp\", "
+        "\"start_rate\": 1, \"end_rate\": 20, \"duration\": 60}]'. "
+        "Phase types are constant, ramp, steps, diurnal and spike; see "
+        "load_profiles.py. Arrivals follow a non-homogeneous Poisson process "
+        "and metrics are also reported per phase. Replaces --request-rate, "
+        "--burstiness and --num-prompts.")
     parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--dataset-num-proc",
+        "--random-num-proc",
+        type=int,
+        default=1,
+        help="Number of processes that tokenize the candidate prompts of the "
+        "sharegpt, sonnet and hf datasets, or decode the prompts of the "
+        "random and burstgpt datasets. Batches are already processed in "
+        "parallel by fast tokenizers, so this mainly helps slow tokenizers "
+        "and long prompts.")
+    parser.add_argument(
+        "--dataset-cache-dir",
+        type=str,
+        default=None,
+        help="Directory of a persistent cache of sampled datasets. The "
+        "requests are stored under a key derived from the dataset, its "
+        "sampling options, --num-prompts, --seed and the tokenizer, and "
+        "later runs with the same key memory-map them instead of sampling "
+        "again. Disabled by default.")
+    parser.add_argument(
+        "--dataset-prefetch",
+        type=int,
+        default=0,
+        help="Generate the requests while the benchmark runs, in a "
+        "background thread that stays up to this many requests ahead of the "
+        "dispatcher, instead of sampling the whole dataset before the run "
+        "starts. The requests are the same for a given seed. If generation "
+        "cannot keep up with the request rate, the delay shows up as "
+        "schedule lag; the dispatcher waits without blocking the event "
+        "loop, so the requests in flight are not delayed. 0 (default) "
+        "samples everything up front.")
     parser.add_argument(
         "--trust-remote-code",
         action="store_true",
@@ -831,6 +2192,36 @@ if __name__ == "__main__":
         "\"ttft\", \"tpot\", \"e2el\". For more context on the definition of "
         "goodput, refer to DistServe paper: https://arxiv.org/pdf/2401.09670 "
         "and the blog: https://hao-ai-lab.github.io/blogs/distserve")
+    parser.add_argument(
+        "--exact-percentiles",
+        action="store_true",
+        help="Compute latency percentiles from every sample instead of from "
+        "bounded-memory sketches. This keeps every inter-token latency in "
+        "memory until the end of the run, which can take gigabytes on long "
+        "runs. Without it, per-request ITLs are not kept for --save-detailed.")
+    parser.add_argument(
+        "--discard-generated-text",
+        action="store_true",
+        help="Do not keep the generated text of each request, only its "
+        "timings. Backends that do not report the number of output tokens "
+        "are then credited with one token per streamed chunk.")
+    parser.add_argument(
+        "--disable-harness-monitor",
+        action="store_true",
+        help="Do not measure the event loop lag, CPU utilization and GC "
+        "pauses of the benchmark client, nor warn when they may have "
+        "distorted the results. Only a single process is monitored.")
+    parser.add_argument(
+        "--harness-monitor-interval",
+        type=float,
+        default=0.01,
+        help="Seconds between two samples of the event loop lag.")
+    parser.add_argument(
+        "--sketch-relative-accuracy",
+        type=float,
+        default=DEFAULT_RELATIVE_ACCURACY,
+        help="Relative error bound of the percentiles reported from latency "
+        "sketches. Means and standard deviations are always exact.")
 
     # group for dataset specific arguments
     sonnet_group = parser.add_argument_group("sonnet dataset options")
@@ -894,6 +2285,196 @@ if __name__ == "__main__":
         " context. The length range of context in a random "
         " request is [random-prefix-len, "
         " random-prefix-len + random-prefix-len * random-range-ratio).")
+    random_group.add_argument(
+        "--random-prompt-format",
+        type=str,
+        default=RandomDataset.DEFAULT_PROMPT_FORMAT,
+        choices=RandomDataset.PROMPT_FORMATS,
+        help="How random and trace prompts are sent. \"text\" decodes the "
+        "random token IDs to text, which the server may tokenize to a slightly "
+        "different length than the one recorded. \"exact-text\" re-encodes "
+        "and trims the decoded prompts so that the recorded input length is "
+        "exact. \"token-ids\" sends the token IDs themselves, which skips "
+        "decoding and is only supported by the OpenAI Completions API.")
+
+    search_group = parser.add_argument_group("saturation search options")
+    search_group.add_argument(
+        "--search",
+        type=str,
+        default=None,
+        choices=SEARCH_PARAMETERS,
+        help="Search for the highest request rate or max concurrency at "
+        "which the --goodput SLOs are still met. The parameter is doubled "
+        "from --search-min until a run misses the SLOs, then bisected. "
+        "Every run reuses the tokenizer and the sampled requests, and the "
+        "knee and the throughput-vs-latency curve are reported.")
+    search_group.add_argument("--search-min",
+                              type=float,
+                              default=1.0,
+                              help="Lowest value tried by --search.")
+    search_group.add_argument("--search-max",
+                              type=float,
+                              default=1024.0,
+                              help="Highest value tried by --search.")
+    search_group.add_argument(
+        "--search-growth",
+        type=float,
+        default=2.0,
+        help="Factor the searched value grows by until a run fails.")
+    search_group.add_argument(
+        "--search-tolerance",
+        type=float,
+        default=0.05,
+        help="Relative gap between the passing and the failing request "
+        "rate at which the bisection stops. A max concurrency is bisected "
+        "down to adjacent values.")
+    search_group.add_argument(
+        "--search-min-good-ratio",
+        type=float,
+        default=0.9,
+        help="Share of the requests that must complete within every "
+        "--goodput SLO for a run to pass.")
+
+    gpu_group = parser.add_argument_group("GPU monitoring options")
+    gpu_group.add_argument(
+        "--gpu-supervised",
+        type=str,
+        default=None,
+        help="Comma-separated IDs of the GPUs to monitor during the run, "
+        "e.g. 0,1,3. Their utilization, memory and power over the "
+        "measurement window are reported under GPU Statistics, together "
+        "with the output tokens per joule.")
+    gpu_group.add_argument(
+        "--gpu-telemetry-source",
+        type=str,
+        default="auto",
+        choices=TELEMETRY_SOURCES,
+        help="Where the GPU readings come from. \"auto\" uses NVML if pynvml "
+        "is installed, else nvidia-smi, else hy-smi (Hygon DCUs). \"fake\" "
+        "produces synthetic readings.")
+    gpu_group.add_argument(
+        "--gpu-smi-command",
+        type=str,
+        default=None,
+        help="Command run instead of nvidia-smi or hy-smi, e.g. "
+        "\"python fake_smi.py nvidia-smi\" to test without accelerators.")
+    gpu_group.add_argument(
+        "--gpu-telemetry-interval",
+        type=float,
+        default=0.1,
+        help="Seconds between two GPU readings.")
+
+    server_metrics_group = parser.add_argument_group("server metrics options")
+    server_metrics_group.add_argument(
+        "--scrape-server-metrics",
+        action="store_true",
+        help="Poll the server's Prometheus endpoint during the run and "
+        "report its running and waiting requests, KV cache usage, prefix "
+        "cache hit rate and preemptions. The time series is saved with "
+        "--save-detailed.")
+    server_metrics_group.add_argument(
+        "--server-metrics-url",
+        type=str,
+        default=None,
+        help="URL of the Prometheus endpoint. Defaults to /metrics on the "
+        "server being benchmarked.")
+    server_metrics_group.add_argument(
+        "--server-metrics-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between two scrapes of the server metrics.")
+
+    live_group = parser.add_argument_group("live metrics options")
+    live_group.add_argument(
+        "--live-metrics-file",
+        type=str,
+        default=None,
+        help="Append the metrics of every --live-metrics-interval to this "
+        "time series while the run is in progress: requests started, "
+        "finished and in flight, request and token rates and TTFT/ITL "
+        "percentiles (--metric-percentiles). JSONL if the name ends with "
+        ".jsonl, CSV otherwise.")
+    live_group.add_argument(
+        "--openmetrics-file",
+        type=str,
+        default=None,
+        help="Rewrite this OpenMetrics text file every "
+        "--live-metrics-interval with the running totals and the latest "
+        "window, e.g. for the node_exporter textfile collector.")
+    live_group.add_argument(
+        "--live-metrics-interval",
+        type=float,
+        default=1.0,
+        help="Seconds per live metrics window.")
+
+    steady_group = parser.add_argument_group("steady-state options")
+    steady_group.add_argument(
+        "--steady-state",
+        action="store_true",
+        help="Detect when the completion and output token rates settle, "
+        "cutting the ramp-up and drain with the MSER rule, and report the "
+        "throughput and latency percentiles of the steady state next to "
+        "the whole-run numbers.")
+    steady_group.add_argument(
+        "--steady-state-early-stop",
+        action="store_true",
+        help="Stop sending requests once the steady-state rates are known "
+        "within --steady-state-tolerance. Implies --steady-state.")
+    steady_group.add_argument(
+        "--steady-state-window",
+        type=float,
+        default=1.0,
+        help="Seconds per window over which the rates are counted.")
+    steady_group.add_argument(
+        "--steady-state-tolerance",
+        type=float,
+        default=0.05,
+        help="Relative half-width of the 95%% confidence interval of the "
+        "steady-state rates below which they count as settled.")
+    steady_group.add_argument(
+        "--steady-state-min-windows",
+        type=int,
+        default=20,
+        help="Least number of steady windows before the steady state is "
+        "reported. At least 10, the number of batch means.")
+
+    closed_loop_group = parser.add_argument_group("closed-loop options")
+    closed_loop_group.add_argument(
+        "--num-users",
+        type=int,
+        default=None,
+        help="Run in closed-loop mode with this many virtual users. Each "
+        "user sends its next request only once its previous one finished "
+        "and its think time elapsed, so the load follows the server's "
+        "speed. Replaces --request-rate, --burstiness and "
+        "--max-concurrency; per-user fairness statistics are reported.")
+    closed_loop_group.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="Mean seconds a virtual user waits after a response before "
+        "sending its next request.")
+    closed_loop_group.add_argument(
+        "--think-time-distribution",
+        type=str,
+        default="constant",
+        choices=["constant", "exponential"],
+        help="Distribution of the think times, drawn from --seed.")
+    closed_loop_group.add_argument(
+        "--per-user-prompts",
+        action="store_true",
+        help="Give every virtual user its own prompt stream, request i going "
+        "to user i mod --num-users. By default the users take their next "
+        "prompt from one shared stream.")
+
+    trace_group = parser.add_argument_group("trace dataset options")
+    trace_group.add_argument(
+        "--trace-time-scale",
+        type=float,
+        default=1.0,
+        help="Speed-up applied to the recorded arrival times of the trace, "
+        "e.g. 10 replays it ten times faster. Prompt and output lengths are "
+        "kept. --request-rate and --burstiness are ignored.")
 
     hf_group = parser.add_argument_group("hf dataset options")
     hf_group.add_argument("--hf-subset",
@@ -937,6 +2518,42 @@ if __name__ == "__main__":
                         "launching the server. For each request, the "
                         "script chooses a LoRA module at random.")
 
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="Number of client processes to shard the requests across. "
+        "Each process runs its own event loop and connection pool, while "
+        "the arrival schedule, --request-rate and --max-concurrency are "
+        "still applied globally. Use this when a single client process "
+        "cannot keep up with the target concurrency.")
+
+    conn_group = parser.add_argument_group("client connection pool options")
+    conn_group.add_argument(
+        "--conn-limit",
+        type=int,
+        default=DEFAULT_CONN_LIMIT,
+        help="Maximum number of simultaneous connections in the client "
+        "session pool. 0 means unlimited.")
+    conn_group.add_argument(
+        "--conn-limit-per-host",
+        type=int,
+        default=DEFAULT_CONN_LIMIT_PER_HOST,
+        help="Maximum number of simultaneous connections to the same "
+        "endpoint. 0 means unlimited.")
+    conn_group.add_argument(
+        "--keepalive-timeout",
+        type=float,
+        default=DEFAULT_KEEPALIVE_TIMEOUT,
+        help="Seconds an idle pooled connection is kept open for reuse. "
+        "0 closes every connection after its request.")
+    conn_group.add_argument(
+        "--dns-cache-ttl",
+        type=int,
+        default=DEFAULT_DNS_CACHE_TTL,
+        help="Seconds resolved host names are cached by the client. "
+        "0 disables the DNS cache.")
+
     args = parser.parse_args()
 
     main(args)
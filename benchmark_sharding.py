@@ -0,0 +1,534 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Multi-process load generation for very high concurrency.
+
+A single asyncio event loop saturates one CPU core after a few thousand
+concurrent streams, at which point the client rather than the server sets
+TTFT and ITL. This module splits the requests and their arrival schedule
+across several worker processes, each with its own event loop and pooled
+client session, and merges the results back in request order.
+
+The global request rate is preserved because the parent computes the arrival
+schedule once and every worker dispatches its share against the same start
+time, using the same absolute-deadline dispatcher as a single-process run.
+``time.perf_counter`` is backed by the system-wide monotonic clock on Linux,
+so deadlines and timestamps are comparable across the processes.
+``--max-concurrency`` is enforced by a semaphore shared by all workers.
+In closed-loop mode the virtual users are dealt to the workers instead, and
+each worker runs its users against the shared start time.
+"""
+
+import asyncio
+import gc
+import itertools
+import multiprocessing
+import queue
+import time
+from collections.abc import AsyncIterable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Union
+
+from backend_request_func import (ASYNC_REQUEST_FUNCS, RequestFuncInput,
+                                  create_client_session)
+from latency_sketch import TokenLatencySketches
+from live_metrics import LiveMetrics
+from request_records import RequestRecords
+from tqdm.asyncio import tqdm
+
+# Delay between the last worker reporting ready and the first request, so
+# that every worker observes the start signal before its first deadline.
+SHARD_START_DELAY = 0.05
+# How often the parent refreshes the progress bar while workers run.
+SHARD_PROGRESS_INTERVAL = 0.2
+
+
+@dataclass
+class ClosedLoop:
+    """
+    Closed-loop load: every virtual user sends its next request only once
+    its previous one finished and its think time elapsed.
+    """
+    # Virtual users driven by this process.
+    users: list[int]
+    # Seconds the user waits after request i before sending its next one.
+    # A timed run cycles through the requests, and their think times.
+    think_times: list[float]
+    # User of request i, or None if the users take their next request from
+    # one shared stream.
+    user_ids: Optional[list[int]] = None
+
+
+@dataclass
+class ShardPlan:
+    """The part of a benchmark run that is executed by one worker process."""
+    worker_id: int
+    backend: str
+    # Positions of the requests in the original request list.
+    indices: list[int]
+    request_inputs: list[RequestFuncInput]
+    # Intended send times, in seconds relative to the shared start time.
+    arrival_times: list[float]
+    session_kwargs: dict[str, Any]
+    # Relative accuracy of the worker's ITL sketches, None for exact mode.
+    sketch_accuracy: Optional[float]
+    keep_text: bool
+    # Size of the worker's dispatch pool; the global limit itself is
+    # enforced by a semaphore shared by all workers.
+    max_concurrency: Optional[int]
+    # The worker's virtual users in closed-loop mode.
+    closed_loop: Optional[ClosedLoop] = None
+
+
+class ProcessSemaphore:
+    """
+    Async context manager over a semaphore shared between processes.
+
+    Blocking acquires are handed to a single helper thread, so requests that
+    wait on the semaphore are admitted in FIFO order within the worker and
+    the event loop itself never blocks.
+    """
+
+    def __init__(self, semaphore) -> None:
+        self._semaphore = semaphore
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._waiters = 0
+
+    async def __aenter__(self) -> None:
+        if self._waiters == 0 and self._semaphore.acquire(block=False):
+            return
+        self._waiters += 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._semaphore.acquire)
+        finally:
+            self._waiters -= 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._semaphore.release()
+
+
+class _ShardProgress:
+    """Minimal stand-in for tqdm that publishes a worker's completions."""
+
+    def __init__(self, counters, worker_id: int) -> None:
+        self._counters = counters
+        self._worker_id = worker_id
+
+    def update(self, n: int = 1) -> None:
+        # Each worker owns its slot, so no lock is needed.
+        self._counters[self._worker_id] += n
+
+
+class _Schedule:
+    """
+    ``enumerate(zip(request_inputs, *columns))``, flattened, as an
+    asynchronous iterator that any number of coroutines can share, each
+    item being taken once. An asynchronous ``request_inputs``, such as a
+    dataset generated in the background, is awaited, so the streams in
+    flight are still read while the next request is not ready.
+    """
+
+    def __init__(self, request_inputs: Union[Iterable, AsyncIterable],
+                 *columns: Iterable) -> None:
+        self._rows = zip(*columns) if columns else itertools.repeat(())
+        self._index = itertools.count()
+        self._async = hasattr(request_inputs, "__aiter__")
+        self._inputs = (request_inputs.__aiter__()
+                        if self._async else iter(request_inputs))
+        self._lock = asyncio.Lock()
+
+    def __aiter__(self) -> "_Schedule":
+        return self
+
+    async def __anext__(self) -> tuple:
+        if not self._async:
+            row = next(self._rows, None)
+            request_input = next(self._inputs, self)
+            if row is None or request_input is self:
+                raise StopAsyncIteration
+            return (next(self._index), request_input, *row)
+        # Another coroutine may take the next item while this one waits.
+        async with self._lock:
+            row = next(self._rows, None)
+            if row is None:
+                raise StopAsyncIteration
+            request_input = await self._inputs.__anext__()
+            return (next(self._index), request_input, *row)
+
+
+async def _iterate(items: Iterable):
+    for item in items:
+        yield item
+
+
+async def dispatch_requests(
+    request_func: Callable,
+    session,
+    request_inputs: Union[Iterable[RequestFuncInput],
+                          AsyncIterable[RequestFuncInput]],
+    arrival_times: Iterable[float],
+    start_time: float,
+    max_concurrency: Optional[int],
+    semaphore,
+    pbar,
+    records: RequestRecords,
+    token_sketches: Optional[TokenLatencySketches] = None,
+    stop_time: Optional[float] = None,
+    stop_event: Optional[asyncio.Event] = None,
+    live_metrics: Optional[LiveMetrics] = None,
+) -> RequestRecords:
+    """
+    Send every request at ``start_time + arrival_times[i]``.
+
+    Used both by the single-process benchmark and by every shard. Deadlines
+    are absolute, so sleep overshoot or a stalled event loop delays a single
+    request instead of shifting the rest of the schedule. Each output records
+    its deadline and the time it was released, from which the schedule lag
+    is reported.
+
+    With ``max_concurrency``, a fixed pool of that many worker coroutines
+    pulls requests from the schedule, so memory is proportional to the
+    concurrency rather than to the number of requests. Otherwise a task is
+    created at each deadline and dropped once it finishes. ``semaphore``
+    optionally adds a limit shared with other processes.
+
+    ``request_inputs`` may be asynchronous; the dispatcher then awaits each
+    request instead of blocking the event loop until it is built.
+
+    The outcome of request ``i`` goes to row ``i`` of ``records`` as soon as
+    it ends, and with ``token_sketches`` its inter-token latencies are folded
+    into the sketches; the output object itself is not kept.
+
+    With ``stop_time``, no request is sent from that time on, so the
+    schedule may be endless; requests in flight are still awaited. Setting
+    ``stop_event`` ends the run the same way. ``live_metrics`` is told
+    about every request as it is sent and as it finishes.
+    """
+
+    def stopped(scheduled_time: float) -> bool:
+        if stop_event is not None and stop_event.is_set():
+            return True
+        return stop_time is not None and max(
+            scheduled_time, time.perf_counter()) >= stop_time
+
+    async def send_request(index, request_input, scheduled_time,
+                           dispatch_time):
+        if live_metrics is not None:
+            live_metrics.request_started()
+        if semaphore is None:
+            output = await request_func(request_input, pbar, session)
+        else:
+            async with semaphore:
+                output = await request_func(request_input, pbar, session)
+        output.scheduled_time = scheduled_time
+        output.dispatch_time = dispatch_time
+        if token_sketches is not None:
+            token_sketches.record(output)
+        if live_metrics is not None:
+            live_metrics.record(output)
+        records.record(index, output)
+
+    schedule = _Schedule(request_inputs, arrival_times)
+
+    if max_concurrency:
+
+        async def worker():
+            # Workers share the iterator, so each request is taken once.
+            async for index, request_input, arrival_time in schedule:
+                scheduled_time = start_time + arrival_time
+                if stopped(scheduled_time):
+                    break
+                delay = scheduled_time - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    if stopped(scheduled_time):
+                        break
+                # A request that came due while every worker was busy is
+                # sent late, which shows up as schedule lag.
+                await send_request(index, request_input, scheduled_time,
+                                   time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(max_concurrency)))
+        return records
+
+    in_flight: set[asyncio.Task] = set()
+    async for index, request_input, arrival_time in schedule:
+        scheduled_time = start_time + arrival_time
+        if stopped(scheduled_time):
+            break
+        delay = scheduled_time - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            if stopped(scheduled_time):
+                break
+        task = asyncio.create_task(
+            send_request(index, request_input, scheduled_time,
+                         time.perf_counter()))
+        in_flight.add(task)
+        task.add_done_callback(_discard_if_succeeded(in_flight))
+    await asyncio.gather(*in_flight)
+    return records
+
+
+async def dispatch_closed_loop(
+    request_func: Callable,
+    session,
+    request_inputs: Union[Iterable[RequestFuncInput],
+                          AsyncIterable[RequestFuncInput]],
+    closed_loop: ClosedLoop,
+    start_time: float,
+    pbar,
+    records: RequestRecords,
+    token_sketches: Optional[TokenLatencySketches] = None,
+    stop_time: Optional[float] = None,
+    stop_event: Optional[asyncio.Event] = None,
+    live_metrics: Optional[LiveMetrics] = None,
+) -> RequestRecords:
+    """
+    Drive the requests with the virtual users of ``closed_loop``.
+
+    Every user sends its first request at ``start_time`` and each following
+    one as soon as the previous request finished and its think time
+    elapsed, until its stream is exhausted, ``stop_time`` passed or
+    ``stop_event`` was set. With
+    per-user streams, request ``i`` is sent by user
+    ``closed_loop.user_ids[i]``, and a timed run cycles through each user's
+    requests; otherwise the users take their next request from one shared
+    stream. A request's scheduled and dispatch times are both the moment
+    its user became ready, so the client adds no queue wait. Outcomes are
+    recorded as by `dispatch_requests`, in the order the requests were
+    sent, together with the user of each request.
+    """
+    if closed_loop.user_ids is None:
+        # Users share the iterator, so each request is taken once.
+        shared = _Schedule(request_inputs)
+        streams = {user: shared for user in closed_loop.users}
+    else:
+        per_user = {user: [] for user in closed_loop.users}
+        async for position, request_input, user in _Schedule(
+                request_inputs, closed_loop.user_ids):
+            per_user[user].append((position, request_input))
+        streams = {
+            user: _iterate(
+                itertools.cycle(items) if stop_time is not None else items)
+            for user, items in per_user.items()
+        }
+    rows = itertools.count()
+
+    async def user_loop(user: int, stream) -> None:
+        ready_time = start_time
+        delay = start_time - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async for position, request_input in stream:
+            if (stop_time is not None and ready_time >= stop_time
+                    or stop_event is not None and stop_event.is_set()):
+                break
+            index = next(rows)
+            if live_metrics is not None:
+                live_metrics.request_started()
+            output = await request_func(request_input, pbar, session)
+            output.scheduled_time = output.dispatch_time = ready_time
+            if token_sketches is not None:
+                token_sketches.record(output)
+            if live_metrics is not None:
+                live_metrics.record(output)
+            records.record(index, output)
+            records.user_id[index] = user
+            think_time = closed_loop.think_times[position %
+                                                 len(closed_loop.think_times)]
+            if think_time > 0:
+                await asyncio.sleep(think_time)
+            ready_time = time.perf_counter()
+
+    await asyncio.gather(*(user_loop(user, stream)
+                           for user, stream in streams.items()))
+    return records
+
+
+def _discard_if_succeeded(in_flight: set[asyncio.Task]):
+    # Finished tasks are dropped so that only in-flight requests are held;
+    # a failed one stays in the set so the final gather re-raises its error.
+    def callback(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            in_flight.discard(task)
+
+    return callback
+
+
+async def _run_shard(
+    plan: ShardPlan, start_time: float, semaphore, counters
+) -> tuple[RequestRecords, Optional[TokenLatencySketches]]:
+    request_func = ASYNC_REQUEST_FUNCS[plan.backend]
+    token_sketches = (TokenLatencySketches(plan.sketch_accuracy)
+                      if plan.sketch_accuracy is not None else None)
+    records = RequestRecords(len(plan.request_inputs),
+                             keep_itl=token_sketches is None,
+                             keep_text=plan.keep_text)
+    async with create_client_session(**plan.session_kwargs) as session:
+        if plan.closed_loop is not None:
+            await dispatch_closed_loop(
+                request_func=request_func,
+                session=session,
+                request_inputs=plan.request_inputs,
+                closed_loop=plan.closed_loop,
+                start_time=start_time,
+                pbar=_ShardProgress(counters, plan.worker_id),
+                records=records,
+                token_sketches=token_sketches,
+            )
+            return records, token_sketches
+        await dispatch_requests(
+            request_func=request_func,
+            session=session,
+            request_inputs=plan.request_inputs,
+            arrival_times=plan.arrival_times,
+            start_time=start_time,
+            max_concurrency=plan.max_concurrency,
+            semaphore=(ProcessSemaphore(semaphore)
+                       if semaphore is not None else None),
+            pbar=_ShardProgress(counters, plan.worker_id),
+            records=records,
+            token_sketches=token_sketches,
+        )
+    return records, token_sketches
+
+
+def _shard_worker_main(plan: ShardPlan, semaphore, ready_counter, start_event,
+                       start_time, counters, result_queue) -> None:
+    # Same treatment as the parent: keep the shard's inputs out of GC scans.
+    gc.collect()
+    gc.freeze()
+    with ready_counter.get_lock():
+        ready_counter.value += 1
+    start_event.wait()
+    try:
+        result = asyncio.run(
+            _run_shard(plan, start_time.value, semaphore, counters))
+        result_queue.put((plan.worker_id, result, None))
+    except BaseException as e:
+        result_queue.put((plan.worker_id, None, repr(e)))
+
+
+def split_into_shards(
+    backend: str,
+    request_inputs: list[RequestFuncInput],
+    arrival_times: list[float],
+    num_workers: int,
+    session_kwargs: dict[str, Any],
+    sketch_accuracy: Optional[float] = None,
+    keep_text: bool = True,
+    max_concurrency: Optional[int] = None,
+    closed_loop: Optional[ClosedLoop] = None,
+) -> list[ShardPlan]:
+    """
+    Deal the requests round-robin, keeping each shard's schedule order.
+
+    In closed-loop mode the users are dealt round-robin instead, and with
+    per-user streams every shard gets the requests of its users.
+    """
+    plans = []
+    for worker_id in range(num_workers):
+        shard_loop = None
+        if closed_loop is None or closed_loop.user_ids is None:
+            indices = list(range(worker_id, len(request_inputs), num_workers))
+        else:
+            indices = [
+                index for index, user in enumerate(closed_loop.user_ids)
+                if user % num_workers == worker_id
+            ]
+        if closed_loop is not None:
+            shard_loop = ClosedLoop(
+                users=closed_loop.users[worker_id::num_workers],
+                think_times=[closed_loop.think_times[i] for i in indices],
+                user_ids=(None if closed_loop.user_ids is None else
+                          [closed_loop.user_ids[i] for i in indices]))
+        plans.append(
+            ShardPlan(
+                worker_id=worker_id,
+                backend=backend,
+                indices=indices,
+                request_inputs=[request_inputs[i] for i in indices],
+                arrival_times=[arrival_times[i] for i in indices],
+                session_kwargs=session_kwargs,
+                sketch_accuracy=sketch_accuracy,
+                keep_text=keep_text,
+                max_concurrency=max_concurrency,
+                closed_loop=shard_loop,
+            ))
+    return plans
+
+
+async def run_sharded(
+    plans: list[ShardPlan],
+    max_concurrency: Optional[int],
+    pbar: Optional[tqdm],
+    token_sketches: Optional[TokenLatencySketches] = None,
+) -> tuple[RequestRecords, float]:
+    """
+    Run every shard in its own process and merge the results.
+
+    Returns the records in original request order together with the shared
+    start time, which is on the same clock as the parent's perf_counter.
+    The workers' latency sketches are merged into ``token_sketches``.
+    """
+    # Workers must not inherit the parent's running event loop or tokenizer
+    # threads, so they are started fresh.
+    ctx = multiprocessing.get_context("spawn")
+    semaphore = (ctx.BoundedSemaphore(max_concurrency)
+                 if max_concurrency else None)
+    ready_counter = ctx.Value("i", 0)
+    start_event = ctx.Event()
+    start_time = ctx.Value("d", 0.0)
+    counters = ctx.Array("q", len(plans), lock=False)
+    result_queue = ctx.Queue()
+
+    processes = [
+        ctx.Process(target=_shard_worker_main,
+                    args=(plan, semaphore, ready_counter, start_event,
+                          start_time, counters, result_queue),
+                    daemon=True) for plan in plans
+    ]
+    for process in processes:
+        process.start()
+
+    while ready_counter.value < len(plans):
+        if not all(process.is_alive() for process in processes):
+            raise RuntimeError("A benchmark worker process exited early.")
+        await asyncio.sleep(SHARD_PROGRESS_INTERVAL / 10)
+    start_time.value = time.perf_counter() + SHARD_START_DELAY
+    start_event.set()
+
+    loop = asyncio.get_running_loop()
+    pending = len(plans)
+    results = {}
+    shown = 0
+    while pending:
+        try:
+            worker_id, result, error = await loop.run_in_executor(
+                None, result_queue.get, True, SHARD_PROGRESS_INTERVAL)
+        except queue.Empty:
+            worker_id = None
+        if worker_id is not None:
+            if error is not None:
+                raise RuntimeError(
+                    f"Benchmark worker {worker_id} failed: {error}")
+            results[worker_id], worker_sketches = result
+            if token_sketches is not None:
+                token_sketches.merge(worker_sketches)
+            pending -= 1
+        if pbar is not None:
+            done = sum(counters)
+            pbar.update(done - shown)
+            shown = done
+
+    for process in processes:
+        process.join()
+
+    merged = RequestRecords(sum(len(plan.indices) for plan in plans),
+                            keep_itl=plans[0].sketch_accuracy is None,
+                            keep_text=plans[0].keep_text)
+    for plan in plans:
+        merged.put(plan.indices, results[plan.worker_id])
+    return merged, start_time.value
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: Apache-2.0
+r"""Microbenchmark the client-side cost of parsing streamed SSE responses.
+
+Compares the per-chunk cost of the previous line-by-line parsing
+(strip + decode + removeprefix + json.loads per line) with the shared
+SSEDecoder used by backend_request_func.py. Framing is measured on its own
+and together with the standard library JSON decoder, and with the optional
+fast decoder when it is installed.
+
+Usage:
+    python benchmark_sse_parser.py \
+        --num-events 100000 \
+        --events-per-chunk 1 4 16
+"""
+import argparse
+import json
+import time
+
+from backend_request_func import SSE_DONE, SSEDecoder, json_loads
+
+
+def build_stream(num_events: int, events_per_chunk: int) -> list[bytes]:
+    """Build an OpenAI completions style stream split into network chunks."""
+    events = []
+    for i in range(num_events):
+        data = {
+            "id": "cmpl-benchmark",
+            "object": "text_completion",
+            "created": 0,
+            "model": "benchmark",
+            "choices": [{
+                "index": 0,
+                "text": f" token{i}",
+                "logprobs": None,
+                "finish_reason": None,
+            }],
+        }
+        events.append(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    return [
+        b"".join(events[i:i + events_per_chunk])
+        for i in range(0, len(events), events_per_chunk)
+    ]
+
+
+def parse_lines(chunks: list[bytes], decode: bool) -> int:
+    # Mirrors the former parsing loop, which iterated over response lines.
+    count = 0
+    for chunk_bytes in chunks:
+        for line in chunk_bytes.splitlines(keepends=True):
+            line = line.strip()
+            if not line:
+                continue
+            chunk = line.decode("utf-8").removeprefix("data: ")
+            if chunk != "[DONE]":
+                count += len(json.loads(chunk)["choices"]) if decode else 1
+    return count
+
+
+def parse_sse(chunks: list[bytes], loads) -> int:
+    count = 0
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            if event != SSE_DONE:
+                count += len(loads(event)["choices"]) if loads else 1
+    for event in decoder.flush():
+        if event != SSE_DONE:
+            count += len(loads(event)["choices"]) if loads else 1
+    return count
+
+
+def main(args: argparse.Namespace):
+    parsers = {
+        "lines": lambda chunks: parse_lines(chunks, decode=False),
+        "sse": lambda chunks: parse_sse(chunks, None),
+        "lines+json": lambda chunks: parse_lines(chunks, decode=True),
+        "sse+json": lambda chunks: parse_sse(
+            chunks, lambda event: json.loads(event.decode("utf-8"))),
+    }
+    # The fallback decoder is defined in backend_request_func itself.
+    if json_loads.__module__ != "backend_request_func":
+        parsers[f"sse+{json_loads.__module__}"] = (
+            lambda chunks: parse_sse(chunks, json_loads))
+
+    print("{:<18} {:>16} {:>14} {:>14}".format("Parser", "Events/chunk",
+                                              "ns/chunk", "ns/event"))
+    for events_per_chunk in args.events_per_chunk:
+        chunks = build_stream(args.num_events, events_per_chunk)
+        for name, parse in parsers.items():
+            best = float("inf")
+            for _ in range(args.num_iters):
+                st = time.perf_counter_ns()
+                count = parse(chunks)
+                best = min(best, time.perf_counter_ns() - st)
+            assert count == args.num_events, (name, count)
+            print("{:<18} {:>16} {:>14.1f} {:>14.1f}".format(
+                name, events_per_chunk, best / len(chunks),
+                best / args.num_events))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cost of parsing streamed SSE responses.")
+    parser.add_argument("--num-events",
+                        type=int,
+                        default=100000,
+                        help="Number of token events in the stream.")
+    parser.add_argument("--events-per-chunk",
+                        type=int,
+                        nargs="+",
+                        default=[1, 4, 16],
+                        help="Number of events delivered per network chunk.")
+    parser.add_argument("--num-iters",
+                        type=int,
+                        default=5,
+                        help="Number of timed iterations; the best is kept.")
+    main(parser.parse_args())
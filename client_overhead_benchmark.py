@@ -0,0 +1,341 @@
+# SPDX-License-Identifier: Apache-2.0
+r"""Benchmark the overhead of the benchmark client itself.
+
+Runs `benchmark()` from benchmark_serving.py against the mock server of
+mock_server.py, started in a subprocess so that its CPU time is not counted,
+over a matrix of backends, concurrencies and output lengths. Each cell is
+run twice:
+
+    zero latency  the stub streams every token at once, so the output
+                  throughput is the most the client sustains, and the CPU
+                  the client spent per token is its cost on the hot path
+    paced         the stub sends a token every --itl-ms, so the gap between
+                  the measured and the configured ITL is the measurement
+                  error of the client, and the lag of the event loop (see
+                  harness_monitor.py) shows how far it fell behind
+
+    python client_overhead_benchmark.py --tokenizer <path> \
+        --output client_overhead.json --baseline baseline.json
+
+The results are written to --output. With --baseline, each cell is compared
+with the same cell of an earlier output; cells that got worse by more than
+--regression-threshold are listed and the exit status is 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Optional
+
+import aiohttp
+
+from backend_request_func import get_tokenizer
+from benchmark_dataset import SampleRequest
+from benchmark_serving import benchmark
+from harness_monitor import HarnessMonitor
+
+# Backend -> endpoint of the mock server.
+BACKEND_ENDPOINTS = {
+    "vllm": "/v1/completions",
+    "openai-chat": "/v1/chat/completions",
+    "tgi": "/generate_stream",
+    "tensorrt-llm": "/v2/models/ensemble/generate_stream",
+}
+# Compared metric -> (True if higher is better, change below which a cell
+# is never flagged, in the metric's unit).
+COMPARED_METRICS: dict[str, tuple[bool, float]] = {
+    "cpu_us_per_token": (False, 0.5),
+    "max_output_throughput": (True, 0.0),
+    "p99_loop_lag_ms": (False, 1.0),
+    "mean_itl_error_ms": (False, 0.2),
+    "p99_itl_error_ms": (False, 1.0),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def mock_server(itl_ms: float, timeout: float = 30.0):
+    """Start mock_server.py on a free port and yield its base URL."""
+    port = _free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "mock_server.py")
+    process = subprocess.Popen([
+        sys.executable, script, "--port",
+        str(port), "--ttft-ms", "0", "--itl-ms",
+        str(itl_ms)
+    ],
+                               stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                urllib.request.urlopen(f"{base_url}/health", timeout=1)
+                break
+            except OSError:
+                if (process.poll() is not None
+                        or time.monotonic() > deadline):
+                    raise RuntimeError("The mock server did not start.")
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def _run(base_url: str, backend: str, tokenizer: Any,
+               input_requests: list[SampleRequest], concurrency: int,
+               lag_interval: float) -> dict[str, Any]:
+    # The report of every run would drown the summary of the suite.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return await benchmark(
+            backend=backend,
+            api_url=base_url + BACKEND_ENDPOINTS[backend],
+            base_url=base_url,
+            model_id="mock",
+            model_name="mock",
+            tokenizer=tokenizer,
+            input_requests=input_requests,
+            logprobs=None,
+            request_rate=float("inf"),
+            burstiness=1.0,
+            disable_tqdm=True,
+            profile=False,
+            selected_percentile_metrics=["itl"],
+            selected_percentiles=[99.0],
+            ignore_eos=True,
+            goodput_config_dict={},
+            max_concurrency=concurrency,
+            lora_modules=None,
+            # Only the client's own work is on this process's clock.
+            harness_monitor=HarnessMonitor(lag_interval),
+        )
+
+
+def run_cell(zero_latency_url: str, paced_url: str, backend: str,
+             tokenizer: Any, concurrency: int, output_len: int,
+             num_requests: int, num_paced_requests: int, input_len: int,
+             itl_ms: float, lag_interval: float) -> dict[str, Any]:
+    request = SampleRequest(prompt=" ".join(["hello"] * input_len),
+                            prompt_len=input_len,
+                            expected_output_len=output_len)
+    zero = asyncio.run(
+        _run(zero_latency_url, backend, tokenizer, [request] * num_requests,
+             concurrency, lag_interval))
+    # The stub sends exactly output_len tokens per request.
+    tokens = zero["completed"] * output_len
+    paced = asyncio.run(
+        _run(paced_url, backend, tokenizer, [request] * num_paced_requests,
+             concurrency, lag_interval))
+    zero_harness = zero["harness"]
+    paced_harness = paced["harness"]
+    return {
+        "backend": backend,
+        "concurrency": concurrency,
+        "output_len": output_len,
+        "num_requests": num_requests,
+        "num_paced_requests": num_paced_requests,
+        "failed": (num_requests - zero["completed"]) +
+        (num_paced_requests - paced["completed"]),
+        "cpu_us_per_token":
+        zero_harness["client_cpu_time_s"] / max(tokens, 1) * 1e6,
+        # Close to 1 when the client, not the stub, limited the throughput.
+        "client_cpu_utilization": zero_harness["mean_client_cpu_util"],
+        "max_output_throughput": tokens / zero["duration"],
+        "max_request_throughput": zero["request_throughput"],
+        "mean_loop_lag_ms": paced_harness["mean_loop_lag_ms"],
+        "p99_loop_lag_ms": paced_harness["p99_loop_lag_ms"],
+        "max_loop_lag_ms": paced_harness["max_loop_lag_ms"],
+        "max_gc_pause_ms": max(zero_harness["max_gc_pause_ms"],
+                               paced_harness["max_gc_pause_ms"]),
+        "mean_itl_error_ms": paced["mean_itl_ms"] - itl_ms,
+        "p99_itl_error_ms": paced["p99_itl_ms"] - itl_ms,
+    }
+
+
+def cell_key(cell: dict[str, Any]) -> tuple[str, int, int]:
+    return cell["backend"], cell["concurrency"], cell["output_len"]
+
+
+def compare_to_baseline(cells: list[dict[str, Any]],
+                        baseline: dict[str, Any],
+                        threshold: float) -> list[str]:
+    """
+    Describe every metric of `cells` that is worse than in the matching
+    cell of `baseline` by more than `threshold`, relatively.
+    """
+    baseline_cells = {cell_key(cell): cell for cell in baseline["cells"]}
+    regressions = []
+    for cell in cells:
+        old = baseline_cells.get(cell_key(cell))
+        if old is None:
+            continue
+        for metric, (higher_is_better, min_change) in COMPARED_METRICS.items():
+            if metric not in old:
+                continue
+            change = cell[metric] - old[metric]
+            if higher_is_better:
+                change = -change
+            if change > max(threshold * abs(old[metric]), min_change):
+                backend, concurrency, output_len = cell_key(cell)
+                regressions.append(
+                    f"{backend} concurrency={concurrency} "
+                    f"output_len={output_len}: {metric} "
+                    f"{old[metric]:.2f} -> {cell[metric]:.2f}")
+    return regressions
+
+
+def print_cells(cells: list[dict[str, Any]]) -> None:
+    print("{:<13} {:>5} {:>6} {:>9} {:>6} {:>11} {:>9} {:>9} {:>9}".format(
+        "backend", "conc", "outlen", "cpu us/tk", "cpu%", "max tok/s",
+        "p99 lag", "itl err", "p99 err"))
+    for cell in cells:
+        print("{:<13} {:>5} {:>6} {:>9.2f} {:>5.0f}% {:>11.0f} {:>7.2f}ms "
+              "{:>7.2f}ms {:>7.2f}ms".format(
+                  cell["backend"], cell["concurrency"], cell["output_len"],
+                  cell["cpu_us_per_token"],
+                  cell["client_cpu_utilization"] * 100,
+                  cell["max_output_throughput"], cell["p99_loop_lag_ms"],
+                  cell["mean_itl_error_ms"], cell["p99_itl_error_ms"]))
+
+
+def main(args: argparse.Namespace) -> Optional[int]:
+    for backend in args.backends:
+        if backend not in BACKEND_ENDPOINTS:
+            raise ValueError(f"The mock server does not serve {backend}, "
+                             f"choose from {list(BACKEND_ENDPOINTS)}.")
+    tokenizer = get_tokenizer(args.tokenizer,
+                              trust_remote_code=args.trust_remote_code)
+    # Same as benchmark_serving.py, so that the numbers carry over.
+    gc.collect()
+    gc.freeze()
+
+    cells = []
+    with mock_server(0) as zero_latency_url, mock_server(
+            args.itl_ms) as paced_url:
+        for backend in args.backends:
+            for concurrency in args.concurrency:
+                for output_len in args.output_lens:
+                    cell = run_cell(
+                        zero_latency_url,
+                        paced_url,
+                        backend,
+                        tokenizer,
+                        concurrency=concurrency,
+                        output_len=output_len,
+                        num_requests=max(args.num_requests,
+                                         4 * concurrency),
+                        num_paced_requests=max(args.num_paced_requests,
+                                               concurrency),
+                        input_len=args.input_len,
+                        itl_ms=args.itl_ms,
+                        lag_interval=args.loop_lag_interval_ms / 1000)
+                    print_cells([cell])
+                    cells.append(cell)
+
+    print()
+    print_cells(cells)
+    output = {
+        "date": time.strftime("%Y%m%d-%H%M%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "aiohttp": aiohttp.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "itl_ms": args.itl_ms,
+            "input_len": args.input_len,
+            "num_requests": args.num_requests,
+            "num_paced_requests": args.num_paced_requests,
+            "loop_lag_interval_ms": args.loop_lag_interval_ms,
+        },
+        "cells": cells,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline is None:
+        return None
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(cells, baseline,
+                                      args.regression_threshold)
+    if not regressions:
+        print(f"No regressions against {args.baseline}.")
+        return None
+    print(f"\n{len(regressions)} regressions against {args.baseline}:")
+    for regression in regressions:
+        print(f"  {regression}")
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the overhead of the benchmark client.")
+    parser.add_argument("--tokenizer",
+                        type=str,
+                        required=True,
+                        help="Tokenizer to count output tokens with.")
+    parser.add_argument("--trust-remote-code", action="store_true")
+    parser.add_argument("--backends",
+                        type=str,
+                        nargs="+",
+                        default=list(BACKEND_ENDPOINTS))
+    parser.add_argument("--concurrency",
+                        type=int,
+                        nargs="+",
+                        default=[1, 16, 64, 256])
+    parser.add_argument("--output-lens",
+                        type=int,
+                        nargs="+",
+                        default=[16, 256])
+    parser.add_argument("--input-len", type=int, default=32)
+    parser.add_argument("--num-requests",
+                        type=int,
+                        default=1000,
+                        help="Requests of each zero-latency run, at least "
+                        "four per concurrent stream.")
+    parser.add_argument("--num-paced-requests",
+                        type=int,
+                        default=16,
+                        help="Requests of each paced run, at least one per "
+                        "concurrent stream.")
+    parser.add_argument("--itl-ms",
+                        type=float,
+                        default=5.0,
+                        help="Inter-token latency of the paced stub.")
+    parser.add_argument("--loop-lag-interval-ms",
+                        type=float,
+                        default=10.0,
+                        help="Interval of the event-loop lag probe.")
+    parser.add_argument("--output",
+                        type=str,
+                        default="client_overhead.json",
+                        help="File to write the results to.")
+    parser.add_argument("--baseline",
+                        type=str,
+                        default=None,
+                        help="Earlier --output to compare the results with.")
+    parser.add_argument("--regression-threshold",
+                        type=float,
+                        default=0.1,
+                        help="Relative change of a metric that counts as a "
+                        "regression.")
+    args = parser.parse_args()
+    sys.exit(main(args))
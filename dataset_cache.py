@@ -0,0 +1,245 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Persistent on-disk cache of sampled benchmark datasets.
+
+A sweep such as run_benchmark.sh starts one benchmark process per cell and
+each of them would otherwise sample and tokenize the same requests again.
+Datasets are stored under a key that hashes the dataset name, the sampling
+parameters, the number of requests, the seed and a fingerprint of the
+tokenizer, so a change to any of them is a cache miss rather than a stale
+hit.
+
+Each entry is a directory of flat binary files:
+
+    meta.json          format version, request count, RNG states
+    lengths.npy        (n, 2) int64: prompt_len, expected_output_len
+    text.bin           UTF-8 prompts back to back        (text prompts)
+    text_offsets.npy   (n + 1) int64 byte offsets into text.bin
+    token_ids.bin      int64 token IDs back to back      (token-ID prompts)
+    token_offsets.npy  (n + 1) int64 offsets into token_ids.bin
+
+Entries are opened with memory maps, so loading takes milliseconds whatever
+the dataset size, only the pages of the requests actually sent are read,
+and concurrent benchmark processes share them through the page cache.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import random
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
+from typing import Any, Optional
+
+import numpy as np
+from transformers import PreTrainedTokenizerBase
+
+from benchmark_dataset import SampleRequest
+
+# Bump when the layout of an entry changes.
+CACHE_FORMAT_VERSION = 1
+
+
+def tokenizer_fingerprint(tokenizer: PreTrainedTokenizerBase) -> str:
+    """Hash what determines how the tokenizer encodes and decodes."""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # The full serialized pipeline: vocab, merges, normalizers, ...
+        digest.update(backend.to_str().encode())
+    else:
+        digest.update(
+            json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    digest.update(str(tokenizer.clean_up_tokenization_spaces).encode())
+    return digest.hexdigest()
+
+
+def dataset_cache_key(
+    dataset_name: str,
+    sample_params: dict[str, Any],
+    num_requests: int,
+    seed: int,
+    tokenizer: PreTrainedTokenizerBase,
+) -> str:
+    """Return the content address of a sampled dataset."""
+    description = json.dumps(
+        {
+            "version": CACHE_FORMAT_VERSION,
+            "dataset_name": dataset_name,
+            "sample_params": sample_params,
+            "num_requests": num_requests,
+            "seed": seed,
+            "tokenizer": tokenizer_fingerprint(tokenizer),
+        },
+        sort_keys=True,
+        default=str)
+    return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+
+def _rng_state() -> dict[str, Any]:
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    version, internal_state, gauss_next = random.getstate()
+    return {
+        "numpy": [name, keys.tolist(), pos, has_gauss, cached_gaussian],
+        "python": [version, list(internal_state), gauss_next],
+    }
+
+
+def _restore_rng_state(state: dict[str, Any]) -> None:
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, np.asarray(keys, dtype=np.uint32), pos,
+                         has_gauss, cached_gaussian))
+    version, internal_state, gauss_next = state["python"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+
+class CachedDataset:
+    """
+    Read-only, memory-mapped view of a cached dataset.
+
+    Behaves as a sequence of SampleRequest; each request is materialized
+    only when it is accessed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._lengths = np.load(os.path.join(path, "lengths.npy"),
+                                mmap_mode="r")
+        self._text: Optional[mmap.mmap] = None
+        self._token_ids: Optional[np.ndarray] = None
+        if self.meta["prompt_type"] == "text":
+            self._offsets = np.load(os.path.join(path, "text_offsets.npy"),
+                                    mmap_mode="r")
+            with open(os.path.join(path, "text.bin"), "rb") as f:
+                # mmap refuses empty files.
+                if os.fstat(f.fileno()).st_size:
+                    self._text = mmap.mmap(f.fileno(),
+                                           0,
+                                           access=mmap.ACCESS_READ)
+        else:
+            self._offsets = np.load(os.path.join(path, "token_offsets.npy"),
+                                    mmap_mode="r")
+            ids_path = os.path.join(path, "token_ids.bin")
+            self._token_ids = (np.memmap(ids_path, dtype=np.int64, mode="r")
+                               if os.path.getsize(ids_path) else np.zeros(
+                                   0, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return self._lengths.shape[0]
+
+    def __getitem__(self, index: int) -> SampleRequest:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        index %= len(self)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        if self._token_ids is not None:
+            prompt: Any = self._token_ids[start:end].tolist()
+        else:
+            prompt = (self._text[start:end].decode("utf-8")
+                      if self._text is not None else "")
+        prompt_len, expected_output_len = self._lengths[index].tolist()
+        return SampleRequest(prompt=prompt,
+                             prompt_len=prompt_len,
+                             expected_output_len=expected_output_len)
+
+    def __iter__(self) -> Iterator[SampleRequest]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def restore_rng_state(self) -> None:
+        """
+        Leave the global RNGs as the original sampling did, so that draws
+        made after sampling, such as the arrival times, do not depend on
+        whether the dataset came from the cache.
+        """
+        _restore_rng_state(self.meta["rng_state"])
+
+
+def load_cached_dataset(cache_dir: str, key: str) -> Optional[CachedDataset]:
+    """Open the cache entry `key`, or return None if there is none."""
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return CachedDataset(path)
+
+
+def cache_samples(samples: Iterable[SampleRequest], cache_dir: str,
+                  key: str) -> Iterator[SampleRequest]:
+    """
+    Return an iterator over `samples` that writes them to the entry `key`.
+
+    The entry is written to a temporary directory that is renamed into
+    place only once the samples are exhausted, so readers never see a
+    partial entry and concurrent writers of the same key are harmless. The
+    global RNG states are captured by this call, so it must be made right
+    after the dataset drew its random parameters.
+    """
+    return _write_entry(samples, cache_dir, key, _rng_state())
+
+
+def _write_entry(samples: Iterable[SampleRequest], cache_dir: str, key: str,
+                 rng_state: dict[str, Any]) -> Iterator[SampleRequest]:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f".{key}.", dir=cache_dir)
+    try:
+        lengths: list[tuple[int, int]] = []
+        offsets = [0]
+        prompt_type = None
+        with open(os.path.join(tmp_path, "text.bin"), "wb") as text_file, \
+                open(os.path.join(tmp_path, "token_ids.bin"),
+                     "wb") as ids_file:
+            for sample in samples:
+                if sample.multi_modal_data is not None:
+                    raise ValueError(
+                        "Multi-modal requests cannot be cached.")
+                sample_type = ("text"
+                               if isinstance(sample.prompt, str) else "token")
+                if prompt_type is None:
+                    prompt_type = sample_type
+                elif sample_type != prompt_type:
+                    raise ValueError("Cannot cache a dataset that mixes text "
+                                     "and token ID prompts.")
+                if sample_type == "text":
+                    offsets.append(offsets[-1] +
+                                   text_file.write(
+                                       sample.prompt.encode("utf-8")))
+                else:
+                    ids_file.write(
+                        np.asarray(sample.prompt, dtype=np.int64).tobytes())
+                    offsets.append(offsets[-1] + len(sample.prompt))
+                lengths.append(
+                    (sample.prompt_len, sample.expected_output_len))
+                yield sample
+
+        prompt_type = prompt_type or "text"
+        np.save(os.path.join(tmp_path, "lengths.npy"),
+                np.asarray(lengths, dtype=np.int64).reshape(-1, 2))
+        if prompt_type == "text":
+            np.save(os.path.join(tmp_path, "text_offsets.npy"),
+                    np.asarray(offsets, dtype=np.int64))
+            os.remove(os.path.join(tmp_path, "token_ids.bin"))
+        else:
+            np.save(os.path.join(tmp_path, "token_offsets.npy"),
+                    np.asarray(offsets, dtype=np.int64))
+            os.remove(os.path.join(tmp_path, "text.bin"))
+        with open(os.path.join(tmp_path, "meta.json"), "w",
+                  encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": CACHE_FORMAT_VERSION,
+                    "num_requests": len(lengths),
+                    "prompt_type": prompt_type,
+                    "rng_state": rng_state,
+                }, f)
+        try:
+            os.rename(tmp_path, os.path.join(cache_dir, key))
+        except OSError:
+            # Another process stored the same entry first.
+            pass
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
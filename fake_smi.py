@@ -0,0 +1,81 @@
+# SPDX-License-Identifier: Apache-2.0
+r"""Stand-in for nvidia-smi and hy-smi on machines without accelerators.
+
+Prints synthetic readings in the output format that the matching telemetry
+source of gpu_telemetry.py parses, so that GPU monitoring can be exercised
+anywhere:
+
+    python fake_smi.py nvidia-smi \
+        --query-gpu=index,utilization.gpu,utilization.memory,memory.used,memory.total,power.draw \
+        --format=csv,noheader,nounits -i 0,1 -lms 100
+    python fake_smi.py hy-smi
+
+The benchmark runs it with e.g.
+``--gpu-telemetry-source nvidia-smi --gpu-smi-command "python fake_smi.py
+nvidia-smi"``. FAKE_SMI_NUM_GPUS sets the number of devices (default 8).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+NUM_GPUS = int(os.environ.get("FAKE_SMI_NUM_GPUS", "8"))
+TOTAL_MEMORY_MB = 24564
+
+
+def reading(gpu_id: int) -> tuple[float, float, float, float]:
+    """Return util %, memory util %, memory used MB and power W."""
+    util = random.uniform(60, 80)
+    return util, util / 2, 11000 + 10 * gpu_id + util, 100 + 2 * util
+
+
+def nvidia_smi(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog="nvidia-smi")
+    parser.add_argument("--query-gpu", required=True)
+    parser.add_argument("--format", required=True)
+    parser.add_argument("-i", "--id", default=None)
+    parser.add_argument("-lms", "--loop-ms", type=int, default=None)
+    args = parser.parse_args(argv)
+    gpu_ids = (list(map(int, args.id.split(",")))
+               if args.id else list(range(NUM_GPUS)))
+    while True:
+        for gpu_id in gpu_ids:
+            util, mem_util, mem_used, power = reading(gpu_id)
+            values = {
+                "index": gpu_id,
+                "utilization.gpu": round(util),
+                "utilization.memory": round(mem_util),
+                "memory.used": round(mem_used),
+                "memory.total": TOTAL_MEMORY_MB,
+                "power.draw": round(power, 2),
+            }
+            print(", ".join(
+                str(values.get(field, "[N/A]"))
+                for field in args.query_gpu.split(",")),
+                  flush=True)
+        if args.loop_ms is None:
+            return
+        time.sleep(args.loop_ms / 1000)
+
+
+def hy_smi() -> None:
+    print("=" * 24 + " System Management Interface " + "=" * 24)
+    print("=" * 77)
+    print("DCU     Temp     AvgPwr     Perf     PwrCap     VRAM%      "
+          "DCU%      Mode")
+    for gpu_id in range(NUM_GPUS):
+        util, mem_util, _, power = reading(gpu_id)
+        print(f"{gpu_id:<8}{45.0:.1f}C    {power:.1f}W     auto     "
+              f"300.0W     {mem_util:.0f}%{'':<8}{util:.0f}%{'':<8}Normal")
+    print("=" * 77)
+    print("=" * 31 + " End of SMI Log " + "=" * 30)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("nvidia-smi", "hy-smi"):
+        sys.exit("usage: fake_smi.py {nvidia-smi,hy-smi} [options]")
+    if sys.argv[1] == "nvidia-smi":
+        nvidia_smi(sys.argv[2:])
+    else:
+        hy_smi()
@@ -0,0 +1,344 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Accelerator telemetry sampled alongside a benchmark run.
+
+A background thread polls a telemetry source for the utilization, memory
+and power of the supervised GPUs, so sampling never blocks the event loop
+that sends the requests. Every sample is stamped with ``time.perf_counter``,
+the clock of the request timestamps, so the statistics can be restricted to
+the measurement window of the run and the energy it used compared with the
+tokens it generated.
+
+Sources:
+
+    nvml        NVIDIA Management Library through pynvml, if installed
+    nvidia-smi  one long-running ``nvidia-smi --query-gpu ... -lms`` process
+    hy-smi      Hygon DCUs, polling the ``hy-smi`` table
+    fake        synthetic values, for running without accelerators
+
+``auto`` picks the first of nvml, nvidia-smi and hy-smi that is available.
+The command run by the CLI sources can be replaced, e.g. by
+``python fake_smi.py nvidia-smi``, which prints the same output as the real
+tools.
+"""
+
+import math
+import random
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+TELEMETRY_SOURCES = ("auto", "nvml", "nvidia-smi", "hy-smi", "fake")
+NVIDIA_SMI_FIELDS = ("index,utilization.gpu,utilization.memory,memory.used,"
+                     "memory.total,power.draw")
+
+
+@dataclass
+class GpuReading:
+    """One reading of one GPU. Quantities a source cannot read are NaN."""
+    gpu_id: int
+    util: float  # %
+    mem_util: float  # %
+    mem_used: float  # MB
+    mem_total: float  # MB
+    power: float  # W
+
+
+def _number(text: str) -> float:
+    """Parse a reading such as "45.0", "120.0W" or "[N/A]"; NaN if none."""
+    text = text.strip().rstrip("%WwCcB").strip()
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+class TelemetrySource:
+    """Reads all supervised GPUs at once."""
+
+    # True if `read` blocks until the next sample is due by itself.
+    paced = False
+
+    def open(self, gpu_ids: list[int], interval: float) -> None:
+        self.gpu_ids = gpu_ids
+        self.interval = interval
+
+    def read(self) -> list[GpuReading]:
+        """Return the next readings, or [] once the source has ended."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class NvmlSource(TelemetrySource):
+
+    def open(self, gpu_ids: list[int], interval: float) -> None:
+        super().open(gpu_ids, interval)
+        if pynvml is None:
+            raise RuntimeError("The nvml source needs pynvml, install it "
+                               "with `pip install nvidia-ml-py`.")
+        pynvml.nvmlInit()
+        self._handles = [
+            pynvml.nvmlDeviceGetHandleByIndex(gpu_id) for gpu_id in gpu_ids
+        ]
+
+    def read(self) -> list[GpuReading]:
+        readings = []
+        for gpu_id, handle in zip(self.gpu_ids, self._handles):
+            rates = pynvml.nvmlDeviceGetUtilizationRates(handle)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            try:
+                power = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000
+            except pynvml.NVMLError:
+                power = math.nan
+            readings.append(
+                GpuReading(gpu_id=gpu_id,
+                           util=rates.gpu,
+                           mem_util=rates.memory,
+                           mem_used=memory.used / 2**20,
+                           mem_total=memory.total / 2**20,
+                           power=power))
+        return readings
+
+    def close(self) -> None:
+        pynvml.nvmlShutdown()
+
+
+class NvidiaSmiSource(TelemetrySource):
+    """
+    Streams readings from a single ``nvidia-smi -lms`` process instead of
+    starting one process per sample.
+    """
+
+    paced = True
+
+    def __init__(self, command: str = "nvidia-smi") -> None:
+        self.command = shlex.split(command)
+
+    def open(self, gpu_ids: list[int], interval: float) -> None:
+        super().open(gpu_ids, interval)
+        self._process = subprocess.Popen(
+            self.command + [
+                f"--query-gpu={NVIDIA_SMI_FIELDS}",
+                "--format=csv,noheader,nounits",
+                "-i",
+                ",".join(map(str, gpu_ids)),
+                "-lms",
+                str(max(int(interval * 1000), 1)),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True)
+
+    def read(self) -> list[GpuReading]:
+        readings = []
+        while len(readings) < len(self.gpu_ids):
+            line = self._process.stdout.readline()
+            if not line:
+                return []
+            fields = line.split(",")
+            if len(fields) < 6:
+                continue
+            readings.append(
+                GpuReading(int(fields[0]), *map(_number, fields[1:6])))
+        return readings
+
+    def close(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+class HySmiSource(TelemetrySource):
+    """
+    Polls the default ``hy-smi`` table, whose rows start with the DCU index
+    (as counted by hygon/activate_service/start.sh). It has no memory
+    sizes, so only the VRAM utilization is reported.
+    """
+
+    def __init__(self, command: str = "hy-smi") -> None:
+        self.command = shlex.split(command)
+
+    def read(self) -> list[GpuReading]:
+        output = subprocess.run(self.command,
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout
+        columns: list[str] = []
+        readings = []
+        for line in output.splitlines():
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0] in ("DCU", "HCU", "GPU", "Device"):
+                # Drop qualifiers such as "Temp (Junction)".
+                columns = [t for t in tokens if not t.startswith("(")]
+            elif tokens[0].isdigit() and columns:
+                row = dict(zip(columns, tokens))
+                gpu_id = int(tokens[0])
+                if gpu_id not in self.gpu_ids:
+                    continue
+                util = next((row[c] for c in ("DCU%", "HCU%", "GPU%")
+                             if c in row), "")
+                readings.append(
+                    GpuReading(gpu_id=gpu_id,
+                               util=_number(util),
+                               mem_util=_number(row.get("VRAM%", "")),
+                               mem_used=math.nan,
+                               mem_total=math.nan,
+                               power=_number(
+                                   row.get("AvgPwr", row.get("Power", "")))))
+        return readings
+
+
+class FakeSource(TelemetrySource):
+    """Synthetic readings, standing in for NVML without accelerators."""
+
+    def __init__(self) -> None:
+        # A private generator leaves the benchmark's seeded draws alone.
+        self._random = random.Random(0)
+
+    def read(self) -> list[GpuReading]:
+        readings = []
+        for gpu_id in self.gpu_ids:
+            util = self._random.uniform(60, 80)
+            readings.append(
+                GpuReading(gpu_id=gpu_id,
+                           util=util,
+                           mem_util=util / 2,
+                           mem_used=11000 + util,
+                           mem_total=24564,
+                           power=100 + 2 * util))
+        return readings
+
+
+def create_source(name: str,
+                  command: Optional[str] = None) -> TelemetrySource:
+    """Create the telemetry source `name`, one of TELEMETRY_SOURCES."""
+    if name == "auto":
+        if pynvml is not None:
+            name = "nvml"
+        elif shutil.which("nvidia-smi"):
+            name = "nvidia-smi"
+        elif shutil.which("hy-smi"):
+            name = "hy-smi"
+        else:
+            raise RuntimeError("No GPU telemetry source found: install "
+                               "pynvml, or put nvidia-smi or hy-smi on PATH.")
+    if name == "nvml":
+        return NvmlSource()
+    if name == "nvidia-smi":
+        return NvidiaSmiSource(command or "nvidia-smi")
+    if name == "hy-smi":
+        return HySmiSource(command or "hy-smi")
+    if name == "fake":
+        return FakeSource()
+    raise ValueError(f"Unknown GPU telemetry source: {name}")
+
+
+class GpuTelemetry:
+    """Samples `source` for `gpu_ids` every `interval` seconds."""
+
+    def __init__(self,
+                 source: TelemetrySource,
+                 gpu_ids: list[int],
+                 interval: float = 0.1) -> None:
+        self.source = source
+        self.gpu_ids = gpu_ids
+        self.interval = interval
+        # Appended by the sampling thread only.
+        self._times: list[float] = []
+        self._readings: list[tuple[int, float, float, float, float,
+                                   float]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.source.open(self.gpu_ids, self.interval)
+        self._thread = threading.Thread(target=self._sample,
+                                        name="gpu-telemetry",
+                                        daemon=True)
+        self._thread.start()
+
+    def _sample(self) -> None:
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            readings = self.source.read()
+            now = time.perf_counter()
+            if not readings and self.source.paced:
+                return
+            for r in readings:
+                self._times.append(now)
+                self._readings.append((r.gpu_id, r.util, r.mem_util,
+                                       r.mem_used, r.mem_total, r.power))
+            if not self.source.paced:
+                next_sample += self.interval
+                self._stop.wait(max(next_sample - time.perf_counter(), 0))
+
+    def stop(self) -> None:
+        """Stop sampling and close the source; a no-op unless started."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        # A streaming source returns within one interval.
+        self._thread.join()
+        self._thread = None
+        self.source.close()
+
+    def samples(self) -> dict[str, np.ndarray]:
+        """Every sample as columns: time, gpu_id, util, mem_util, ..."""
+        readings = np.asarray(self._readings, dtype=np.float64).reshape(-1, 6)
+        return {
+            "time": np.asarray(self._times, dtype=np.float64),
+            "gpu_id": readings[:, 0].astype(np.int64),
+            "util": readings[:, 1],
+            "mem_util": readings[:, 2],
+            "mem_used": readings[:, 3],
+            "mem_total": readings[:, 4],
+            "power": readings[:, 5],
+        }
+
+    def summarize(self, start: float, end: float) -> dict[int, dict[str, Any]]:
+        """
+        Per-GPU statistics of the samples taken in ``[start, end]``
+        (perf_counter times). Energy integrates the power over time.
+        """
+        samples = self.samples()
+        stats = {}
+        for gpu_id in self.gpu_ids:
+            mask = ((samples["gpu_id"] == gpu_id) & (samples["time"] >= start)
+                    & (samples["time"] <= end))
+            if not mask.any():
+                continue
+
+            def column(name: str) -> np.ndarray:
+                return samples[name][mask]
+
+            power = column("power")
+            times = column("time")
+            stats[gpu_id] = {
+                "samples": int(mask.sum()),
+                "avg_gpu_util": float(np.mean(column("util"))),
+                "max_gpu_util": float(np.max(column("util"))),
+                "avg_mem_util": float(np.mean(column("mem_util"))),
+                "max_mem_util": float(np.max(column("mem_util"))),
+                "avg_mem_used_mb": float(np.mean(column("mem_used"))),
+                "max_mem_used_mb": float(np.max(column("mem_used"))),
+                "total_mem_mb": float(np.max(column("mem_total"))),
+                "avg_power_w": float(np.mean(power)),
+                "max_power_w": float(np.max(power)),
+                "energy_j": float(
+                    np.sum((power[1:] + power[:-1]) / 2 * np.diff(times))),
+            }
+        return stats
@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Saturation of the benchmark client itself.
+
+Every request of a run shares one event loop. While the loop is busy with
+other coroutines, decoding JSON or collecting garbage, the chunks of a
+stream wait in the socket, and TTFT and ITL grow by time the server did not
+spend. HarnessMonitor measures this while the run is in progress:
+
+    loop lag  how late a periodic sleep wakes up, every `interval` seconds
+    CPU       the process time of the client at each wakeup
+    GC        the duration of every collection, from ``gc.callbacks``; the
+              objects allocated after ``gc.freeze()`` are still collected
+
+A wakeup costs a timer and three appends, so the monitor can stay on for
+every run. `suspect_metrics` compares the measurements with the latencies
+of the run and names the metrics the harness may have distorted.
+"""
+
+import asyncio
+import gc
+import time
+from array import array
+from typing import Any
+
+import numpy as np
+
+# A latency metric is suspect once the client stalls for this fraction of
+# its median, and for at least MIN_STALL_MS.
+STALL_FRACTION = 0.1
+MIN_STALL_MS = 1.0
+# Mean CPU utilization above which the client was busy all the time.
+CPU_SATURATION = 0.9
+# Length of the windows of the maximum CPU utilization, in seconds.
+CPU_WINDOW = 1.0
+
+
+class HarnessMonitor:
+    """Samples the event loop of the client every `interval` seconds."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        if interval <= 0:
+            raise ValueError(f"The interval must be positive, got {interval}.")
+        self.interval = interval
+        self._times = array("d")
+        self._lags = array("d")
+        self._cpu = array("d")
+        self._gc_start = 0.0
+        self._gc_starts = array("d")
+        self._gc_pauses = array("d")
+
+    def _on_gc(self, phase: str, info: dict[str, Any]) -> None:
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+        else:
+            self._gc_starts.append(self._gc_start)
+            self._gc_pauses.append(time.perf_counter() - self._gc_start)
+
+    async def run(self) -> None:
+        """Sample until cancelled."""
+        gc.callbacks.append(self._on_gc)
+        try:
+            while True:
+                due = time.perf_counter() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.perf_counter()
+                self._times.append(now)
+                self._lags.append(now - due)
+                self._cpu.append(time.process_time())
+        finally:
+            gc.callbacks.remove(self._on_gc)
+
+    def summarize(self, start_time: float, duration: float) -> dict[str, Any]:
+        """Statistics of the `duration` seconds from `start_time`."""
+        times = np.asarray(self._times) - start_time
+        inside = (times >= 0) & (times <= duration)
+        times = times[inside]
+        lags = np.asarray(self._lags)[inside] * 1000
+        cpu = np.asarray(self._cpu)[inside]
+        gc_starts = np.asarray(self._gc_starts) - start_time
+        gc_pauses = np.asarray(self._gc_pauses)[(gc_starts >= 0)
+                                                & (gc_starts <= duration)]
+        summary: dict[str, Any] = {
+            "loop_lag_samples": int(lags.size),
+            "mean_loop_lag_ms": float(lags.mean()) if lags.size else 0.0,
+            "p99_loop_lag_ms":
+            float(np.percentile(lags, 99)) if lags.size else 0.0,
+            "max_loop_lag_ms": float(lags.max()) if lags.size else 0.0,
+            "client_cpu_time_s": 0.0,
+            "mean_client_cpu_util": 0.0,
+            "max_client_cpu_util": 0.0,
+            "gc_collections": int(gc_pauses.size),
+            "total_gc_pause_ms": float(gc_pauses.sum() * 1000),
+            "max_gc_pause_ms":
+            float(gc_pauses.max() * 1000) if gc_pauses.size else 0.0,
+        }
+        if times.size >= 2 and times[-1] > times[0]:
+            summary["client_cpu_time_s"] = float(cpu[-1] - cpu[0])
+            summary["mean_client_cpu_util"] = float(
+                (cpu[-1] - cpu[0]) / (times[-1] - times[0]))
+            edges = np.arange(times[0], times[-1], CPU_WINDOW)
+            if edges.size >= 2:
+                summary["max_client_cpu_util"] = float(
+                    np.diff(np.interp(edges, times, cpu)).max() / CPU_WINDOW)
+            else:
+                summary["max_client_cpu_util"] = (
+                    summary["mean_client_cpu_util"])
+        return summary
+
+
+def suspect_metrics(summary: dict[str, Any],
+                    medians_ms: dict[str, float]) -> dict[str, Any]:
+    """
+    The metrics the harness may have distorted, given the `summary` of
+    HarnessMonitor and the median of each latency metric, and why.
+    """
+    suspects: list[str] = []
+    reasons: list[str] = []
+    # A collection blocks the loop as well, but can be rarer than 1%.
+    stall_ms = max(summary["p99_loop_lag_ms"], summary["max_gc_pause_ms"])
+    # A median ITL near zero is itself a sign of tokens read late in bursts.
+    stalled = [
+        name for name, median in medians_ms.items()
+        if stall_ms >= max(STALL_FRACTION * median, MIN_STALL_MS)
+    ]
+    if stalled:
+        suspects.extend(stalled)
+        reasons.append(
+            f"the event loop stalled for {stall_ms:.2f} ms (P99 lag "
+            f"{summary['p99_loop_lag_ms']:.2f} ms, longest GC pause "
+            f"{summary['max_gc_pause_ms']:.2f} ms), at least "
+            f"{STALL_FRACTION:.0%} of the median " +
+            ", ".join(name.upper() for name in stalled))
+    if summary["mean_client_cpu_util"] >= CPU_SATURATION:
+        suspects.extend(name for name in medians_ms if name not in suspects)
+        suspects.extend(["request_throughput", "output_throughput"])
+        reasons.append(
+            f"the client used {summary['mean_client_cpu_util']:.0%} of a CPU, "
+            "so the offered load may have been limited by the client")
+    return {"suspect_metrics": suspects, "saturation_reasons": reasons}
@@ -0,0 +1,207 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Bounded-memory latency distributions for long benchmark runs.
+
+Keeping every inter-token latency of a soak run (millions of requests with
+hundreds of tokens each) as Python floats costs gigabytes and makes the final
+np.percentile pass slow. LatencySketch replaces the list with a fixed-size,
+mergeable histogram whose quantiles have a documented relative error bound.
+ExactDistribution exposes the same interface over the raw values, so that
+calculate_metrics can use either one.
+"""
+
+import math
+from typing import Optional, Union
+
+import numpy as np
+
+# Relative accuracy of the reported quantiles, see LatencySketch.
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Latencies are tracked between 1 us and ~3 hours; values below the lower
+# bound are counted as 0 and values above the upper bound are clamped.
+DEFAULT_MIN_VALUE = 1e-6
+DEFAULT_MAX_VALUE = 1e4
+
+Values = Union[list[float], np.ndarray]
+
+
+class LatencySketch:
+    """
+    Mergeable log-bucketed histogram with a bounded relative error.
+
+    A value ``v`` is counted in the bucket ``i`` with
+    ``gamma**(i-1) < v <= gamma**i``, where
+    ``gamma = (1 + relative_accuracy) / (1 - relative_accuracy)``. Each
+    bucket is reported by the value ``2 * gamma**i / (gamma + 1)``, which is
+    within ``relative_accuracy`` of everything the bucket holds (the DDSketch
+    bound). A percentile is therefore within ``relative_accuracy`` (1% by
+    default) of the exact nearest-rank percentile, as long as it lies in
+    ``[min_value, max_value]``; below ``min_value`` the absolute error is at
+    most ``min_value`` (1 us by default).
+
+    Memory is fixed at ``log(max_value / min_value) / log(gamma)`` counters,
+    about 1.2k for the defaults, regardless of how many values are added.
+    Count, mean, standard deviation, min and max are tracked exactly. Two
+    sketches with the same parameters can be merged losslessly, e.g. the
+    sketches of several worker processes.
+    """
+
+    def __init__(
+        self,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+        min_value: float = DEFAULT_MIN_VALUE,
+        max_value: float = DEFAULT_MAX_VALUE,
+    ) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1), but got "
+                             f"{relative_accuracy}.")
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._inv_log_gamma = 1.0 / math.log(self._gamma)
+        self._offset = math.ceil(math.log(min_value) * self._inv_log_gamma)
+        self._last = (math.ceil(math.log(max_value) * self._inv_log_gamma) -
+                      self._offset)
+        # Index 0 is the zero bucket for values <= min_value.
+        self._counts = np.zeros(self._last + 1, dtype=np.int64)
+        self.count = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        index = math.ceil(math.log(value) * self._inv_log_gamma) - self._offset
+        return min(index, self._last)
+
+    def add(self, value: float) -> None:
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self._sum += value
+        self._sum_sq += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values: Values) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        indices = np.zeros(values.shape, dtype=np.int64)
+        above = values > self.min_value
+        indices[above] = np.minimum(
+            np.ceil(np.log(values[above]) * self._inv_log_gamma).astype(
+                np.int64) - self._offset, self._last)
+        self._counts += np.bincount(indices, minlength=self._counts.size)
+        self.count += values.size
+        self._sum += float(values.sum())
+        self._sum_sq += float(np.dot(values, values))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: "LatencySketch") -> None:
+        if (other.relative_accuracy, other.min_value, other.max_value) != (
+                self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("Cannot merge sketches with different "
+                             "parameters.")
+        self._counts += other._counts
+        self.count += other.count
+        self._sum += other._sum
+        self._sum_sq += other._sum_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        if not self.count:
+            return 0.0
+        mean = self.mean
+        return math.sqrt(max(self._sum_sq / self.count - mean * mean, 0.0))
+
+    def percentile(self, p: float) -> float:
+        """Return the ``p``-th percentile (0-100), see the error bound."""
+        if not self.count:
+            return 0.0
+        rank = round(p / 100 * (self.count - 1))
+        index = int(
+            np.searchsorted(np.cumsum(self._counts), rank, side="right"))
+        if index == 0:
+            value = 0.0
+        else:
+            value = (2 * self._gamma**(index + self._offset) /
+                     (self._gamma + 1))
+        # The exact extremes are known, which tightens the tail estimates.
+        return min(max(value, self.min), self.max)
+
+
+class ExactDistribution:
+    """Keeps every value and computes percentiles with numpy."""
+
+    def __init__(self) -> None:
+        self._chunks: list[np.ndarray] = []
+        self._values: Optional[np.ndarray] = None
+
+    def add_many(self, values: Values) -> None:
+        self._chunks.append(np.asarray(values, dtype=np.float64))
+        self._values = None
+
+    @property
+    def values(self) -> np.ndarray:
+        if self._values is None:
+            self._values = (np.concatenate(self._chunks)
+                            if self._chunks else np.zeros(0))
+        return self._values
+
+    @property
+    def count(self) -> int:
+        return self.values.size
+
+    @property
+    def mean(self) -> float:
+        return float(np.mean(self.values)) if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        return float(np.std(self.values)) if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        return float(np.percentile(self.values, p)) if self.count else 0.0
+
+
+class TokenLatencySketches:
+    """
+    Per-token latency sketches fed by each request as soon as it finishes.
+
+    Once a request's inter-token latencies are folded into the sketches they
+    need not be kept, so memory stays proportional to the number of requests
+    in flight instead of to the number of tokens generated.
+    """
+
+    def __init__(self,
+                 relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.itl = LatencySketch(relative_accuracy)
+        # Inter-token latencies after the first one of each request.
+        self.other_token = LatencySketch(relative_accuracy)
+
+    def record(self, output) -> None:
+        itl = output.itl
+        if output.success and itl.size:
+            self.itl.add_many(itl)
+            self.other_token.add_many(itl[1:])
+
+    def merge(self, other: "TokenLatencySketches") -> None:
+        self.itl.merge(other.itl)
+        self.other_token.merge(other.other_token)
+
+    def new_sketch(self) -> LatencySketch:
+        """Create an empty sketch with the same accuracy."""
+        return LatencySketch(self.relative_accuracy)
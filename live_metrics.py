@@ -0,0 +1,200 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Live time series of a benchmark run in progress.
+
+`calculate_metrics` only runs once the run is over, which on a soak test of
+hours hides any degradation until the end. LiveMetrics is fed by the
+dispatcher as each request is sent and as it finishes, and closes a window
+every interval: the requests started, finished and failed in the window,
+the requests in flight at its end, the request and output token rates and
+the TTFT and ITL percentiles of the requests that finished in it.
+
+Each window is appended to a CSV or JSONL time series, and an OpenMetrics
+text file with the running totals and the latest window is rewritten
+atomically, for a node_exporter textfile collector or any other local
+Prometheus tooling to scrape. Per-request work is a few counter updates and
+a sketch insertion (see latency_sketch.py), so the overhead is bounded
+regardless of the length of the run.
+"""
+
+import asyncio
+import csv
+import json
+import os
+import time
+from typing import Any, Optional
+
+from latency_sketch import DEFAULT_RELATIVE_ACCURACY, LatencySketch
+
+# Prefix of the exported metric names.
+METRIC_PREFIX = "benchmark"
+
+
+def _percentile_key(name: str, p: float) -> str:
+    p_word = str(int(p)) if int(p) == p else str(p)
+    return f"p{p_word}_{name}_ms"
+
+
+class LiveMetrics:
+    """
+    Windowed metrics of a run, written to `series_path` (CSV, or JSONL if
+    the name ends with .jsonl) and `openmetrics_path` every `interval`
+    seconds.
+    """
+
+    def __init__(self,
+                 interval: float = 1.0,
+                 series_path: Optional[str] = None,
+                 openmetrics_path: Optional[str] = None,
+                 percentiles: tuple[float, ...] = (50.0, 99.0),
+                 relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        if interval <= 0:
+            raise ValueError(f"The interval must be positive, got {interval}.")
+        self.interval = interval
+        self.series_path = series_path
+        self.openmetrics_path = openmetrics_path
+        self.percentiles = percentiles
+        self.relative_accuracy = relative_accuracy
+        self.start_time = 0.0
+        # Running totals since the start of the run.
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+        self.output_tokens = 0
+        self._series_file = None
+        self._csv_writer: Optional[csv.DictWriter] = None
+        self._reset_window(0.0)
+
+    def _reset_window(self, window_start: float) -> None:
+        self._window_start = window_start
+        self._window_started = 0
+        self._window_finished = 0
+        self._window_failed = 0
+        self._window_tokens = 0
+        self._ttft = LatencySketch(self.relative_accuracy)
+        self._itl = LatencySketch(self.relative_accuracy)
+
+    def start(self, start_time: float) -> None:
+        """Start the first window at `start_time` (a perf_counter time)."""
+        self.start_time = start_time
+        self._reset_window(0.0)
+        if self.series_path is not None:
+            self._series_file = open(self.series_path,
+                                     "w",
+                                     encoding="utf-8",
+                                     newline="")
+
+    def request_started(self) -> None:
+        self.started += 1
+        self._window_started += 1
+
+    def record(self, output) -> None:
+        """Count a finished request."""
+        self.finished += 1
+        self._window_finished += 1
+        if not output.success:
+            self.failed += 1
+            self._window_failed += 1
+            return
+        tokens = (output.output_tokens if output.output_tokens is not None
+                  else output.itl.size + 1)
+        self.output_tokens += tokens
+        self._window_tokens += tokens
+        self._ttft.add(output.ttft)
+        if output.itl.size:
+            self._itl.add_many(output.itl)
+
+    def flush(self) -> dict[str, Any]:
+        """Close the current window, export it and start the next one."""
+        window_end = time.perf_counter() - self.start_time
+        length = max(window_end - self._window_start, 1e-9)
+        row: dict[str, Any] = {
+            "window_start": round(self._window_start, 6),
+            "window_end": round(window_end, 6),
+            "requests_started": self._window_started,
+            "requests_finished": self._window_finished,
+            "requests_failed": self._window_failed,
+            "in_flight": self.started - self.finished,
+            "request_throughput": self._window_finished / length,
+            "output_throughput": self._window_tokens / length,
+        }
+        for name, sketch in (("ttft", self._ttft), ("itl", self._itl)):
+            for p in self.percentiles:
+                row[_percentile_key(name, p)] = sketch.percentile(p) * 1000
+        self._write_series(row)
+        if self.openmetrics_path is not None:
+            self._write_openmetrics(row)
+        self._reset_window(window_end)
+        return row
+
+    def _write_series(self, row: dict[str, Any]) -> None:
+        if self._series_file is None:
+            return
+        if self.series_path.endswith(".jsonl"):
+            self._series_file.write(json.dumps(row) + "\n")
+        else:
+            if self._csv_writer is None:
+                self._csv_writer = csv.DictWriter(self._series_file,
+                                                  fieldnames=list(row))
+                self._csv_writer.writeheader()
+            self._csv_writer.writerow(row)
+        self._series_file.flush()
+
+    def _write_openmetrics(self, row: dict[str, Any]) -> None:
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str,
+                   samples: list[tuple[str, float]]) -> None:
+            name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"# HELP {name} {help_text}")
+            suffix = "_total" if metric_type == "counter" else ""
+            for labels, value in samples:
+                lines.append(f"{name}{suffix}{labels} {value}")
+
+        metric("requests_started", "counter", "Requests sent.",
+               [("", self.started)])
+        metric("requests_finished", "counter", "Requests finished.",
+               [("", self.finished)])
+        metric("requests_failed", "counter", "Requests that failed.",
+               [("", self.failed)])
+        metric("output_tokens", "counter", "Output tokens received.",
+               [("", self.output_tokens)])
+        metric("requests_in_flight", "gauge", "Requests awaiting a response.",
+               [("", row["in_flight"])])
+        metric("request_throughput", "gauge",
+               "Requests finished per second in the last window.",
+               [("", row["request_throughput"])])
+        metric("output_throughput", "gauge",
+               "Output tokens per second in the last window.",
+               [("", row["output_throughput"])])
+        for name, help_text in (("ttft", "Time to first token"),
+                                ("itl", "Inter-token latency")):
+            metric(
+                f"{name}_seconds", "gauge",
+                f"{help_text} percentiles of the last window.",
+                [(f'{{quantile="{p / 100:g}"}}',
+                  row[_percentile_key(name, p)] / 1000)
+                 for p in self.percentiles])
+        lines.append("# EOF")
+        # Scrapers must never see a partially written file.
+        tmp_path = f"{self.openmetrics_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.openmetrics_path)
+
+    async def run(self) -> None:
+        """Close a window every interval until cancelled."""
+        next_flush = self.start_time + self.interval
+        while True:
+            # Absolute deadlines, so the windows do not drift.
+            await asyncio.sleep(max(next_flush - time.perf_counter(), 0))
+            self.flush()
+            next_flush += self.interval
+
+    def close(self) -> None:
+        """Export the last, partial window and close the time series."""
+        self.flush()
+        if self._series_file is not None:
+            self._series_file.close()
+            self._series_file = None
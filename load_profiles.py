@@ -0,0 +1,218 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Time-varying request rates for capacity tests.
+
+A LoadProfile is a request rate over time made of consecutive phases (a
+constant rate, a linear ramp, a staircase of steps or a sinusoidal day
+curve), optionally with spikes laid over them. Arrival times are drawn from
+the non-homogeneous Poisson process with that rate, and every phase and
+spike is a named time window that the benchmark reports metrics for.
+
+Profiles are usually given declaratively, as a JSON list with one object per
+phase, e.g.::
+
+    [{"type": "ramp", "start_rate": 1, "end_rate": 20, "duration": 60},
+     {"type": "steps", "rates": [20, 40, 60], "step_duration": 30},
+     {"type": "diurnal", "mean_rate": 30, "amplitude": 20,
+      "period": 120, "duration": 240},
+     {"type": "spike", "at": 200, "duration": 5, "multiplier": 4}]
+
+Rates are in requests/s and times in seconds from the start of the run.
+Spikes do not advance the time; they scale (``multiplier``) and/or add to
+(``rate``) the rate of whatever runs during their window.
+"""
+
+import json
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Union
+
+import numpy as np
+
+RateFunction = Callable[[np.ndarray], np.ndarray]
+
+
+@dataclass
+class Phase:
+    """A named time window of a load profile, ``[start, end)`` seconds."""
+
+    name: str
+    start: float
+    end: float
+
+
+class LoadProfile:
+    """
+    A request rate over time, built phase by phase.
+
+    Each builder method appends a phase after the previous ones and returns
+    the profile, so profiles can be chained:
+    ``LoadProfile().ramp(1, 20, 60).constant(20, 120)``.
+    """
+
+    def __init__(self) -> None:
+        self.phases: list[Phase] = []
+        # (start, end, rate of the local time, upper bound of the rate)
+        self._segments: list[tuple[float, float, RateFunction, float]] = []
+        # (start, end, multiplier, extra rate)
+        self._spikes: list[tuple[float, float, float, float]] = []
+
+    @property
+    def duration(self) -> float:
+        return self._segments[-1][1] if self._segments else 0.0
+
+    def _append(self, name: str, duration: float, rate_fn: RateFunction,
+                max_rate: float) -> "LoadProfile":
+        if duration <= 0:
+            raise ValueError(
+                f"Phase {name} needs a positive duration, got {duration}.")
+        if max_rate < 0:
+            raise ValueError(f"Phase {name} has a negative rate.")
+        start = self.duration
+        self._segments.append((start, start + duration, rate_fn, max_rate))
+        self.phases.append(Phase(name, start, start + duration))
+        return self
+
+    def constant(self,
+                 rate: float,
+                 duration: float,
+                 name: Optional[str] = None) -> "LoadProfile":
+        return self._append(name or f"constant({rate:g})", duration,
+                            lambda t: np.full(t.shape, float(rate)), rate)
+
+    def ramp(self,
+             start_rate: float,
+             end_rate: float,
+             duration: float,
+             name: Optional[str] = None) -> "LoadProfile":
+        """Rate going linearly from `start_rate` to `end_rate`."""
+        slope = (end_rate - start_rate) / duration if duration > 0 else 0.0
+        return self._append(name or f"ramp({start_rate:g}->{end_rate:g})",
+                            duration, lambda t: start_rate + slope * t,
+                            max(start_rate, end_rate))
+
+    def steps(self,
+              rates: list[float],
+              step_duration: float,
+              name: Optional[str] = None) -> "LoadProfile":
+        """A staircase: one constant phase per rate."""
+        for i, rate in enumerate(rates):
+            self.constant(rate,
+                          step_duration,
+                          name=f"{name or 'step'}[{i}]({rate:g})")
+        return self
+
+    def diurnal(self,
+                mean_rate: float,
+                amplitude: float,
+                period: float,
+                duration: float,
+                phase_shift: float = 0.0,
+                name: Optional[str] = None) -> "LoadProfile":
+        """
+        Sinusoidal day curve ``mean_rate + amplitude * sin(2 pi t / period)``
+        clipped at 0, starting `phase_shift` seconds into the period. A
+        compressed day is a `period` of minutes instead of 86400 s.
+        """
+        omega = 2 * math.pi / period
+        return self._append(
+            name or f"diurnal({mean_rate:g}+-{amplitude:g})", duration,
+            lambda t: np.maximum(
+                mean_rate + amplitude * np.sin(omega * (t + phase_shift)), 0),
+            max(mean_rate + abs(amplitude), 0))
+
+    def spike(self,
+              at: float,
+              duration: float,
+              multiplier: float = 1.0,
+              rate: float = 0.0,
+              name: Optional[str] = None) -> "LoadProfile":
+        """
+        Multiply the rate by `multiplier` and add `rate` during
+        ``[at, at + duration)``. The spike is reported as its own phase.
+        """
+        if duration <= 0 or multiplier < 0 or rate < 0:
+            raise ValueError("A spike needs a positive duration and a "
+                             "non-negative multiplier and rate.")
+        self._spikes.append((at, at + duration, multiplier, rate))
+        self.phases.append(
+            Phase(name or f"spike@{at:g}s", at, at + duration))
+        return self
+
+    def rate(self, t: Union[float, np.ndarray]) -> np.ndarray:
+        """Request rate at the times `t`, 0 outside the profile."""
+        t = np.asarray(t, dtype=np.float64)
+        rate = np.zeros(t.shape)
+        for start, end, rate_fn, _ in self._segments:
+            inside = (t >= start) & (t < end)
+            rate[inside] = rate_fn(t[inside] - start)
+        for start, end, multiplier, extra in self._spikes:
+            inside = (t >= start) & (t < end)
+            rate[inside] = rate[inside] * multiplier + extra
+        return rate
+
+    def max_rate(self) -> float:
+        """An upper bound of `rate` over the whole profile."""
+        base = max((bound for *_, bound in self._segments), default=0.0)
+        multiplier = max((m for _, _, m, _ in self._spikes), default=1.0)
+        extra = sum(e for *_, e in self._spikes)
+        return base * max(multiplier, 1.0) + extra
+
+    def arrival_times(self) -> list[float]:
+        """
+        Draw the arrival times of a non-homogeneous Poisson process with
+        this rate, by thinning.
+
+        Candidates are drawn from a homogeneous process at `max_rate` and
+        each is kept with probability ``rate(t) / max_rate``, all in
+        vectorized calls on the global numpy generator, so the schedule is
+        reproducible from the seed.
+        """
+        bound = self.max_rate()
+        if bound <= 0 or self.duration <= 0:
+            return []
+        num_candidates = np.random.poisson(bound * self.duration)
+        candidates = np.sort(
+            np.random.uniform(0, self.duration, size=num_candidates))
+        keep = np.random.uniform(0, bound,
+                                 size=num_candidates) < self.rate(candidates)
+        return candidates[keep].tolist()
+
+    @classmethod
+    def from_spec(cls, spec: Union[str, list[dict[str,
+                                                   Any]]]) -> "LoadProfile":
+        """
+        Build a profile from its JSON description, see the module docstring.
+        `spec` is the parsed list, a JSON string or the path to a JSON file.
+        """
+        if isinstance(spec, str):
+            if os.path.exists(spec):
+                with open(spec, encoding="utf-8") as f:
+                    spec = json.load(f)
+            else:
+                spec = json.loads(spec)
+        if not isinstance(spec, list) or not spec:
+            raise ValueError("A load profile is a non-empty JSON list of "
+                             "phases.")
+        builders = {
+            "constant": cls.constant,
+            "ramp": cls.ramp,
+            "steps": cls.steps,
+            "diurnal": cls.diurnal,
+            "spike": cls.spike,
+        }
+        profile = cls()
+        for phase in spec:
+            phase = dict(phase)
+            phase_type = phase.pop("type", None)
+            if phase_type not in builders:
+                raise ValueError(f"Unknown load profile phase type: "
+                                 f"{phase_type}. Expected one of "
+                                 f"{list(builders)}.")
+            try:
+                builders[phase_type](profile, **phase)
+            except TypeError as err:
+                raise ValueError(
+                    f"Invalid {phase_type} phase {phase}: {err}") from err
+        return profile
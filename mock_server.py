@@ -0,0 +1,530 @@
+# SPDX-License-Identifier: Apache-2.0
+r"""Mock streaming inference server for benchmarking without accelerators.
+
+Serves the streaming protocols parsed by backend_request_func.py, with
+synthetic tokens produced on a configurable schedule:
+
+    POST /v1/completions                OpenAI Completions (vllm, openai, ...)
+    POST /v1/chat/completions           OpenAI Chat Completions
+    POST /generate_stream               TGI, or TensorRT-LLM if the payload
+                                        has a text_input
+    POST /v2/models/{model}/generate_stream
+                                        TensorRT-LLM (Triton)
+    GET  /metrics                       vLLM-style Prometheus metrics
+    GET  /health
+
+Each request generates its max_tokens (max_new_tokens for TGI) tokens, as
+with --ignore-eos. The first chunk is sent after the TTFT and every further
+chunk after the per-token delays of its tokens, drawn from a constant,
+exponential or lognormal distribution. Chunks are due at absolute times, so
+a server that falls behind shows up as lateness rather than drift. Periodic
+batching stalls hold back every chunk that falls due during a stall, the
+way a long prefill holds back the decode steps of a real engine.
+``usage`` is sent after the last chunk when ``stream_options.include_usage``
+is set.
+
+    python mock_server.py --port 8000 --ttft-ms 50 --itl-ms 10
+    python benchmark_serving.py --backend vllm --port 8000 ...
+
+The per-chunk work is a timer and one write of pre-encoded bytes, so one
+process serves 10k+ concurrent streams; uvloop and orjson are used if
+installed. Prompt token counts are approximated by the number of words.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import resource
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aiohttp import web
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+DELAY_DISTRIBUTIONS = ("constant", "exponential", "lognormal")
+# Text of every generated token.
+TOKEN_TEXT = " tok"
+
+
+@dataclass
+class MockConfig:
+    # Mean time to first token and per-token delay, in seconds.
+    ttft: float = 0.05
+    itl: float = 0.01
+    distribution: str = "constant"
+    # Coefficient of variation of the lognormal distribution.
+    cv: float = 0.5
+    tokens_per_chunk: int = 1
+    # Every stall_interval seconds, no chunk is sent for stall_duration.
+    stall_interval: float = 0.0
+    stall_duration: float = 0.0
+    # Fraction of requests answered with HTTP 500, and of streams that are
+    # cut off before their last chunk.
+    error_rate: float = 0.0
+    abort_rate: float = 0.0
+    # Requests streamed at once; the rest wait. 0 means unbounded.
+    max_num_seqs: int = 0
+    prefix_cache_hit_rate: float = 0.0
+    model_name: str = "mock"
+    seed: int = 0
+
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def _event(obj: Any) -> bytes:
+    return b"data: " + _dumps(obj) + b"\n\n"
+
+
+def _count_prompt_tokens(prompt: Any) -> int:
+    if isinstance(prompt, list):
+        if prompt and isinstance(prompt[0], dict):
+            # Chat messages.
+            return sum(
+                _count_prompt_tokens(message.get("content", ""))
+                for message in prompt)
+        return len(prompt)
+    return len(str(prompt).split())
+
+
+class OpenAICompletionsStream:
+    """Encodes the chunks of one OpenAI Completions stream."""
+
+    object_name = "text_completion"
+
+    def __init__(self, request_id: str, model: str) -> None:
+        self.header = {
+            "id": request_id,
+            "object": self.object_name,
+            "created": int(time.time()),
+            "model": model,
+        }
+        # Every chunk but the last has the same bytes.
+        self._cache: dict[tuple[int, bool], bytes] = {}
+
+    def choice(self, text: str, last: bool, first: bool) -> dict[str, Any]:
+        return {
+            "index": 0,
+            "text": text,
+            "logprobs": None,
+            "finish_reason": "length" if last else None,
+        }
+
+    def chunk(self, index: int, count: int, last: bool) -> bytes:
+        key = (count, last)
+        if index > 0 and key in self._cache:
+            return self._cache[key]
+        data = _event({
+            **self.header, "choices":
+            [self.choice(TOKEN_TEXT * count, last, index == 0)]
+        })
+        if index > 0:
+            self._cache[key] = data
+        return data
+
+    def tail(self, prompt_tokens: int, completion_tokens: int,
+             include_usage: bool) -> bytes:
+        usage = b""
+        if include_usage:
+            usage = _event({
+                **self.header,
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+        return usage + b"data: [DONE]\n\n"
+
+
+class OpenAIChatStream(OpenAICompletionsStream):
+
+    object_name = "chat.completion.chunk"
+
+    def choice(self, text: str, last: bool, first: bool) -> dict[str, Any]:
+        delta = {"role": "assistant", "content": text} if first else {
+            "content": text
+        }
+        return {
+            "index": 0,
+            "delta": delta,
+            "logprobs": None,
+            "finish_reason": "length" if last else None,
+        }
+
+
+class TGIStream:
+    """One event per token, the last one with the generated text."""
+
+    def __init__(self, request_id: str, model: str) -> None:
+        pass
+
+    def chunk(self, index: int, count: int, last: bool) -> bytes:
+        events = []
+        for i in range(index, index + count):
+            generated_text = (TOKEN_TEXT * (i + 1) if last
+                              and i == index + count - 1 else None)
+            events.append(
+                _event({
+                    "index": i,
+                    "token": {
+                        "id": 0,
+                        "text": TOKEN_TEXT,
+                        "logprob": 0.0,
+                        "special": False,
+                    },
+                    "generated_text": generated_text,
+                    "details": None,
+                }))
+        return b"".join(events)
+
+    def tail(self, prompt_tokens: int, completion_tokens: int,
+             include_usage: bool) -> bytes:
+        return b""
+
+
+class TRTLLMStream:
+    """One event per token, as the Triton generate_stream endpoint sends."""
+
+    def __init__(self, request_id: str, model: str) -> None:
+        self._event = _event({
+            "model_name": model,
+            "model_version": "1",
+            "sequence_end": False,
+            "sequence_id": 0,
+            "sequence_start": False,
+            "text_output": TOKEN_TEXT,
+        })
+
+    def chunk(self, index: int, count: int, last: bool) -> bytes:
+        return self._event * count
+
+    def tail(self, prompt_tokens: int, completion_tokens: int,
+             include_usage: bool) -> bytes:
+        return b""
+
+
+class MockServer:
+
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.epoch = time.perf_counter()
+        self.slots = (asyncio.Semaphore(config.max_num_seqs)
+                      if config.max_num_seqs > 0 else None)
+        self.num_requests = 0
+        self.running = 0
+        self.waiting = 0
+        self.prompt_tokens = 0
+        self.generation_tokens = 0
+        self.prefix_cache_hits = 0
+        self.successes = 0
+        self.errors = 0
+        self.aborts = 0
+        if config.distribution == "lognormal":
+            self._sigma = math.sqrt(math.log1p(config.cv**2))
+
+    def delay(self, mean: float, count: int = 1) -> float:
+        """Total of `count` delays with the given mean, in seconds."""
+        if mean <= 0:
+            return 0.0
+        distribution = self.config.distribution
+        if distribution == "constant":
+            return mean * count
+        if distribution == "exponential":
+            # A sum of exponentials is gamma distributed.
+            return self.random.gammavariate(count, mean)
+        mu = math.log(mean) - self._sigma**2 / 2
+        return sum(
+            self.random.lognormvariate(mu, self._sigma)
+            for _ in range(count))
+
+    def after_stalls(self, due: float) -> float:
+        """Postpone a chunk due during a batching stall to its end."""
+        interval = self.config.stall_interval
+        if interval <= 0 or self.config.stall_duration <= 0:
+            return due
+        phase = (due - self.epoch) % interval
+        if phase < self.config.stall_duration:
+            due += self.config.stall_duration - phase
+        return due
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        return await self._serve(request, OpenAICompletionsStream,
+                                 "max_tokens", "prompt")
+
+    async def chat_completions(self,
+                               request: web.Request) -> web.StreamResponse:
+        return await self._serve(request, OpenAIChatStream, "max_tokens",
+                                 "messages")
+
+    async def generate_stream(self,
+                              request: web.Request) -> web.StreamResponse:
+        body = json_loads(await request.read())
+        if "text_input" in body:
+            return await self._serve(request, TRTLLMStream, "max_tokens",
+                                     "text_input", body)
+        return await self._serve(request, TGIStream, "max_new_tokens",
+                                 "inputs", body)
+
+    async def trt_llm_generate_stream(
+            self, request: web.Request) -> web.StreamResponse:
+        return await self._serve(request, TRTLLMStream, "max_tokens",
+                                 "text_input")
+
+    async def _serve(self,
+                     request: web.Request,
+                     stream_class: type,
+                     max_tokens_key: str,
+                     prompt_key: str,
+                     body: Optional[dict[str, Any]] = None) -> web.StreamResponse:
+        if body is None:
+            body = json_loads(await request.read())
+        params = body.get("parameters", body)
+        num_tokens = int(params.get(max_tokens_key) or 16)
+        prompt_tokens = _count_prompt_tokens(body.get(prompt_key, ""))
+        self.num_requests += 1
+        if self.random.random() < self.config.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {"error": {
+                    "message": "Injected error",
+                    "code": 500
+                }},
+                status=500)
+
+        self.waiting += 1
+        try:
+            if self.slots is not None:
+                await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.prompt_tokens += prompt_tokens
+        self.prefix_cache_hits += int(prompt_tokens *
+                                      self.config.prefix_cache_hit_rate)
+        try:
+            return await self._stream(
+                request,
+                stream_class(f"cmpl-{self.num_requests}",
+                             body.get("model") or self.config.model_name),
+                num_tokens, prompt_tokens,
+                bool((body.get("stream_options") or {}).get("include_usage")))
+        finally:
+            self.running -= 1
+            if self.slots is not None:
+                self.slots.release()
+
+    async def _stream(self, request: web.Request, stream: Any,
+                      num_tokens: int, prompt_tokens: int,
+                      include_usage: bool) -> web.StreamResponse:
+        config = self.config
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        })
+        await response.prepare(request)
+        abort_at = (self.random.randrange(num_tokens)
+                    if self.random.random() < config.abort_rate else None)
+        due = time.perf_counter() + self.delay(config.ttft)
+        sent = 0
+        while sent < num_tokens:
+            count = min(config.tokens_per_chunk, num_tokens - sent)
+            due = self.after_stalls(due)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if abort_at is not None and sent >= abort_at:
+                # Drop the connection mid-stream, as a crashed worker would.
+                self.aborts += 1
+                request.transport.close()
+                return response
+            await response.write(
+                stream.chunk(sent, count, sent + count == num_tokens))
+            sent += count
+            self.generation_tokens += count
+            due += self.delay(config.itl, count)
+        await response.write(
+            stream.tail(prompt_tokens, num_tokens, include_usage))
+        await response.write_eof()
+        self.successes += 1
+        return response
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        """The vLLM metrics that server_metrics.py scrapes, and a few more."""
+        lines = []
+        labels = f'{{model_name="{self.config.model_name}"}}'
+
+        def metric(name: str, metric_type: str, help_text: str,
+                   value: float) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            suffix = "_total" if metric_type == "counter" else ""
+            lines.append(f"{name}{suffix}{labels} {float(value)}")
+
+        max_num_seqs = self.config.max_num_seqs
+        metric("vllm:num_requests_running", "gauge",
+               "Number of requests being streamed.", self.running)
+        metric("vllm:num_requests_waiting", "gauge",
+               "Number of requests waiting for a slot.", self.waiting)
+        metric("vllm:kv_cache_usage_perc", "gauge",
+               "Fraction of --max-num-seqs in use.",
+               self.running / max_num_seqs if max_num_seqs else 0.0)
+        metric("vllm:prefix_cache_queries", "counter",
+               "Prompt tokens looked up in the prefix cache.",
+               self.prompt_tokens)
+        metric("vllm:prefix_cache_hits", "counter",
+               "Prompt tokens found in the prefix cache.",
+               self.prefix_cache_hits)
+        metric("vllm:num_preemptions", "counter", "Preempted requests.", 0)
+        metric("vllm:prompt_tokens", "counter", "Prompt tokens processed.",
+               self.prompt_tokens)
+        metric("vllm:generation_tokens", "counter", "Tokens generated.",
+               self.generation_tokens)
+        metric("vllm:request_success", "counter", "Requests completed.",
+               self.successes)
+        metric("mock:injected_errors", "counter",
+               "Requests answered with an injected HTTP 500.", self.errors)
+        metric("mock:injected_aborts", "counter",
+               "Streams cut off on purpose.", self.aborts)
+        return web.Response(text="\n".join(lines) + "\n")
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/completions", self.completions)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/generate_stream", self.generate_stream)
+        app.router.add_post("/v2/models/{model}/generate_stream",
+                            self.trt_llm_generate_stream)
+        app.router.add_get("/metrics", self.metrics)
+        app.router.add_get("/health", self.health)
+        return app
+
+
+def _raise_open_file_limit() -> None:
+    # Every stream holds a socket; the default soft limit is often 1024.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(args: argparse.Namespace) -> None:
+    config = MockConfig(
+        ttft=args.ttft_ms / 1000,
+        itl=args.itl_ms / 1000,
+        distribution=args.delay_distribution,
+        cv=args.delay_cv,
+        tokens_per_chunk=args.tokens_per_chunk,
+        stall_interval=args.stall_interval_ms / 1000,
+        stall_duration=args.stall_ms / 1000,
+        error_rate=args.error_rate,
+        abort_rate=args.abort_rate,
+        max_num_seqs=args.max_num_seqs,
+        prefix_cache_hit_rate=args.prefix_cache_hit_rate,
+        model_name=args.served_model_name,
+        seed=args.seed,
+    )
+    _raise_open_file_limit()
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    async def create_app() -> web.Application:
+        # The semaphore must be created on the serving loop.
+        return MockServer(config).create_app()
+
+    print(f"Mock server listening on http://{args.host}:{args.port}")
+    web.run_app(create_app(),
+                host=args.host,
+                port=args.port,
+                access_log=None,
+                backlog=args.backlog,
+                print=None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Mock streaming inference server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--served-model-name",
+                        type=str,
+                        default="mock",
+                        help="Model name of the metric labels, and of the "
+                        "responses to requests without a model.")
+    parser.add_argument("--ttft-ms",
+                        type=float,
+                        default=50.0,
+                        help="Mean time to first token in milliseconds.")
+    parser.add_argument("--itl-ms",
+                        type=float,
+                        default=10.0,
+                        help="Mean delay per output token in milliseconds. "
+                        "0 streams every token at once.")
+    parser.add_argument("--delay-distribution",
+                        type=str,
+                        default="constant",
+                        choices=DELAY_DISTRIBUTIONS,
+                        help="Distribution of the TTFT and per-token "
+                        "delays.")
+    parser.add_argument("--delay-cv",
+                        type=float,
+                        default=0.5,
+                        help="Coefficient of variation of the lognormal "
+                        "delays.")
+    parser.add_argument("--tokens-per-chunk",
+                        type=int,
+                        default=1,
+                        help="Tokens sent per network write. OpenAI streams "
+                        "put them in one event, TGI and TensorRT-LLM "
+                        "streams send one event per token.")
+    parser.add_argument("--stall-interval-ms",
+                        type=float,
+                        default=0.0,
+                        help="Period of the batching stalls, 0 for none.")
+    parser.add_argument("--stall-ms",
+                        type=float,
+                        default=0.0,
+                        help="Length of each batching stall, during which "
+                        "no stream sends a chunk.")
+    parser.add_argument("--error-rate",
+                        type=float,
+                        default=0.0,
+                        help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument("--abort-rate",
+                        type=float,
+                        default=0.0,
+                        help="Fraction of streams cut off before the end.")
+    parser.add_argument("--max-num-seqs",
+                        type=int,
+                        default=0,
+                        help="Requests streamed at once, the others wait "
+                        "and count as waiting in /metrics. 0 for no limit.")
+    parser.add_argument("--prefix-cache-hit-rate",
+                        type=float,
+                        default=0.0,
+                        help="Fraction of prompt tokens reported as prefix "
+                        "cache hits in /metrics.")
+    parser.add_argument("--backlog",
+                        type=int,
+                        default=4096,
+                        help="Listen backlog, for bursts of new "
+                        "connections.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args)
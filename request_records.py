@@ -0,0 +1,161 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Columnar storage for the per-request results of a benchmark run.
+
+Each request's timings are copied into preallocated numpy columns as soon as
+the request finishes, so the RequestFuncOutput objects can be released and
+the metrics and the detailed result file are computed from whole columns
+instead of by looping over per-request Python objects.
+"""
+
+from typing import Optional
+
+import numpy as np
+from backend_request_func import RequestFuncOutput
+
+_EMPTY_ITL = np.zeros(0)
+
+# Numpy columns and the value of a row that was not recorded.
+_COLUMN_DEFAULTS = {
+    "success": False,
+    "output_tokens": -1,
+    "prompt_len": 0,
+    "latency": 0.0,
+    "ttft": 0.0,
+    "itl_tail_sum": 0.0,
+    "connect_time": 0.0,
+    "pool_wait": 0.0,
+    "scheduled_time": 0.0,
+    "dispatch_time": 0.0,
+    "start_time": 0.0,
+    "user_id": -1,
+}
+_LIST_COLUMNS = ("itls", "generated_texts", "errors")
+
+
+class RequestRecords:
+    """
+    Row ``i`` holds the outcome of the ``i``-th request of the run.
+
+    Per-request inter-token latencies are only kept with ``keep_itl`` (exact
+    percentiles), and generated texts only with ``keep_text``. Without the
+    text, a backend that does not report its output token count is credited
+    with one token per streamed chunk.
+
+    When the number of requests is not known up front, as in a timed run,
+    ``num_requests`` is only the initial capacity: recording a row past the
+    end grows every column, and `trim` drops the unused rows at the end.
+    """
+
+    def __init__(self,
+                 num_requests: int,
+                 keep_itl: bool = True,
+                 keep_text: bool = True) -> None:
+        self.success = np.zeros(num_requests, dtype=bool)
+        # -1 where the backend did not report the number of output tokens.
+        self.output_tokens = np.full(num_requests, -1, dtype=np.int64)
+        self.prompt_len = np.zeros(num_requests, dtype=np.int64)
+        self.latency = np.zeros(num_requests)
+        self.ttft = np.zeros(num_requests)
+        # Sum of the inter-token latencies after the first one.
+        self.itl_tail_sum = np.zeros(num_requests)
+        self.connect_time = np.zeros(num_requests)
+        self.pool_wait = np.zeros(num_requests)
+        self.scheduled_time = np.zeros(num_requests)
+        self.dispatch_time = np.zeros(num_requests)
+        self.start_time = np.zeros(num_requests)
+        # Virtual user that sent the request in closed-loop mode, else -1.
+        self.user_id = np.full(num_requests, -1, dtype=np.int64)
+        self.itls: Optional[list[np.ndarray]] = (
+            [_EMPTY_ITL] * num_requests if keep_itl else None)
+        self.generated_texts: Optional[list[str]] = (
+            [""] * num_requests if keep_text else None)
+        self.errors: list[str] = [""] * num_requests
+        # One past the highest recorded row.
+        self.num_recorded = 0
+
+    def __len__(self) -> int:
+        return self.success.size
+
+    @property
+    def keep_itl(self) -> bool:
+        return self.itls is not None
+
+    @property
+    def keep_text(self) -> bool:
+        return self.generated_texts is not None
+
+    def _grow(self, size: int) -> None:
+        # Double the capacity so that appending stays amortized O(1).
+        size = max(size, 2 * len(self))
+        for name, default in _COLUMN_DEFAULTS.items():
+            column = getattr(self, name)
+            grown = np.full(size, default, dtype=column.dtype)
+            grown[:column.size] = column
+            setattr(self, name, grown)
+        for name, default in zip(_LIST_COLUMNS, (_EMPTY_ITL, "", "")):
+            column = getattr(self, name)
+            if column is not None:
+                column.extend([default] * (size - len(column)))
+
+    def _select_rows(self, rows) -> "RequestRecords":
+        selected = RequestRecords(0, self.keep_itl, self.keep_text)
+        for name in _COLUMN_DEFAULTS:
+            setattr(selected, name, getattr(self, name)[rows])
+        for name in _LIST_COLUMNS:
+            column = getattr(self, name)
+            if column is not None:
+                setattr(selected, name, [
+                    column[i] for i in np.arange(len(self))[rows].tolist()
+                ])
+        selected.num_recorded = len(selected)
+        return selected
+
+    def trim(self) -> "RequestRecords":
+        """The records without the rows past the last recorded one."""
+        if self.num_recorded == len(self):
+            return self
+        return self._select_rows(slice(0, self.num_recorded))
+
+    def select(self, mask: np.ndarray) -> "RequestRecords":
+        """A copy of the rows where ``mask`` is set, in order."""
+        return self._select_rows(np.asarray(mask, dtype=bool))
+
+    def record(self, index: int, output: RequestFuncOutput) -> None:
+        if index >= len(self):
+            self._grow(index + 1)
+        self.num_recorded = max(self.num_recorded, index + 1)
+        itl = output.itl
+        self.success[index] = output.success
+        if output.output_tokens is not None:
+            self.output_tokens[index] = output.output_tokens
+        elif not self.keep_text and output.success:
+            self.output_tokens[index] = itl.size + 1
+        self.prompt_len[index] = output.prompt_len
+        self.latency[index] = output.latency
+        self.ttft[index] = output.ttft
+        self.itl_tail_sum[index] = itl[1:].sum()
+        self.connect_time[index] = output.connect_time
+        self.pool_wait[index] = output.pool_wait
+        self.scheduled_time[index] = output.scheduled_time
+        self.dispatch_time[index] = output.dispatch_time
+        self.start_time[index] = output.start_time
+        if self.itls is not None:
+            self.itls[index] = itl
+        if self.generated_texts is not None:
+            self.generated_texts[index] = output.generated_text
+        self.errors[index] = output.error
+
+    def put(self, indices: list[int], other: "RequestRecords") -> None:
+        """Copy every row of ``other`` to the rows ``indices`` of self."""
+        index_array = np.asarray(indices, dtype=np.int64)
+        if index_array.size:
+            self.num_recorded = max(self.num_recorded,
+                                    int(index_array.max()) + 1)
+        for name in _COLUMN_DEFAULTS:
+            getattr(self, name)[index_array] = getattr(other, name)
+        for name in _LIST_COLUMNS:
+            column = getattr(self, name)
+            if column is not None:
+                for index, value in zip(indices, getattr(other, name)):
+                    column[index] = value
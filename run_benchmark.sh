@@ -25,6 +25,8 @@ backend="vllm"
 
 # 脚本配置参数
 sleep_time=1
+# 数据集缓存目录，相同参数的测试复用已生成的请求
+dataset_cache_dir="./dataset_cache"
 
 # 创建日志目录
 mkdir -p "$log_dir"
@@ -61,6 +63,7 @@ for concurrency in "${concurrencies[@]}"; do
                 --random-input-len "$input_len" \
                 --random-output-len "$output_len" \
                 --port "$port" \
+                --dataset-cache-dir "$dataset_cache_dir" \
                 $trust_remote_code \
                 2>&1 | tee -a "$log_file"
 
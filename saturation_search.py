@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Search for the highest load a server sustains within its goodput SLOs.
+
+The searched parameter (the request rate or the maximum concurrency) is
+grown geometrically from a lower bound until a probe misses the SLOs, then
+bisected between the last passing and the first failing value. Each probe
+is a full benchmark run; a probe passes when the share of requests that
+completed within every --goodput SLO is at least the required ratio. The
+highest passing value is the knee, and every probe is kept as a point of
+the throughput-vs-latency curve.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+SEARCH_PARAMETERS = ("request-rate", "max-concurrency")
+
+
+@dataclass
+class SearchProbe:
+    value: float
+    passed: bool
+    good_ratio: float
+    result: dict[str, Any]
+
+    def curve_point(self) -> dict[str, Any]:
+        """The probe as a point of the throughput-vs-latency curve."""
+        point = {
+            "value": self.value,
+            "passed": self.passed,
+            "good_ratio": self.good_ratio,
+        }
+        for key in ("request_throughput", "request_goodput",
+                    "output_throughput", "mean_ttft_ms", "p99_ttft_ms",
+                    "mean_tpot_ms", "p99_tpot_ms", "mean_e2el_ms",
+                    "p99_e2el_ms"):
+            if key in self.result:
+                point[key] = self.result[key]
+        return point
+
+
+def good_ratio(result: dict[str, Any], num_requests: int) -> float:
+    """Share of the sent requests that completed within every SLO."""
+    good = result["request_goodput"] * result["duration"]
+    return good / num_requests if num_requests else 0.0
+
+
+def search_saturation(
+    run_probe: Callable[[float], dict[str, Any]],
+    num_requests: int,
+    low: float,
+    high: float,
+    min_good_ratio: float,
+    growth: float = 2.0,
+    tolerance: float = 0.05,
+    integer: bool = False,
+) -> tuple[Optional[SearchProbe], list[SearchProbe]]:
+    """
+    Find the highest value in ``[low, high]`` whose probe passes.
+
+    `run_probe(value)` runs one benchmark and returns its result dict. The
+    bisection stops once the passing and failing values are within
+    `tolerance` of each other, relatively, or adjacent for an `integer`
+    parameter. Returns the knee probe, None if even `low` fails, and every
+    probe in the order they were run.
+    """
+    if not 0 < low <= high:
+        raise ValueError(f"Invalid search range [{low}, {high}].")
+    if growth <= 1:
+        raise ValueError(f"The search growth must be above 1, got {growth}.")
+    probes: list[SearchProbe] = []
+
+    def probe(value: float) -> SearchProbe:
+        print(f"\nSaturation search: probing {value:g}")
+        result = run_probe(value)
+        ratio = good_ratio(result, num_requests)
+        probes.append(
+            SearchProbe(value=value,
+                        passed=ratio >= min_good_ratio,
+                        good_ratio=ratio,
+                        result=result))
+        print(f"Saturation search: {value:g} "
+              f"{'passed' if probes[-1].passed else 'failed'} with "
+              f"{ratio * 100:.1f}% of requests within the SLOs")
+        return probes[-1]
+
+    knee: Optional[SearchProbe] = None
+    failed: Optional[SearchProbe] = None
+    value = low
+    while True:
+        current = probe(value)
+        if not current.passed:
+            failed = current
+            break
+        knee = current
+        if value >= high:
+            break
+        value = min(value * growth, high)
+        if integer:
+            value = float(max(int(value), int(knee.value) + 1))
+
+    while knee is not None and failed is not None:
+        if integer:
+            if failed.value - knee.value <= 1:
+                break
+            value = float((int(knee.value) + int(failed.value)) // 2)
+        else:
+            if failed.value - knee.value <= tolerance * knee.value:
+                break
+            value = (knee.value + failed.value) / 2
+        current = probe(value)
+        if current.passed:
+            knee = current
+        else:
+            failed = current
+    return knee, probes
+
+
+def print_search_results(parameter: str, knee: Optional[SearchProbe],
+                         probes: list[SearchProbe]) -> None:
+    print("=" * 55)
+    print("{:^55}".format(f" Saturation Search ({parameter}) "))
+    print("=" * 55)
+    print("{:>10} {:>6} {:>8} {:>9} {:>9} {:>9}".format(
+        "Value", "Pass", "Good %", "Req/s", "P99 TTFT", "P99 E2EL"))
+    for probe in sorted(probes, key=lambda p: p.value):
+        print("{:>10g} {:>6} {:>8.1f} {:>9.2f} {:>9.1f} {:>9.1f}".format(
+            probe.value, "yes" if probe.passed else "no",
+            probe.good_ratio * 100, probe.result["request_throughput"],
+            probe.result.get("p99_ttft_ms", float("nan")),
+            probe.result.get("p99_e2el_ms", float("nan"))))
+    print("-" * 55)
+    if knee is None:
+        print(f"No {parameter} in the search range met the SLOs.")
+    else:
+        print("{:<30} {:>24g}".format(f"Knee ({parameter}):", knee.value))
+        print("{:<30} {:>18.2f} req/s".format(
+            "Request throughput at knee:",
+            knee.result["request_throughput"]))
+        print("{:<30} {:>18.2f} req/s".format(
+            "Goodput at knee:", knee.result["request_goodput"]))
+    print("=" * 55)
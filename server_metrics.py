@@ -0,0 +1,164 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Server-side metrics scraped from the Prometheus endpoint during a run.
+
+Client-side latencies alone do not tell why TTFT grew: the server may have
+been queueing requests, preempting them or running out of KV cache. The
+scraper polls the server's ``/metrics`` endpoint in the background and
+keeps a time series of the metrics that explain this, stamped with
+``time.perf_counter`` like the requests themselves.
+
+The exposition text is parsed line by line as it arrives, and only the
+samples of the tracked families are decoded; the histograms that make up
+most of a vLLM scrape are skipped without being split. Samples of a family
+with several label sets, e.g. one per model or engine, are summed for
+counts and averaged for ratios such as the KV cache usage.
+"""
+
+import asyncio
+import time
+import warnings
+from typing import Any, Optional
+
+import aiohttp
+import numpy as np
+
+# Tracked metrics: result name -> (kind, vLLM metric names across versions).
+# A "ratio" is a gauge between 0 and 1 that is averaged across label sets.
+SERVER_METRICS: dict[str, tuple[str, tuple[str, ...]]] = {
+    "num_requests_running": ("gauge", ("vllm:num_requests_running", )),
+    "num_requests_waiting": ("gauge", ("vllm:num_requests_waiting", )),
+    "num_requests_swapped": ("gauge", ("vllm:num_requests_swapped", )),
+    "kv_cache_usage": ("ratio", ("vllm:gpu_cache_usage_perc",
+                                 "vllm:kv_cache_usage_perc")),
+    "prefix_cache_hit_rate": ("ratio", ("vllm:gpu_prefix_cache_hit_rate", )),
+    "prefix_cache_queries": ("counter", ("vllm:prefix_cache_queries_total",
+                                         "vllm:gpu_prefix_cache_queries_total")),
+    "prefix_cache_hits": ("counter", ("vllm:prefix_cache_hits_total",
+                                      "vllm:gpu_prefix_cache_hits_total")),
+    "num_preemptions": ("counter", ("vllm:num_preemptions_total", )),
+}
+# Sample name -> result name.
+_SAMPLE_NAMES = {
+    sample_name: name
+    for name, (_, sample_names) in SERVER_METRICS.items()
+    for sample_name in sample_names
+}
+
+
+def parse_sample(line: bytes) -> Optional[tuple[str, float]]:
+    """
+    Return the result name and value of an exposition line that holds a
+    sample of a tracked metric, else None.
+    """
+    if not line.startswith(b"vllm:"):
+        return None
+    end = line.find(b"{")
+    if end < 0:
+        end = line.find(b" ")
+    name = _SAMPLE_NAMES.get(line[:end].decode("ascii", "replace"))
+    if name is None:
+        return None
+    # The value follows the labels; an optional timestamp follows the value.
+    if line[end:end + 1] == b"{":
+        end = line.rfind(b"}") + 1
+    try:
+        return name, float(line[end:].split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+class ServerMetricsScraper:
+    """Polls `url` every `interval` seconds until cancelled."""
+
+    def __init__(self, url: str, interval: float = 1.0) -> None:
+        if interval <= 0:
+            raise ValueError(f"The interval must be positive, got {interval}.")
+        self.url = url
+        self.interval = interval
+        self.times: list[float] = []
+        self.values: dict[str, list[float]] = {
+            name: []
+            for name in SERVER_METRICS
+        }
+        self.failures = 0
+
+    async def scrape(self, session: aiohttp.ClientSession) -> None:
+        sent = time.perf_counter()
+        sums: dict[str, float] = {}
+        counts: dict[str, int] = {}
+        async with session.get(self.url) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                sample = parse_sample(line)
+                if sample is not None:
+                    name, value = sample
+                    sums[name] = sums.get(name, 0.0) + value
+                    counts[name] = counts.get(name, 0) + 1
+        # Stamped halfway through the scrape.
+        self.times.append((sent + time.perf_counter()) / 2)
+        for name, values in self.values.items():
+            value = sums.get(name, np.nan)
+            if SERVER_METRICS[name][0] == "ratio" and name in counts:
+                # Summed across engines, a fraction would exceed 1.
+                value /= counts[name]
+            values.append(value)
+
+    async def run(self) -> None:
+        timeout = aiohttp.ClientTimeout(total=max(self.interval, 1.0))
+        # A session of its own, so scrapes never wait for the pooled
+        # connections of the benchmark requests.
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            next_scrape = time.perf_counter()
+            while True:
+                try:
+                    await self.scrape(session)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    if self.failures == 0:
+                        warnings.warn(f"Scraping {self.url} failed: {err!r}")
+                    self.failures += 1
+                next_scrape += self.interval
+                await asyncio.sleep(max(next_scrape - time.perf_counter(), 0))
+
+    def results(self, start_time: float, duration: float) -> dict[str, Any]:
+        """
+        Summaries of the scrapes in the `duration` seconds from
+        `start_time` and every scrape, with times relative to `start_time`.
+        """
+        times = np.asarray(self.times) - start_time
+        inside = (times >= 0) & (times <= duration)
+        summary: dict[str, Any] = {
+            "scrapes": int(inside.sum()),
+            "failed_scrapes": self.failures,
+        }
+        # Counters grow from the last scrape before the window.
+        before = np.flatnonzero(times < 0)
+        counted = inside.copy()
+        if before.size:
+            counted[before[-1]] = True
+        for name, (kind, _) in SERVER_METRICS.items():
+            values = np.asarray(self.values[name])
+            values = values[counted if kind == "counter" else inside]
+            values = values[~np.isnan(values)]
+            if not values.size:
+                continue
+            if kind != "counter":
+                summary[f"mean_{name}"] = float(values.mean())
+                summary[f"max_{name}"] = float(values.max())
+            else:
+                summary[f"delta_{name}"] = float(values[-1] - values[0])
+        queries = summary.get("delta_prefix_cache_queries")
+        if queries and "delta_prefix_cache_hits" in summary:
+            # The hit rate of the run itself, not since the server started.
+            summary["run_prefix_cache_hit_rate"] = (
+                summary["delta_prefix_cache_hits"] / queries)
+        return {
+            "server_metrics": summary,
+            "server_metrics_series": {
+                "time": times.tolist(),
+                **{
+                    name: [None if np.isnan(v) else v for v in values]
+                    for name, values in self.values.items()
+                },
+            },
+        }
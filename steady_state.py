@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: Apache-2.0
+"""
+Detection of the steady state of a benchmark run.
+
+Completions and output tokens are counted per fixed window of the run, by
+the time each request finished. The ramp-up at the start and the drain at
+the end are cut with the MSER rule (Marginal Standard Error Rule): the
+truncation point is the one that minimizes the standard error of the mean
+of the windows that remain, searched over the first half of the series.
+What remains is the steady state.
+
+The steady state is reported as settled once the 95% confidence interval of
+its mean rates, estimated from batch means, is within a relative tolerance.
+While a run is in progress, `SteadyStateMonitor` repeats the detection on
+the requests finished so far and can end the run early once it settled.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from request_records import RequestRecords
+
+# The steady state is split into this many batches, whose means are close
+# to independent even when neighbouring windows are correlated.
+NUM_BATCHES = 10
+# 97.5% quantile of Student's t with NUM_BATCHES - 1 degrees of freedom.
+BATCH_MEANS_T = 2.262
+
+
+@dataclass
+class SteadyState:
+    """The steady part of a run, in seconds from its start."""
+    start: float
+    end: float
+    request_rate: float
+    # Half-width of the 95% confidence interval of request_rate.
+    request_rate_half_width: float
+    # None when the backend did not report every output token count.
+    output_rate: Optional[float]
+    output_rate_half_width: Optional[float]
+    # Whether every confidence interval is within the tolerance.
+    settled: bool
+
+
+def window_rates(finish_times: np.ndarray, weights: Optional[np.ndarray],
+                 window: float) -> np.ndarray:
+    """
+    Rate per `window` of the events at `finish_times`, each counted with
+    its weight. The last, partial window is dropped.
+    """
+    if finish_times.size == 0:
+        return np.zeros(0)
+    num_windows = int(finish_times.max() // window)
+    bins = (finish_times // window).astype(np.int64)
+    keep = bins < num_windows
+    return np.bincount(bins[keep],
+                       weights=None if weights is None else weights[keep],
+                       minlength=num_windows) / window
+
+
+def mser_truncation(series: np.ndarray) -> int:
+    """
+    Number of leading values to drop so that the standard error of the mean
+    of the rest is smallest, searched over the first half of the series.
+    """
+    n = series.size
+    if n < 2:
+        return 0
+    # Sums over series[d:] for every d, from reversed cumulative sums.
+    remaining = np.arange(n, 0, -1, dtype=np.float64)
+    tail_sum = np.cumsum(series[::-1])[::-1]
+    tail_square_sum = np.cumsum(np.square(series)[::-1])[::-1]
+    squared_deviations = tail_square_sum - np.square(tail_sum) / remaining
+    statistic = squared_deviations / np.square(remaining)
+    return int(np.argmin(statistic[:n // 2 + 1]))
+
+
+def _batch_means_half_width(series: np.ndarray) -> float:
+    batch_size = series.size // NUM_BATCHES
+    batches = series[:batch_size * NUM_BATCHES].reshape(NUM_BATCHES,
+                                                        batch_size)
+    return float(BATCH_MEANS_T * batches.mean(axis=1).std(ddof=1) /
+                 np.sqrt(NUM_BATCHES))
+
+
+def detect_steady_state(
+    finish_times: np.ndarray,
+    output_tokens: Optional[np.ndarray],
+    window: float = 1.0,
+    tolerance: float = 0.05,
+    min_windows: int = 2 * NUM_BATCHES,
+) -> Optional[SteadyState]:
+    """
+    Find the steady state of the requests that finished at `finish_times`,
+    in seconds from the start of the run, and produced `output_tokens`.
+
+    Returns None while fewer than `min_windows` windows remain after the
+    ramp-up and the drain are cut.
+    """
+    series = [window_rates(finish_times, None, window)]
+    if output_tokens is not None:
+        series.append(
+            window_rates(finish_times, output_tokens.astype(np.float64),
+                         window))
+    # Each rate settles on its own; the steady state must hold for all.
+    start = max(mser_truncation(rates) for rates in series)
+    end = series[0].size - max(
+        mser_truncation(rates[start:][::-1]) for rates in series)
+    if end - start < max(min_windows, NUM_BATCHES):
+        return None
+    steady = [rates[start:end] for rates in series]
+    means = [float(rates.mean()) for rates in steady]
+    half_widths = [_batch_means_half_width(rates) for rates in steady]
+    return SteadyState(
+        start=start * window,
+        end=end * window,
+        request_rate=means[0],
+        request_rate_half_width=half_widths[0],
+        output_rate=means[1] if len(means) > 1 else None,
+        output_rate_half_width=half_widths[1] if len(means) > 1 else None,
+        settled=all(half_width <= tolerance * mean
+                    for mean, half_width in zip(means, half_widths)),
+    )
+
+
+def records_finish_times(records: RequestRecords, start_time: float,
+                         success: np.ndarray) -> np.ndarray:
+    """Finish times of the `success` rows, in seconds from `start_time`."""
+    return (records.start_time[success] + records.latency[success] -
+            start_time)
+
+
+class SteadyStateMonitor:
+    """
+    Repeat the steady-state detection while the run is in progress and set
+    `stop_event` as soon as the steady state settled.
+    """
+
+    def __init__(self,
+                 window: float = 1.0,
+                 tolerance: float = 0.05,
+                 min_windows: int = 2 * NUM_BATCHES) -> None:
+        self.window = window
+        self.tolerance = tolerance
+        self.min_windows = min_windows
+        # Seconds into the run at which it was stopped, if it was.
+        self.stopped_at: Optional[float] = None
+
+    def check(self, records: RequestRecords,
+              start_time: float) -> Optional[SteadyState]:
+        success = records.success
+        output_tokens = records.output_tokens[success]
+        return detect_steady_state(
+            records_finish_times(records, start_time, success),
+            # Token rates are only tracked when every count is known.
+            output_tokens if (output_tokens >= 0).all() else None,
+            window=self.window,
+            tolerance=self.tolerance,
+            min_windows=self.min_windows)
+
+    async def run(self, records: RequestRecords, start_time: float,
+                  stop_event: asyncio.Event) -> None:
+        while not stop_event.is_set():
+            await asyncio.sleep(self.window)
+            state = self.check(records, start_time)
+            if state is not None and state.settled:
+                self.stopped_at = time.perf_counter() - start_time
+                print(f"\nSteady state settled after {self.stopped_at:.1f} "
+                      "s, stopping the run.")
+                stop_event.set()
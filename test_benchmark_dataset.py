@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import json
+import random
+import time
+
+import pytest
+
+from benchmark_dataset import PrefetchIterator, iter_json_array
+
+
+def _parse(tmp_path, text: str, chunk_size: int) -> list:
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding="utf-8")
+    data = path.read_bytes()
+    elements = []
+    for element, start, end in iter_json_array(str(path),
+                                               chunk_size=chunk_size):
+        assert json.loads(data[start:end]) == element
+        elements.append(element)
+    return elements
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 10, 4096])
+def test_numbers_split_across_chunks(tmp_path, chunk_size):
+    text = "[1.5e3, 2.25, -7, 0.5E-2, 10, 3e+1]"
+    assert _parse(tmp_path, text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_matches_json_load(tmp_path, chunk_size):
+    rng = random.Random(0)
+
+    def value(depth: int = 0):
+        kind = rng.randrange(6 if depth < 2 else 4)
+        if kind == 0:
+            return rng.randint(-10**6, 10**6)
+        if kind == 1:
+            return rng.uniform(-1e6, 1e6) * 10**rng.randint(-5, 5)
+        if kind == 2:
+            return rng.choice([True, False, None])
+        if kind == 3:
+            return "".join(rng.choice('ab"é\\n ') for _ in range(5))
+        if kind == 4:
+            return [value(depth + 1) for _ in range(rng.randrange(4))]
+        return {f"k{i}": value(depth + 1) for i in range(rng.randrange(4))}
+
+    for _ in range(50):
+        array = [value() for _ in range(rng.randrange(1, 8))]
+        text = json.dumps(array, indent=rng.choice([None, 1]))
+        assert _parse(tmp_path, text, chunk_size) == json.loads(text)
+
+
+def test_prefetch_does_not_block_the_event_loop():
+
+    def slow_source():
+        for i in range(5):
+            time.sleep(0.05)
+            yield i
+
+    async def consume():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        items = [item async for item in PrefetchIterator(slow_source(), 2)]
+        ticker.cancel()
+        return items, ticks
+
+    items, ticks = asyncio.run(consume())
+    assert items == list(range(5))
+    # The loop kept running for most of the 0.25 s the source took.
+    assert ticks >= 10
+
+
+def test_prefetch_reraises_source_errors_async():
+
+    def failing_source():
+        yield 1
+        raise ValueError("broken")
+
+    async def consume():
+        return [item async for item in PrefetchIterator(failing_source(), 2)]
+
+    with pytest.raises(ValueError, match="broken"):
+        asyncio.run(consume())
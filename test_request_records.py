@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: Apache-2.0
+from backend_request_func import RequestFuncOutput
+from request_records import RequestRecords
+
+
+def _trt_output(num_chunks: int) -> RequestFuncOutput:
+    # Like async_request_trt_llm: one token per chunk, and no usage count.
+    output = RequestFuncOutput(num_chunks)
+    output.ttft = 0.1
+    for _ in range(num_chunks - 1):
+        output.add_itl(0.01)
+    output.generated_text = "x" * num_chunks
+    output.latency = 0.1 + 0.01 * (num_chunks - 1)
+    output.success = True
+    return output
+
+
+def test_output_without_usage_counts_one_token_per_chunk():
+    records = RequestRecords(2, keep_text=False)
+    records.record(0, _trt_output(7))
+    records.record(1, _trt_output(1))
+    assert records.output_tokens.tolist() == [7, 1]
+
+
+def test_output_without_usage_is_left_for_the_tokenizer():
+    records = RequestRecords(1, keep_text=True)
+    records.record(0, _trt_output(7))
+    assert records.output_tokens.tolist() == [-1]
+    assert records.generated_texts[0] == "x" * 7
+
+
+def test_reported_usage_is_kept():
+    output = _trt_output(7)
+    output.output_tokens = 9
+    records = RequestRecords(1, keep_text=False)
+    records.record(0, output)
+    assert records.output_tokens.tolist() == [9]
@@ -0,0 +1,41 @@
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from server_metrics import ServerMetricsScraper
+
+# Two data-parallel engines.
+EXPOSITION = """\
+# TYPE vllm:num_requests_running gauge
+vllm:num_requests_running{engine="0"} 3.0
+vllm:num_requests_running{engine="1"} 5.0
+# TYPE vllm:kv_cache_usage_perc gauge
+vllm:kv_cache_usage_perc{engine="0"} 0.75
+vllm:kv_cache_usage_perc{engine="1"} 0.25
+# TYPE vllm:num_preemptions_total counter
+vllm:num_preemptions_total{engine="0"} 2.0
+vllm:num_preemptions_total{engine="1"} 4.0
+"""
+
+
+def test_engines_are_summed_for_counts_and_averaged_for_ratios():
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=EXPOSITION)
+
+    async def scrape() -> ServerMetricsScraper:
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        async with TestServer(app) as server:
+            scraper = ServerMetricsScraper(str(server.make_url("/metrics")))
+            async with aiohttp.ClientSession() as session:
+                await scraper.scrape(session)
+        return scraper
+
+    scraper = asyncio.run(scrape())
+    assert scraper.values["num_requests_running"] == [8.0]
+    assert scraper.values["kv_cache_usage"] == [0.5]
+    assert scraper.values["num_preemptions"] == [6.0]